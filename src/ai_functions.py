@@ -1,7 +1,9 @@
+import asyncio
 import json
 import os
+import re
 from openai import AsyncOpenAI
-from typing import List, Dict
+from typing import Any, Iterable, List, Dict, Optional
 from models import (
     ContractParties,
     Contract,
@@ -10,20 +12,141 @@ from models import (
     AgentAction,
     ContractDetails,
     ContractParty,
+    SectionedContract,
+)
+from config import (
+    API_KEY, TEMPLATES_FOLDER, MAX_PROMPT_TOKENS_PER_CALL, TOKEN_POLICY_EXTRACT_PII, TOKEN_POLICY_CONSTRUCT, CONTRACT_SECTION_CACHE,
+    CONTRACT_SECTION_CACHE_TTL_DAYS,
+    PII_CHUNK_TOKENS, PII_CHUNK_OVERLAP_TOKENS, PII_CHUNK_CONCURRENCY,
 )
-from config import API_KEY, TEMPLATES_FOLDER
 from prompts import PII_EXTRACTION_PROMPT, PARTY_IDENTIFICATION_PROMPT, CONTRACT_CONSTRUCTION_PROMPT, SYSTEM_PROMPT
 from validators import ContractRoleValidator
 from role_options import get_role_options
-from openai_client import client
+from openai_client import router
+from tracing import span
+from token_budget import budget_text, count_message_tokens, count_tokens, guard_messages, page_chunks
+from contract_classifier import classify_contract, template_contract_type
+from id_parser import parse_id_document
+from entity_resolution import normalize_name, resolve
+from contract_sections import PARTIES, ADDRESS, INFO_PREFIX, SectionCache, build_contract, has_party_placeholder
+
+
+
+
+# Marks where the (possibly split) template goes in the construction prompt
+TEMPLATE_SLOT = "<<TEMPLATE>>"
+
+# Template placeholders such as {guest_name} that a finished contract must not contain
+UNFILLED_PLACEHOLDER = re.compile(r"\{[a-z_]+\}")
 
+def _check_pii(text: str):
+    """Local checks on extracted PII; a failure sends the chunk to the stronger model."""
+    def check(result: List[PIIData]):
+        if not result and len(text.strip()) > 50:
+            return "no_pii_found"
+        for pii in result:
+            if len(pii.name.strip()) <= 3 or len(pii.address.strip()) <= 5 or any(c.isdigit() for c in pii.name):
+                return "implausible_pii"
+        return None
+    return check
 
+def _check_contract_details(result: ContractDetails):
+    if result.contract_type.lower() not in ContractRoleValidator.valid_types:
+        return "unknown_contract_type"
+    return None
 
+def _names_party(content_words: List[str], name: str) -> bool:
+    """Every word of the name starts a word of the content, ignoring case, diacritics and inflection (POPESCULUI)."""
+    return all(any(word.startswith(part) for word in content_words) for part in normalize_name(name).split())
+
+def _check_section(section_template: str, inputs: Dict[str, Any]):
+    """Local checks on one generated section; a section with a placeholder for a party's name names at least one party."""
+    names = [party["name"] for party in inputs.get(PARTIES, [])] if has_party_placeholder(section_template) else []
+    def check(result: Contract):
+        if not result.content.strip():
+            return "empty_section"
+        if UNFILLED_PLACEHOLDER.search(result.content):
+            return "unfilled_placeholders"
+        content_words = normalize_name(result.content).split()
+        if names and not any(_names_party(content_words, name) for name in names):
+            return "missing_party"
+        return None
+    return check
+
+def _check_agent_action(result: AgentAction):
+    if not result.action.strip() or len(result.reason) <= 10:
+        return "incomplete_action"
+    return None
 
 async def extract_pii(text: str) -> List[PIIData]:
-    """Extract personally identifiable information from text."""
-    return await client.chat.completions.create(
-        model="gpt-4o-mini",
+    """
+    Extract personally identifiable information from text.
+
+    ID cards whose MRZ or labelled fields parse confidently are handled without a model call.
+    Long documents are split into overlapping page chunks that are extracted concurrently
+    (map) and merged (reduce); other text goes to the model in one request, chunked only
+    if it exceeds the token budget.
+    """
+    with span("extract_pii.id_parser", chars=len(text)) as current:
+        parsed = parse_id_document(text)
+        current.attributes["matched"] = parsed is not None
+    if parsed:
+        return [parsed]
+    route = router.route("extract_pii")
+    if count_tokens(text, route) > PII_CHUNK_TOKENS:
+        return await extract_pii_chunked(page_chunks(text, PII_CHUNK_TOKENS, route, overlap=PII_CHUNK_OVERLAP_TOKENS))
+    return await _extract_pii_model(text)
+
+async def extract_pii_chunked(chunks: Iterable[str], max_in_flight: int = PII_CHUNK_CONCURRENCY) -> List[PIIData]:
+    """
+    Extract PII from chunks of one document with at most `max_in_flight` requests at a time.
+
+    Chunks are taken from the iterable only when a slot frees up, so a lazy iterable
+    (see token_budget.page_chunks) never has more than `max_in_flight` chunks in memory.
+    """
+    results: List[List[PIIData]] = []
+    in_flight = set()
+    count = 0
+    with span("extract_pii.chunked", max_in_flight=max_in_flight) as current:
+        try:
+            for chunk in chunks:
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    results.extend(task.result() for task in done)
+                in_flight.add(asyncio.create_task(_extract_pii_model(chunk)))
+                count += 1
+            if in_flight:
+                results.extend(await asyncio.gather(*in_flight))
+        except BaseException:
+            for task in in_flight:
+                task.cancel()
+            raise
+        current.attributes["chunks"] = count
+    return merge_pii(p for result in results for p in result)
+
+def merge_pii(records: Iterable[PIIData]) -> List[PIIData]:
+    """Merge the same person found in several chunks (overlaps, repeated mentions) into one record."""
+    records = list(records)
+    if len(records) < 2:
+        return records
+    return [PIIData(name=party.name, address=party.address) for party in resolve([("", pii) for pii in records])]
+
+async def _extract_pii_model(text: str) -> List[PIIData]:
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"{PII_EXTRACTION_PROMPT}\n\n"}
+    ]
+    route = router.route("extract_pii")
+    overhead = count_message_tokens(messages, route)
+    chunks = budget_text(text, overhead, route, max_prompt_tokens=MAX_PROMPT_TOKENS_PER_CALL, policy=TOKEN_POLICY_EXTRACT_PII)
+    with span("extract_pii", chars=len(text), chunks=len(chunks)):
+        results = await asyncio.gather(*(_extract_pii_request(chunk) for chunk in chunks))
+    return merge_pii(p for result in results for p in result)
+
+async def _extract_pii_request(text: str) -> List[PIIData]:
+    return await router.create(
+        "extract_pii",
+        validator=_check_pii(text),
         response_model=List[PIIData],
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
@@ -31,15 +154,20 @@ async def extract_pii(text: str) -> List[PIIData]:
         ]
     )
 
-async def determine_contract_type(pii_data: List[PIIData], available_templates: List[str]) -> str:
-    """Determine contract type based on available templates."""
+async def determine_contract_type(pii_data: List[PIIData], available_templates: List[str], document_text: Optional[str] = None, templates: Optional[Dict[str, Dict]] = None) -> str:
+    """Determine contract type from the document text, falling back to a manual choice when ambiguous."""
+    if document_text and templates:
+        result = classify_contract(document_text, templates)
+        if result.is_confident:
+            return ContractRoleValidator.validate_contract_type(result.contract_type)
+
     templates_text = "\n".join([f"{i+1}. {template}" for i, template in enumerate(available_templates)])
     while True:
         try:
             selection = input(f"Please select a contract type from the following available templates:\n{templates_text}\nSelect (1-{len(available_templates)}): ").strip()
             selected_index = int(selection) - 1
             if 0 <= selected_index < len(available_templates):
-                contract_type = available_templates[selected_index]
+                contract_type = template_contract_type(available_templates[selected_index])
                 return ContractRoleValidator.validate_contract_type(contract_type)
             else:
                 print("Invalid choice. Please select a valid number.")
@@ -74,15 +202,85 @@ async def identify_parties(pii_data: List[PIIData], contract_type: str) -> Contr
 async def determine_contract_details(parties: ContractParties, contract_type: str) -> ContractDetails:
     """Determine contract details based on contract type."""
     parties_info = ", ".join([f"{party.name} ({', '.join(party.roles)})" for party in parties.parties])
-    return await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
+    return await router.create(
+        "contract_details",
+        validator=_check_contract_details,
+        messages=guard_messages([
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": f"Determine contract details for a contract of type {contract_type} with the following parties:\n\n{parties_info}"}
-        ],
+        ], router.route("contract_details"), max_prompt_tokens=MAX_PROMPT_TOKENS_PER_CALL),
         response_model=ContractDetails
     )
 
+_section_cache: Optional[SectionCache] = None
+
+def _get_section_cache() -> Optional[SectionCache]:
+    global _section_cache
+    if _section_cache is None and CONTRACT_SECTION_CACHE:
+        _section_cache = SectionCache(CONTRACT_SECTION_CACHE, CONTRACT_SECTION_CACHE_TTL_DAYS * 86400)
+    return _section_cache
+
+async def construct_contract_section(contract_type: str, title: str, section_template: str, inputs: Dict[str, Any]) -> str:
+    """Fill in one section of a template, given only the inputs that section uses."""
+    parties_info = ", ".join(f"{party['name']} ({', '.join(party['roles'])})" for party in inputs.get(PARTIES, []))
+    additional_info = {key[len(INFO_PREFIX):]: value for key, value in inputs.items() if key.startswith(INFO_PREFIX)}
+    role_reminder = "Remember to use the exact roles provided (e.g., 'Owner' and 'Renter' for Airbnb contracts, not 'Landlord' and 'Tenant')."
+    section_note = f"Fill in only the section '{title}' of the contract. Return just that section, keeping its heading."
+
+    prompt = f"{CONTRACT_CONSTRUCTION_PROMPT}\n\nContract Type: {contract_type}\nTemplate:\n{TEMPLATE_SLOT}\n"
+    if PARTIES in inputs:
+        prompt += f"Parties: {parties_info}\n"
+    if ADDRESS in inputs:
+        prompt += f"Address: {inputs[ADDRESS]}\n"
+    if additional_info:
+        prompt += f"Additional Information: {additional_info}\n"
+    prompt += f"\n{section_note}\n{role_reminder}"
+    route = router.route("construct_contract")
+    overhead = count_message_tokens([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ], route)
+    # Truncated or rejected when too long, never chunked: each section is generated in one piece
+    section_template = budget_text(section_template, overhead, route, max_prompt_tokens=MAX_PROMPT_TOKENS_PER_CALL, policy=TOKEN_POLICY_CONSTRUCT, overlap=0)[0]
+
+    with span("construct_contract.section", section=title):
+        result = await router.create(
+            "construct_contract",
+            validator=_check_section(section_template, inputs),
+            response_model=Contract,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt.replace(TEMPLATE_SLOT, section_template)}
+            ]
+        )
+    return result.content.strip()
+
+async def construct_contract_sections(
+    contract_type: str,
+    parties: ContractParties,
+    address: str,
+    additional_info: Dict[str, str],
+    template: str,
+    previous: Optional[SectionedContract] = None
+) -> SectionedContract:
+    """
+    Construct a contract section by section.
+
+    Sections whose inputs are unchanged since `previous` (or found in the section cache)
+    are reused, so editing one field regenerates only the sections that use it.
+    """
+    async def generate(title: str, section_template: str, inputs: Dict[str, Any]) -> str:
+        return await construct_contract_section(contract_type, title, section_template, inputs)
+
+    with span("construct_contract", contract_type=contract_type, template_chars=len(template)) as current:
+        sections = await build_contract(
+            contract_type, parties, address, additional_info, template,
+            generate, previous=previous, cache=_get_section_cache()
+        )
+        current.attributes["sections"] = len(sections.sections)
+        current.attributes["regenerated"] = len(sections.regenerated)
+    return sections
+
 async def construct_contract(
     contract_type: str,
     parties: ContractParties,
@@ -91,18 +289,8 @@ async def construct_contract(
     template: str
 ) -> Contract:
     """Construct a contract based on the provided information and template."""
-    parties_info = ", ".join([f"{party.name} ({', '.join(party.roles)})" for party in parties.parties])
-    object_description = additional_info.get('object_description', '[To be determined]')
-    role_reminder = "Remember to use the exact roles provided (e.g., 'Owner' and 'Renter' for Airbnb contracts, not 'Landlord' and 'Tenant')."
-    
-    return await client.chat.completions.create(
-        model="gpt-4o-mini",
-        response_model=Contract,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": f"{CONTRACT_CONSTRUCTION_PROMPT}\n\nContract Type: {contract_type}\nTemplate:\n{template}\nParties: {parties_info}\nAddress: {address}\nAdditional Information: {additional_info}\nObject Description: {object_description}\n\n{role_reminder}"}
-        ]
-    )
+    sections = await construct_contract_sections(contract_type, parties, address, additional_info, template)
+    return Contract(content=sections.text())
 
 async def agent_action(state: AgentState, templates: Dict[str, Dict[str, str]]) -> AgentAction:
     """Determine the next action for the agent."""
@@ -115,12 +303,13 @@ async def agent_action(state: AgentState, templates: Dict[str, Dict[str, str]])
     Available Templates: {', '.join(templates.keys())}
     """
     
-    return await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
+    return await router.create(
+        "agent_action",
+        validator=_check_agent_action,
+        messages=guard_messages([
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": f"Determine the next action based on the current state:\n\n{state_summary}"}
-        ],
+        ], router.route("agent_action"), max_prompt_tokens=MAX_PROMPT_TOKENS_PER_CALL),
         tools=[{"type": "function", "function": {"name": "agent_action", "parameters": AgentAction.model_json_schema()}}],
         tool_choice={"type": "function", "function": {"name": "agent_action"}},
         response_model=AgentAction
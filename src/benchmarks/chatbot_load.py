@@ -0,0 +1,248 @@
+"""
+Load generator for the chatbot assistants.
+
+Drives N simulated conversations through the workflow stages (contract type,
+ID documents, phone numbers, finalize) against the fake model server, ramping
+concurrency level by level. Reports throughput, per-turn latency percentiles,
+event-loop lag and memory per live session.
+
+    rye run python src/benchmarks/chatbot_load.py --assistant instructor --levels 1,10,50,100
+"""
+import argparse
+import asyncio
+import gc
+import importlib.util
+import json
+import logging
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, Tuple
+
+from fake_openai_server import FakeOpenAIServer, FakeServerConfig
+from stats import percentile, summarize
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+CHATBOT_DIR = SRC_DIR / "chatbot"
+
+
+def synthetic_png(seed: int, size: int = 32) -> bytes:
+    """Small, valid grayscale PNG with seeded noise, so every simulated upload is a distinct image."""
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + bytes(rng.randrange(256) for _ in range(size)) for _ in range(size))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def load_module(name: str, path: Path) -> ModuleType:
+    """Import a chatbot module by path with its own folder first on sys.path (they use flat imports)."""
+    sys.path.insert(0, str(path.parent))
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        sys.path.remove(str(path.parent))
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # ru_maxrss is a high-water mark in KiB on Linux; good enough as a fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up a periodic sleeper."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> Dict[str, float]:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return {
+            "p50_ms": round(percentile(self.samples, 50) * 1000, 3),
+            "p99_ms": round(percentile(self.samples, 99) * 1000, 3),
+            "max_ms": round(max(self.samples, default=0.0) * 1000, 3),
+        }
+
+
+def conversation_script(upload_dir: str, index: int) -> List[Tuple[str, str, Any]]:
+    """Turns of one conversation: (stage, user message, data a correct extraction would yield)."""
+    images = []
+    for offset, side in enumerate(("front", "back")):
+        path = os.path.join(upload_dir, f"session{index}_{side}.png")
+        with open(path, "wb") as f:
+            f.write(synthetic_png(index * 2 + offset))
+        images.append(path)
+    return [
+        ("init", "I need a buy-sell contract for my apartment.", "buy-sell"),
+        ("get_contract", f"Here are the ID cards: {', '.join(images)}", images),
+        ("attach_id", "Both IDs belong to the seller and the buyer.", ["POPESCU ION", "IONESCU MARIA"]),
+        ("get_phone", "Phone numbers: 0722 123 456 and +40 733 987 654", ["0722123456", "+40733987654"]),
+        ("complete", "Please finalize the contract.", "finalize"),
+    ]
+
+
+class InstructorSession:
+    """One conversation with chatbot/assistant.ContractAssistant."""
+
+    def __init__(self, module: ModuleType, upload_dir: str, index: int):
+        self.assistant = module.ContractAssistant(os.environ["OPENAI_API_KEY"])
+        self.script = conversation_script(upload_dir, index)
+
+    async def turn(self, stage: str, message: str, data: Any) -> None:
+        await self.assistant.process_message(message)
+        # The stage handlers expect typed payloads that the fake model cannot infer from free text,
+        # so apply what a correct extraction would have produced when the turn did not advance the stage
+        if self.assistant.state.step == stage:
+            handler = self.assistant.workflow_stages.get(stage)
+            if handler:
+                await handler(data)
+
+    async def close(self) -> None:
+        pass
+
+
+class BetaSession:
+    """One conversation with openai_assistant.ContractAssistant (Assistants API)."""
+
+    def __init__(self, module: ModuleType, upload_dir: str, index: int):
+        self.assistant = module.ContractAssistant(os.environ["OPENAI_API_KEY"])
+        self.script = conversation_script(upload_dir, index)
+
+    async def turn(self, stage: str, message: str, data: Any) -> None:
+        await self.assistant.process_message(message)
+
+    async def close(self) -> None:
+        await self.assistant.cleanup()
+
+
+async def run_level(session_factory, concurrency: int, conversations: int) -> Dict[str, Any]:
+    """Run `conversations` conversations with at most `concurrency` sessions alive at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+    turn_latencies: List[float] = []
+    conversation_latencies: List[float] = []
+    errors = 0
+    live_sessions = []
+    peak_rss = 0
+
+    async def converse(index: int) -> None:
+        nonlocal errors, peak_rss
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                session = session_factory(index)
+                live_sessions.append(session)
+                for stage, message, data in session.script:
+                    turn_start = time.perf_counter()
+                    await session.turn(stage, message, data)
+                    turn_latencies.append(time.perf_counter() - turn_start)
+                peak_rss = max(peak_rss, rss_bytes())
+                conversation_latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                logging.warning(f"Conversation {index} failed: {e}")
+
+    gc.collect()
+    rss_before = rss_bytes()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(converse(i) for i in range(conversations)))
+    wall_time = time.perf_counter() - start
+    loop_lag = await monitor.stop()
+    sessions_alive = len(live_sessions)
+    await asyncio.gather(*(s.close() for s in live_sessions), return_exceptions=True)
+    live_sessions.clear()
+
+    return {
+        "concurrency": concurrency,
+        "conversations": conversations,
+        "conversations_per_s": round(len(conversation_latencies) / wall_time, 3) if wall_time else 0.0,
+        "turns": summarize(turn_latencies, wall_time, errors),
+        "event_loop_lag": loop_lag,
+        "memory_per_session_kib": round((peak_rss - rss_before) / max(sessions_alive, 1) / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the chatbot assistants against a fake model server.")
+    parser.add_argument("--assistant", choices=["instructor", "beta"], default="instructor")
+    parser.add_argument("--levels", default="1,5,10,25,50", help="Comma-separated concurrency levels to ramp through")
+    parser.add_argument("--conversations-per-level", type=int, default=0, help="Default: 2x the concurrency level")
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--output", default=None, help="Result file (default: benchmark_results/chatbot_<timestamp>.json)")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(FakeServerConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=0)).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.assistant == "instructor":
+        module = load_module("chatbot_assistant", CHATBOT_DIR / "assistant.py")
+        session_class = InstructorSession
+    else:
+        module = load_module("openai_assistant", CHATBOT_DIR / "openai_assistant" / "assistant.py")
+        session_class = BetaSession
+
+    output = Path(args.output or Path("benchmark_results") / f"chatbot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="chatbot-load-") as upload_dir:
+        for level in levels:
+            conversations = args.conversations_per_level or level * 2
+            result = asyncio.run(run_level(lambda i: session_class(module, upload_dir, i), level, conversations))
+            results.append(result)
+            turns = result["turns"]
+            print(
+                f"concurrency {level:>4}: {turns['throughput_per_s']:>8} turns/s  "
+                f"p50 {turns['p50_ms']:>9} ms  p95 {turns['p95_ms']:>9} ms  p99 {turns['p99_ms']:>9} ms  "
+                f"loop lag p99 {result['event_loop_lag']['p99_ms']:>8} ms  "
+                f"{result['memory_per_session_kib']:>8} KiB/session  errors {turns['errors']}"
+            )
+    server.stop()
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": datetime.now().isoformat(), "parameters": vars(args), "levels": results}, f, indent=2)
+    print(f"Results saved to: {output}")
+
+
+if __name__ == "__main__":
+    main()
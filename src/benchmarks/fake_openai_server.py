@@ -0,0 +1,437 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Answers tool calls and JSON-schema requests with values synthesized from the
+request schema, so instructor can parse them into the project's pydantic models.
+Latency, streaming and 429 injection are configurable. A minimal in-memory
+Assistants API (assistants, threads, messages, runs) backs the beta chatbot.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+SAMPLE_NAMES = ["POPESCU ION", "IONESCU MARIA", "GEORGESCU ANDREI", "DUMITRU ELENA"]
+SAMPLE_ADDRESS = "Str. Lalelelor nr. 10, Bl. A, Ap. 5, Sector 3, Bucuresti"
+
+
+class FakeServerConfig:
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 50.0,
+        stream_chunk_delay_ms: float = 5.0,
+        rate_limit_probability: float = 0.0,
+        retry_after_seconds: float = 1.0,
+        contract_chars: int = 4000,
+        requests_per_minute: int = 5000,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.stream_chunk_delay_ms = stream_chunk_delay_ms
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after_seconds = retry_after_seconds
+        self.contract_chars = contract_chars
+        self.requests_per_minute = requests_per_minute
+        self.random = random.Random(seed)
+
+
+def _resolve(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    while "$ref" in schema:
+        path = schema["$ref"].lstrip("#/").split("/")
+        node = root
+        for part in path:
+            node = node[part]
+        schema = node
+    return schema
+
+
+def synthesize(schema: Dict[str, Any], root: Dict[str, Any], field: str, config: FakeServerConfig, index: int = 0) -> Any:
+    """Build a value that satisfies a JSON schema, using the field name to pick realistic content."""
+    schema = _resolve(schema, root)
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            options = [s for s in schema[key] if _resolve(s, root).get("type") != "null"]
+            return synthesize((options or schema[key])[0], root, field, config, index)
+
+    kind = schema.get("type", "string")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "string")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        if not properties and schema.get("additionalProperties"):
+            return {}
+        return {name: synthesize(sub, root, name, config, index) for name, sub in properties.items()}
+    if kind == "array":
+        count = 1 if field in ("roles",) else 2
+        return [synthesize(schema.get("items", {}), root, field, config, i) for i in range(count)]
+    if kind == "boolean":
+        return True
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+
+    lowered = field.lower()
+    if "name" in lowered:
+        return SAMPLE_NAMES[index % len(SAMPLE_NAMES)]
+    if "address" in lowered:
+        return SAMPLE_ADDRESS
+    if lowered == "content":
+        paragraph = "The parties agree to the terms set out in this contract. "
+        return (paragraph * (config.contract_chars // len(paragraph) + 1))[:config.contract_chars]
+    if "role" in lowered:
+        return "Buyer"
+    if "contract_type" in lowered:
+        return "buy-sell"
+    if "message" in lowered:
+        return "Thank you, please continue."
+    if "reason" in lowered:
+        return "The collected information is sufficient for the next step."
+    return "synthetic value"
+
+
+def build_completion(body: Dict[str, Any], config: FakeServerConfig) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Return the assistant message and, for tool calls, the tool call payload."""
+    tools = body.get("tools") or []
+    if tools:
+        function = tools[0]["function"]
+        choice = body.get("tool_choice")
+        if isinstance(choice, dict):
+            name = choice.get("function", {}).get("name", function["name"])
+            function = next((t["function"] for t in tools if t["function"]["name"] == name), function)
+        schema = function.get("parameters", {})
+        arguments = json.dumps(synthesize(schema, schema, function["name"], config))
+        tool_call = {
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {"name": function["name"], "arguments": arguments},
+        }
+        return {"role": "assistant", "content": None, "tool_calls": [tool_call]}, tool_call
+
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        return {"role": "assistant", "content": json.dumps(synthesize(schema, schema, "", config))}, None
+    return {"role": "assistant", "content": "This is a synthetic response from the fake model server."}, None
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self) -> FakeServerConfig:
+        return self.server.config
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _rate_limit_headers(self) -> Dict[str, str]:
+        remaining = max(0, self.config.requests_per_minute - self.server.requests_in_window())
+        return {
+            "x-ratelimit-limit-requests": str(self.config.requests_per_minute),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": "60s",
+        }
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in {**self._rate_limit_headers(), **(headers or {})}.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sleep_latency(self) -> None:
+        time.sleep(self._run_delay())
+
+    def _not_found(self) -> None:
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _path_parts(self) -> list:
+        path = self.path.split("?")[0].strip("/").split("/")
+        return path[1:] if path and path[0] == "v1" else path
+
+    def do_POST(self) -> None:
+        self.server.record_request()
+        body = self._read_json()
+        parts = self._path_parts()
+        if parts == ["chat", "completions"]:
+            self._handle_chat_completion(body)
+        elif parts == ["assistants"]:
+            self._send_json(200, self.server.assistants.create_assistant(body))
+        elif parts == ["threads"]:
+            self._send_json(200, self.server.assistants.create_thread())
+        elif len(parts) == 3 and parts[0] == "threads" and parts[2] == "messages":
+            self._send_json(200, self.server.assistants.add_message(parts[1], "user", body.get("content", "")))
+        elif len(parts) == 3 and parts[0] == "threads" and parts[2] == "runs":
+            self._send_json(200, self.server.assistants.create_run(parts[1], body.get("assistant_id", ""), self._run_delay()))
+        else:
+            self._not_found()
+
+    def do_GET(self) -> None:
+        self.server.record_request()
+        parts = self._path_parts()
+        if len(parts) == 4 and parts[0] == "threads" and parts[2] == "runs":
+            self._send_json(200, self.server.assistants.retrieve_run(parts[1], parts[3]))
+        elif len(parts) == 3 and parts[0] == "threads" and parts[2] == "messages":
+            self._send_json(200, self.server.assistants.list_messages(parts[1]))
+        else:
+            self._not_found()
+
+    def do_DELETE(self) -> None:
+        parts = self._path_parts()
+        if len(parts) == 2 and parts[0] in ("threads", "assistants"):
+            self._send_json(200, {"id": parts[1], "object": f"{parts[0][:-1]}.deleted", "deleted": True})
+        else:
+            self._not_found()
+
+    def _run_delay(self) -> float:
+        delay = self.config.latency_ms + self.config.random.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+        return max(0.0, delay) / 1000
+
+    def _handle_chat_completion(self, body: Dict[str, Any]) -> None:
+        if self.config.random.random() < self.config.rate_limit_probability:
+            self.server.record_rate_limited()
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (injected)", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after": str(self.config.retry_after_seconds), "x-ratelimit-remaining-requests": "0"},
+            )
+            return
+
+        self._sleep_latency()
+        message, tool_call = build_completion(body, self.config)
+        output_text = tool_call["function"]["arguments"] if tool_call else message["content"]
+        usage = {
+            "prompt_tokens": estimate_tokens(json.dumps(body.get("messages", []))),
+            "completion_tokens": estimate_tokens(output_text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "gpt-4o-mini")
+
+        if body.get("stream"):
+            self._stream(completion_id, model, message, tool_call, output_text, usage)
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id: str, model: str, message: Dict[str, Any], tool_call: Optional[Dict[str, Any]], output_text: str, usage: Dict[str, int]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        for key, value in self._rate_limit_headers().items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.close_connection = True
+
+        def emit(delta: Dict[str, Any], finish_reason: Optional[str] = None, extra: Optional[Dict[str, Any]] = None) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            chunk.update(extra or {})
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        emit({"role": "assistant", "content": None if tool_call else ""})
+        pieces = [output_text[i:i + 32] for i in range(0, len(output_text), 32)]
+        for i, piece in enumerate(pieces):
+            time.sleep(self.config.stream_chunk_delay_ms / 1000)
+            if tool_call:
+                function = {"arguments": piece}
+                call = {"index": 0, "function": function}
+                if i == 0:
+                    call.update(id=tool_call["id"], type="function")
+                    function["name"] = tool_call["function"]["name"]
+                emit({"tool_calls": [call]})
+            else:
+                emit({"content": piece})
+        emit({}, "tool_calls" if tool_call else "stop", {"usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class AssistantsStore:
+    """In-memory assistants, threads, messages and runs; runs complete after the configured latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.threads: Dict[str, list] = {}
+        self.runs: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _new_id(prefix: str) -> str:
+        return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+    def create_assistant(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": self._new_id("asst"), "object": "assistant", "created_at": int(time.time()),
+            "name": body.get("name"), "model": body.get("model", "gpt-4o-mini"),
+            "instructions": body.get("instructions"), "tools": [], "metadata": {},
+        }
+
+    def create_thread(self) -> Dict[str, Any]:
+        thread_id = self._new_id("thread")
+        with self._lock:
+            self.threads[thread_id] = []
+        return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    def add_message(self, thread_id: str, role: str, content: str) -> Dict[str, Any]:
+        message = {
+            "id": self._new_id("msg"), "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread_id, "role": role, "status": "completed", "attachments": [], "metadata": {},
+            "content": [{"type": "text", "text": {"value": content, "annotations": []}}],
+        }
+        with self._lock:
+            self.threads.setdefault(thread_id, []).append(message)
+        return message
+
+    def _run_payload(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": run["id"], "object": "thread.run", "created_at": int(run["created_at"]),
+            "thread_id": run["thread_id"], "assistant_id": run["assistant_id"], "status": run["status"],
+            "model": "gpt-4o-mini", "instructions": "", "tools": [], "metadata": {}, "last_error": None,
+            "parallel_tool_calls": True,
+        }
+
+    def create_run(self, thread_id: str, assistant_id: str, delay: float) -> Dict[str, Any]:
+        run = {
+            "id": self._new_id("run"), "thread_id": thread_id, "assistant_id": assistant_id,
+            "created_at": time.time(), "ready_at": time.time() + delay, "status": "queued",
+        }
+        with self._lock:
+            self.runs[run["id"]] = run
+        return self._run_payload(run)
+
+    def retrieve_run(self, thread_id: str, run_id: str) -> Dict[str, Any]:
+        with self._lock:
+            run = self.runs[run_id]
+            complete = run["status"] != "completed" and time.time() >= run["ready_at"]
+            if complete:
+                run["status"] = "completed"
+            elif run["status"] == "queued":
+                run["status"] = "in_progress"
+        if complete:
+            self.add_message(thread_id, "assistant", "Thank you, please continue.")
+        return self._run_payload(run)
+
+    def list_messages(self, thread_id: str) -> Dict[str, Any]:
+        with self._lock:
+            messages = list(reversed(self.threads.get(thread_id, [])))
+        return {"object": "list", "data": messages, "first_id": None, "last_id": None, "has_more": False}
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: FakeServerConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.config = config
+        self.assistants = AssistantsStore()
+        self.stats = {"requests": 0, "rate_limited": 0}
+        self._request_times = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.stats["requests"] += 1
+            self._request_times.append(time.time())
+
+    def record_rate_limited(self) -> None:
+        with self._lock:
+            self.stats["rate_limited"] += 1
+
+    def requests_in_window(self, window: float = 60.0) -> int:
+        cutoff = time.time() - window
+        with self._lock:
+            self._request_times = [t for t in self._request_times if t >= cutoff]
+            return len(self._request_times)
+
+    def handle_error(self, request: Any, client_address: Tuple[str, int]) -> None:
+        # Clients that give up on a request (timeouts, cancelled hedges) are expected, not server errors
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self) -> "FakeOpenAIServer":
+        """Serve in a background thread and return self."""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--stream-chunk-delay-ms", type=float, default=5.0)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        FakeServerConfig(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            stream_chunk_delay_ms=args.stream_chunk_delay_ms,
+            rate_limit_probability=args.rate_limit_probability,
+            retry_after_seconds=args.retry_after,
+        ),
+        args.host,
+        args.port,
+    )
+    print(f"Fake OpenAI server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Synthetic ID images, PDFs and templates for the offline benchmarks."""
+import os
+from typing import List
+
+ID_CARD_FIELDS = [
+    ("ROMANIA", "CARTE DE IDENTITATE"),
+    ("Nume/Nom/Last name", "{last}"),
+    ("Prenume/Prenom/First name", "{first}"),
+    ("Domiciliu/Adresse/Address", "Str. Lalelelor nr. {number}, Bl. A, Ap. 5, Sector 3, Bucuresti"),
+]
+
+PEOPLE = [("POPESCU", "ION"), ("IONESCU", "MARIA"), ("GEORGESCU", "ANDREI"), ("DUMITRU", "ELENA")]
+
+DEED_PARAGRAPH = (
+    "The undersigned {name}, residing at {address}, declares that the property described in this deed "
+    "is transferred under the conditions agreed between the parties and registered with the land book. "
+)
+
+
+def mrz_check_digit(field: str) -> str:
+    values = [int(c) if c.isdigit() else ord(c) - 55 if c.isalpha() else 0 for c in field]
+    return str(sum(v * (7, 3, 1)[i % 3] for i, v in enumerate(values)) % 10)
+
+
+def id_card_mrz(last: str, first: str, index: int = 0) -> List[str]:
+    """Both lines of a Romanian identity card MRZ (TD2) with valid check digits."""
+    number, birth, expiry, optional = f"RX{100000 + index:06d}<", f"{80 + index % 20:02d}0115", "320115", f"1{index:06d}"
+    line2 = (
+        f"{number}{mrz_check_digit(number)}ROU{birth}{mrz_check_digit(birth)}M"
+        f"{expiry}{mrz_check_digit(expiry)}{optional}"
+    )
+    composite = line2[0:10] + line2[13:20] + line2[21:35]
+    return [f"IDROU{last}<<{first}".ljust(36, "<"), line2 + mrz_check_digit(composite)]
+
+
+def create_id_image(path: str, index: int = 0) -> str:
+    """Render a fake ID card as a PNG."""
+    from PIL import Image, ImageDraw
+
+    last, first = PEOPLE[index % len(PEOPLE)]
+    image = Image.new("RGB", (1000, 630), "white")
+    draw = ImageDraw.Draw(image)
+    y = 40
+    for label, value in ID_CARD_FIELDS:
+        draw.text((40, y), label, fill="black")
+        draw.text((40, y + 22), value.format(last=last, first=first, number=10 + index), fill="black")
+        y += 70
+    for offset, line in enumerate(id_card_mrz(last, first, index)):
+        draw.text((40, 520 + offset * 30), line, fill="black")
+    image.save(path)
+    return path
+
+
+def create_pdf(path: str, pages: int = 3, index: int = 0) -> str:
+    """Write a multi-page deed-like PDF with pymupdf."""
+    import fitz
+
+    last, first = PEOPLE[index % len(PEOPLE)]
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        text = DEED_PARAGRAPH.format(name=f"{last} {first}", address=f"Str. Lalelelor nr. {10 + index}, Bucuresti") * 8
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {page_number + 1}\n\n{text}", fontsize=10)
+    document.save(path)
+    document.close()
+    return path
+
+
+def create_text_document(path: str, index: int = 0) -> str:
+    last, first = PEOPLE[index % len(PEOPLE)]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Utility bill\nCustomer: {first} {last}\nAddress: Str. Lalelelor nr. {10 + index}, Bucuresti\n")
+    return path
+
+
+def create_template(path: str, sections: int = 12) -> str:
+    """Write a buy-sell template with the given number of numbered sections."""
+    lines = ["# contract_type: buy-sell", "Synthetic Buy-Sell Agreement", ""]
+    lines += ["1. Parties", "", "Seller: [Seller's Name], residing at [Seller's Address].",
+              "Buyer: [Buyer's Name], residing at [Buyer's Address].", ""]
+    for number in range(2, sections + 1):
+        lines += [f"{number}. Clause {number}", "",
+                  "The Buyer agrees to pay [amount] RON by [date] under the conditions of this clause. " * 3, ""]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return path
+
+
+def create_dataset(folder: str, images: int = 2, pdfs: int = 1, texts: int = 1, pdf_pages: int = 3) -> List[str]:
+    """Populate a data folder with synthetic documents and return their paths."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(images):
+        paths.append(create_id_image(os.path.join(folder, f"id_card_{i}.png"), i))
+    for i in range(pdfs):
+        paths.append(create_pdf(os.path.join(folder, f"deed_{i}.pdf"), pdf_pages, i))
+    for i in range(texts):
+        paths.append(create_text_document(os.path.join(folder, f"bill_{i}.txt"), i))
+    return paths
@@ -0,0 +1,169 @@
+"""
+Offline benchmark suite for the contract pipeline.
+
+Starts the fake model server, generates a synthetic dataset in a scratch folder
+and measures process_documents, extract_pii, construct_contract and the full
+agent_workflow. Results are written as JSON so runs can be compared.
+
+    rye run python src/benchmarks/run_benchmarks.py --iterations 20 --compare benchmark_results/baseline.json
+"""
+import argparse
+import asyncio
+import builtins
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_openai_server import FakeOpenAIServer, FakeServerConfig
+from fixtures import create_dataset, create_template
+from stats import compare, summarize
+
+
+def scripted_input(prompt: str = "") -> str:
+    """Answer the interactive prompts of agent_workflow without a human."""
+    prompt = prompt.lower()
+    if "(yes/no)" in prompt:
+        return "yes"
+    if "amount" in prompt:
+        return "1000"
+    if "date" in prompt:
+        return "01/01/2030"
+    if "description" in prompt:
+        return "Two-room apartment, 54 square meters, Bucharest"
+    if "press enter" in prompt:
+        return ""
+    return "1"
+
+
+async def measure(func: Callable[[], Awaitable[Any]], iterations: int, concurrency: int) -> Dict[str, float]:
+    """Run func `iterations` times with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def run_one() -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await func()
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                print(f"Benchmark call failed: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_one() for _ in range(iterations)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def run_suite(args: argparse.Namespace, workdir: str) -> Dict[str, Dict[str, float]]:
+    # Imported here so the environment points at the fake server before config loads
+    import ai_functions
+    import document_processing
+    import main
+    from models import ContractParties, ContractParty
+
+    sample_text = "Nume/Nom/Last name POPESCU Prenume/Prenom/First name ION Domiciliu Str. Lalelelor nr. 10, Bucuresti"
+    with open(create_template(os.path.join(workdir, "synthetic-buy-sell.txt"), args.template_sections)) as f:
+        template = f.read()
+    parties = ContractParties(parties=[
+        ContractParty(name="POPESCU ION", roles=["Seller"]),
+        ContractParty(name="IONESCU MARIA", roles=["Buyer"]),
+    ])
+
+    results = {}
+    results["process_documents"] = await measure(document_processing.process_documents, args.iterations, 1)
+    results["extract_pii"] = await measure(lambda: ai_functions.extract_pii(sample_text), args.iterations, args.concurrency)
+    results["construct_contract"] = await measure(
+        lambda: ai_functions.construct_contract("buy-sell", parties, "Str. Lalelelor nr. 10", {"advance": "1000"}, template),
+        args.iterations,
+        args.concurrency,
+    )
+
+    # agent_workflow prompts on stdin and prints progress, so script the answers and silence the output
+    original_input = builtins.input
+    builtins.input = scripted_input
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["agent_workflow"] = await measure(main.agent_workflow, args.workflow_iterations, 1)
+    finally:
+        builtins.input = original_input
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a local fake model server.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--workflow-iterations", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--images", type=int, default=2)
+    parser.add_argument("--pdfs", type=int, default=1)
+    parser.add_argument("--pdf-pages", type=int, default=3)
+    parser.add_argument("--template-sections", type=int, default=12)
+    parser.add_argument("--output", default=None, help="Result file (default: benchmark_results/<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Previous result file to compare against")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(FakeServerConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_limit_probability=args.rate_limit_probability,
+        seed=0,
+    )).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("TAVILY_API_KEY", "tvly-benchmark")
+
+    output = Path(args.output or Path("benchmark_results") / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json").resolve()
+    baseline = Path(args.compare).resolve() if args.compare else None
+    original_cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix="contract-bench-") as workdir:
+        create_dataset(os.path.join(workdir, "data"), args.images, args.pdfs, 1, args.pdf_pages)
+        os.chdir(workdir)
+        try:
+            results = asyncio.run(run_suite(args, workdir))
+        finally:
+            os.chdir(original_cwd)
+            server.stop()
+
+    from openai_client import limiter, router
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "parameters": vars(args),
+        "server": server.stats,
+        "model_routes": router.report(),
+        "concurrency": limiter.snapshot(),
+        "results": results,
+    }
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            report["change_pct"] = compare(json.load(f)["results"], results)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for name, metrics in results.items():
+        print(f"{name:20} {metrics['throughput_per_s']:>8} ops/s  p50 {metrics['p50_ms']:>9} ms  p95 {metrics['p95_ms']:>9} ms  p99 {metrics['p99_ms']:>9} ms")
+    for task, stats in report["model_routes"].items():
+        print(f"{task:20} escalation rate {stats['escalation_rate']:.1%}  served by {stats['served_by']}")
+    print(f"Results saved to: {output}")
+
+
+if __name__ == "__main__":
+    main()
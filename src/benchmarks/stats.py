@@ -0,0 +1,42 @@
+from typing import Dict, List
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of the samples (pct in 0-100)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies: List[float], wall_time: float, errors: int = 0) -> Dict[str, float]:
+    """Throughput and latency percentiles (in milliseconds) for one benchmark."""
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "wall_time_s": round(wall_time, 4),
+        "throughput_per_s": round(len(latencies) / wall_time, 3) if wall_time else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def compare(baseline: Dict[str, Dict[str, float]], current: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Relative change of each metric against a previous run (positive means larger)."""
+    changes = {}
+    for name, metrics in current.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            key: round((value - previous[key]) / previous[key] * 100, 2)
+            for key, value in metrics.items()
+            if key.endswith(("_ms", "_per_s")) and previous.get(key)
+        }
+    return changes
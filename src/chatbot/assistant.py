@@ -1,19 +1,49 @@
 from typing import Optional, Dict, List
 import logging
+import os
+import sys
 from pathlib import Path
 import instructor
 from openai import AsyncOpenAI
 from models import ContractState, ContractResponse, AgentAction
+from uploads import ImageUploadPipeline, UploadRejected, sweep_upload_dirs
+from validation import IdentityCheck, PhoneCheck, SessionValidators
 import asyncio
+import uuid
+
+# Shared pipeline helpers live in the parent src folder
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from token_budget import TRUNCATE, JobBudget, guard_messages
+from model_router import ModelRouter
+from tracing import span, start_trace
 
 logger = logging.getLogger(__name__)
 
+# Chat turns go to the fast model first and to the stronger one only when the reply is unusable
+CHAT_ROUTE = ["gpt-4o-mini", "gpt-4-turbo-preview"]
+# Prompt tokens allowed per chat turn; the conversation context is truncated beyond this
+MAX_TURN_PROMPT_TOKENS = 8_000
+# ID images are stored per session and deleted when it ends; dirs of sessions that never ended
+# (crashed or killed) are deleted once untouched for this many hours
+UPLOAD_ROOT = Path("uploads/id_images")
+UPLOAD_RETENTION_HOURS = float(os.getenv("UPLOAD_RETENTION_HOURS", "24"))
+
 class ContractAssistant:
     def __init__(self, api_key: str):
         self.client = instructor.patch(AsyncOpenAI(api_key=api_key))
+        self.router = ModelRouter(self.client, {"chat": CHAT_ROUTE})
         self.state = ContractState()
-        self.upload_dir = Path("uploads/id_images")
+        self.usage = JobBudget()
+        # Tags this conversation's spans (and profiles, with --profile chat_turn)
+        self.session_id = uuid.uuid4().hex
+        # One upload dir (and duplicate index) per session, so no session can be handed another's file
+        sweep_upload_dirs(UPLOAD_ROOT, UPLOAD_RETENTION_HOURS * 3600)
+        self.upload_dir = UPLOAD_ROOT / self.session_id
         self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self.uploads = ImageUploadPipeline(self.upload_dir)
+        self.validators = SessionValidators()
+        # Problems with the last input, shown to the model so it asks the user to correct them
+        self.validation_issues: List[str] = []
         
         # Define workflow stages
         self.workflow_stages = {
@@ -26,26 +56,46 @@ class ContractAssistant:
 
     async def process_message(self, message: str) -> str:
         """Process user message and execute workflow stage."""
+        start_trace(self.session_id)
         try:
-            # Get AI response and next action
-            response = await self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                response_model=ContractResponse,
-                messages=self._build_context(message)
-            )
+            with span("chat_turn", step=self.state.step):
+                # Get AI response and next action
+                messages = guard_messages(self._build_context(message), self.router.route("chat"), MAX_TURN_PROMPT_TOKENS, TRUNCATE)
+                response = await self.router.create(
+                    "chat",
+                    validator=self._check_response,
+                    response_model=ContractResponse,
+                    messages=messages
+                )
+                raw = getattr(response, "_raw_response", None)
+                self.usage.record(getattr(raw, "usage", None))
             
-            # Execute workflow stage if we have data
-            if response.extracted_data:
-                stage_handler = self.workflow_stages.get(self.state.step)
-                if stage_handler:
-                    await stage_handler(response.extracted_data)
+                # Execute workflow stage if we have data
+                if response.extracted_data:
+                    stage_handler = self.workflow_stages.get(self.state.step)
+                    if stage_handler:
+                        with span(f"chat.{self.state.step}"):
+                            await stage_handler(response.extracted_data)
             
-            return response.message
+                return response.message
             
         except Exception as e:
             logger.error(f"Error in workflow: {e}")
             raise
 
+    async def cleanup(self) -> None:
+        """End the session: delete its uploaded ID images."""
+        await self.uploads.remove()
+        logger.info(f"Deleted the uploads of session {self.session_id}")
+
+    def _check_response(self, response: ContractResponse) -> Optional[str]:
+        """Reject replies the workflow cannot use, so the turn is retried on the stronger model."""
+        if not response.message.strip():
+            return "empty_message"
+        if not response.next_action.action.strip():
+            return "missing_action"
+        return None
+
     async def _process_contract_type(self, data: str) -> None:
         """Process contract type selection."""
         if data in ["airbnb", "buy-sell", "it consulting"]:
@@ -54,59 +104,88 @@ class ContractAssistant:
             logger.info(f"Contract type set to: {data}")
 
     async def _process_documents(self, documents: List[str]) -> None:
-        """Process document uploads concurrently."""
-        tasks = [self.state.validate_image(doc) for doc in documents]
-        results = await asyncio.gather(*tasks)
-        
-        for document, valid in zip(documents, results):
-            if valid:
-                self.state.id_images.append(document)
-                logger.info(f"Document added: {document}")
+        """Stream document uploads into the upload dir concurrently, skipping duplicates."""
+        tasks = [self.uploads.save_file(doc) for doc in documents]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        added = {}
+
+        for document, result in zip(documents, results):
+            if isinstance(result, (UploadRejected, OSError)):
+                logger.warning(f"Document rejected: {document} ({result})")
+            elif isinstance(result, BaseException):
+                raise result
+            elif result.path in self.state.id_images:
+                logger.info(f"Document skipped, already attached as {result.path}: {document}")
+            else:
+                # Duplicates point at the stored original, so it is attached without being processed again
+                self.state.id_images.append(result.path)
+                added[result.path] = result.working_copy or result.path
+                logger.info(f"Document added: {document} -> {result.path}{' (reused)' if result.is_duplicate else ''}")
+        # Read the IDs while the conversation moves on; the identity stage then finds the results cached
+        self.validators.prefetch_ids(added)
 
         if len(self.state.id_images) >= 2:
             self.state.step = "attach_id"
             logger.info("Document processing complete. Moving to identity attachment stage.")
 
     async def _process_identities(self, identities: List[str]) -> None:
-        """Process identity information concurrently."""
+        """Check every named party against the attached IDs concurrently; advance only if all pass."""
+        if isinstance(identities, dict):
+            identities = list(identities.values())
         tasks = [self._validate_identity(identity) for identity in identities]
-        await asyncio.gather(*tasks)
-        self.state.step = "get_phone"
-        logger.info("Identity processing complete. Moving to contact information stage.")
-
-    async def _validate_identity(self, identity: str) -> None:
-        """Simulate identity validation."""
-        logger.info(f"Validating identity: {identity}")
-        await asyncio.sleep(1)
+        results = await asyncio.gather(*tasks)
+        self.validation_issues = [f"Identity '{check.name}': {check.reason}" for check in results if not check.valid]
+        # Accepted on format alone (no daemon, or no ID readable): carried through to the end of the flow
+        self.state.unverified_identities = [check.name for check in results if check.valid and not check.verified]
+        if results and not self.validation_issues:
+            self.state.step = "get_phone"
+            logger.info("Identity processing complete. Moving to contact information stage.")
+
+    async def _validate_identity(self, identity: str) -> IdentityCheck:
+        """Match a party's name against the holders read from the attached ID images."""
+        check = await self.validators.check_identity(identity, self.state.id_images)
+        # The name (and a reason quoting the names read from the IDs) is PII, kept out unless LOG_PAYLOADS is set
+        logger.info(
+            f"Identity checked: valid={check.valid} verified={check.verified}",
+            extra={"payload": {"name": check.name, "id_image": check.id_image, "reason": check.reason}},
+        )
+        return check
 
     async def _process_contact(self, contact_info: List[str]) -> None:
         """Process contact information."""
+        if isinstance(contact_info, dict):
+            contact_info = list(contact_info.values())
         tasks = [self._validate_contact_data(contact) for contact in contact_info]
         results = await asyncio.gather(*tasks)
 
-        for contact, valid in zip(contact_info, results):
-            if valid:
-                await self._store_contact_data(contact)
+        self.validation_issues = []
+        for check in results:
+            if check.valid:
+                if check.normalized not in self.state.phone_numbers:
+                    await self._store_contact_data(check.normalized)
+            else:
+                self.validation_issues.append(f"Phone '{check.raw}': {check.reason}")
 
         if len(self.state.phone_numbers) >= 1:
             self.state.step = "complete"
             logger.info("Contact processing complete. Ready to finalize.")
 
-    async def _validate_contact_data(self, contact: str) -> bool:
-        """Validate contact information."""
-        logger.info(f"Validating contact: {contact}")
-        await asyncio.sleep(1)
-        return True
+    async def _validate_contact_data(self, contact: str) -> PhoneCheck:
+        """Parse a phone number into E.164 form."""
+        return self.validators.check_phone(contact)
 
     async def _store_contact_data(self, contact: str) -> None:
         """Store valid contact information."""
         self.state.phone_numbers.append(contact)
-        logger.info(f"Contact added: {contact}")
+        logger.info("Contact added", extra={"payload": contact})
 
     async def _finalize_contract(self, data: str) -> None:
         """Finalize contract processing."""
         if self.state.is_complete():
-            logger.info("Contract processing complete.")
+            if self.state.unverified_identities:
+                logger.warning(f"Contract processing complete with {len(self.state.unverified_identities)} identities not verified against an ID")
+            else:
+                logger.info("Contract processing complete.")
 
     def _build_context(self, message: str) -> List[Dict[str, str]]:
         """Build message context for AI."""
@@ -136,14 +215,18 @@ class ContractAssistant:
 
         4. FINALIZATION
         - Verify all information is complete
+        - If the state lists unverified identities, tell the user they were not checked against the IDs and must be checked by hand
         - Confirm with user
 
         Respond naturally and guide the user step by step.
         Extract and validate provided information.
+        If the state lists problems to correct, explain them and ask for corrected information.
         """
 
     def _get_context(self) -> str:
         return f"""Current State:
 Contract: {self.state.details.contract_type or 'Undetermined'}
 Attached IDs: {len(self.state.id_images)}
-Collected Phones: {len(self.state.phone_numbers)}"""
\ No newline at end of file
+Collected Phones: {len(self.state.phone_numbers)}
+Identities not verified against an ID: {', '.join(self.state.unverified_identities) or 'None'}
+Problems to correct: {'; '.join(self.validation_issues) or 'None'}"""
\ No newline at end of file
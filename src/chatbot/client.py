@@ -1,5 +1,6 @@
 from typing import Optional
 from assistant import ContractAssistant
+from profiling import profile_from_command_line
 import asyncio
 import os
 from dotenv import load_dotenv
@@ -16,6 +17,8 @@ async def chat_with_assistant() -> None:
     assistant = None
     try:
         assistant = ContractAssistant(api_key)
+        if not assistant.validators.daemon_available():
+            print("Note: ID images are checked by the contract daemon (python src/daemon.py), which is not running; party names are only checked for format and marked unverified.")
         print("Chat started (type 'quit' to exit)")
         
         while True:
@@ -33,4 +36,5 @@ async def chat_with_assistant() -> None:
             await assistant.cleanup()
 
 if __name__ == "__main__":
+    profile_from_command_line("Chat with the contract assistant.")
     asyncio.run(chat_with_assistant())
\ No newline at end of file
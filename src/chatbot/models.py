@@ -3,6 +3,7 @@ from typing import Optional, List, Dict, Literal
 from pydantic import Field
 from openai import AsyncOpenAI
 from pathlib import Path
+from uploads import read_image_type
 
 class ContractParty(OpenAISchema):
     """Information about a contract party."""
@@ -44,13 +45,16 @@ class ContractState(OpenAISchema):
     current_party: Optional[ContractParty] = Field(None)
     id_images: List[str] = Field(default_factory=list)
     phone_numbers: List[str] = Field(default_factory=list)
+    unverified_identities: List[str] = Field(
+        default_factory=list, description="Names accepted without a match on an attached ID (no ID could be read)"
+    )
     
     async def validate_image(self, image_path: str) -> bool:
-        """Validate if file exists and is an image."""
+        """Validate if file exists and its header is a supported image format."""
         path = Path(image_path)
         return (
-            path.exists() and 
-            path.suffix.lower() in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']
+            path.suffix.lower() in ['.png', '.jpg', '.jpeg', '.gif', '.bmp'] and
+            read_image_type(str(path)) is not None
         )
 
     def is_complete(self) -> bool:
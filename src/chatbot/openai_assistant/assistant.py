@@ -6,6 +6,8 @@ from datetime import datetime, timedelta
 from functools import wraps
 from typing import Callable, Any
 import os
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 import logging
 
@@ -13,8 +15,11 @@ import logging
 load_dotenv()
 API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging through the shared non-blocking setup in the src folder
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from logging_setup import configure_logging
+from tracing import span
+configure_logging(level=logging.INFO, json_format=os.getenv('LOG_FORMAT') == 'json', log_payloads=os.getenv('LOG_PAYLOADS', '0') == '1')
 logger = logging.getLogger(__name__)
 
 # Rate limiting constants
@@ -85,49 +90,50 @@ class ContractAssistant:
     async def process_message(self, message: str) -> str:
         """Process user message with rate limiting and retry logic."""
         try:
-            # Add message to thread
-            self.client.beta.threads.messages.create(
-                thread_id=self.thread.id,
-                role="user",
-                content=message
-            )
+            with span("chat_turn", requests=self.request_count):
+                # Add message to thread
+                self.client.beta.threads.messages.create(
+                    thread_id=self.thread.id,
+                    role="user",
+                    content=message
+                )
 
-            # Create run with timeout
-            run = self.client.beta.threads.runs.create(
-                thread_id=self.thread.id,
-                assistant_id=self.assistant.id
-            )
+                # Create run with timeout
+                run = self.client.beta.threads.runs.create(
+                    thread_id=self.thread.id,
+                    assistant_id=self.assistant.id
+                )
 
-            # Wait for completion with timeout
-            timeout = 30  
-            start_time = datetime.now()
+                # Wait for completion with timeout
+                timeout = 30  
+                start_time = datetime.now()
             
-            while run.status not in ["completed", "failed"]:
-                if (datetime.now() - start_time).seconds > timeout:
-                    raise TimeoutError("Request timed out")
+                while run.status not in ["completed", "failed"]:
+                    if (datetime.now() - start_time).seconds > timeout:
+                        raise TimeoutError("Request timed out")
                 
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=self.thread.id,
-                    run_id=run.id
-                )
+                    run = self.client.beta.threads.runs.retrieve(
+                        thread_id=self.thread.id,
+                        run_id=run.id
+                    )
                 
-                if run.status == "failed":
-                    raise Exception(f"Assistant failed: {run.last_error}")
+                    if run.status == "failed":
+                        raise Exception(f"Assistant failed: {run.last_error}")
                     
-                await asyncio.sleep(0.5)
+                    await asyncio.sleep(0.5)
 
-            # Get latest message
-            messages = self.client.beta.threads.messages.list(
-                thread_id=self.thread.id,
-                order="desc",
-                limit=1
-            )
+                # Get latest message
+                messages = self.client.beta.threads.messages.list(
+                    thread_id=self.thread.id,
+                    order="desc",
+                    limit=1
+                )
 
-            # Update rate limiting counters
-            self.request_count += 1
-            self.last_request_time = datetime.now()
+                # Update rate limiting counters
+                self.request_count += 1
+                self.last_request_time = datetime.now()
 
-            return messages.data[0].content[0].text.value
+                return messages.data[0].content[0].text.value
 
         except TimeoutError as e:
             logger.error(f"Timeout error: {e}")
@@ -1,5 +1,6 @@
 from typing import Optional
 from assistant import ContractAssistant
+from profiling import profile_from_command_line
 import asyncio
 import os
 from dotenv import load_dotenv
@@ -33,4 +34,5 @@ async def chat_with_assistant() -> None:
             await assistant.cleanup()
 
 if __name__ == "__main__":
+    profile_from_command_line("Chat with the contract assistant.")
     asyncio.run(chat_with_assistant())
\ No newline at end of file
@@ -2,6 +2,7 @@ import asyncio
 import os
 from dotenv import load_dotenv
 from assistant import ContractAssistant
+from profiling import profile_from_command_line
 
 async def main():
     load_dotenv()
@@ -12,18 +13,24 @@ async def main():
         return
         
     assistant = ContractAssistant(api_key)
+    if not assistant.validators.daemon_available():
+        print("Note: ID images are checked by the contract daemon (python src/daemon.py), which is not running; party names are only checked for format and marked unverified.")
     print("🤖 Hello! How can I help you today?")
     
-    while True:
-        msg = input("\nYou: ")
-        if msg.lower() == 'quit':
-            break
-        if msg.lower() == 'workflow':
-            await assistant.process_workflow()
-            continue
-        response = await assistant.process_message(msg)
-        print(f"Assistant: {response}")
+    try:
+        while True:
+            msg = input("\nYou: ")
+            if msg.lower() == 'quit':
+                break
+            if msg.lower() == 'workflow':
+                await assistant.process_workflow()
+                continue
+            response = await assistant.process_message(msg)
+            print(f"Assistant: {response}")
+    finally:
+        await assistant.cleanup()
 
 if __name__ == "__main__":
+    profile_from_command_line("Chat with the contract assistant.")
     asyncio.run(main())
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+import aiofiles
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = 15 * 1024 * 1024
+WORKING_COPY_MAX_SIDE = 1600
+# Hamming distance (out of 64 bits) below which two images are logged as possibly the same photo.
+# Only a hint: ID cards share one layout, so different people's cards can hash alike
+PHASH_SIMILAR_DISTANCE = 6
+
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpeg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+    b"BM": "bmp",
+}
+
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "gif": ".gif", "bmp": ".bmp"}
+
+
+class UploadRejected(ValueError):
+    pass
+
+
+class UploadResult(BaseModel):
+    """A stored ID image, or a pointer to the earlier upload it duplicates."""
+    path: str = Field(..., description="Stored original")
+    working_copy: Optional[str] = Field(None, description="Downscaled copy used for OCR")
+    sha256: str
+    phash: Optional[str] = None
+    image_format: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duplicate_of: Optional[str] = Field(None, description="Stored path of the original when this upload is a duplicate")
+
+    @property
+    def is_duplicate(self) -> bool:
+        return self.duplicate_of is not None
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """Identify an image format from its first bytes without decoding it."""
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def read_image_type(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return sniff_image_type(f.read(16))
+    except OSError:
+        return None
+
+
+def _inspect_image(path: str, working_dir: Path, stem: str) -> Dict:
+    """Read dimensions from the header, compute a difference hash and write the OCR working copy."""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        width, height = image.size
+        # For JPEG, draft() lets the decoder skip most of the work by decoding at reduced scale
+        image.draft("L", (WORKING_COPY_MAX_SIDE, WORKING_COPY_MAX_SIDE))
+        image = ImageOps.exif_transpose(image)
+
+        small = image.convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = list(small.getdata())
+        bits = [pixels[row * 9 + col] > pixels[row * 9 + col + 1] for row in range(8) for col in range(8)]
+        phash = f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+        working_copy = None
+        if max(width, height) > WORKING_COPY_MAX_SIDE:
+            working_dir.mkdir(parents=True, exist_ok=True)
+            working_copy = str(working_dir / f"{stem}.png")
+            copy = image.convert("RGB")
+            copy.thumbnail((WORKING_COPY_MAX_SIDE, WORKING_COPY_MAX_SIDE))
+            copy.save(working_copy)
+    return {"width": width, "height": height, "phash": phash, "working_copy": working_copy}
+
+
+def sweep_upload_dirs(root: Path, max_age_seconds: float) -> int:
+    """
+    Delete session upload dirs under root untouched for max_age_seconds; they hold ID images (PII).
+
+    Catches sessions that ended without cleaning up (crash, killed process).
+    """
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    for session_dir in Path(root).glob("*/"):
+        try:
+            newest = max((p.stat().st_mtime for p in session_dir.rglob("*")), default=session_dir.stat().st_mtime)
+            if newest < cutoff:
+                shutil.rmtree(session_dir)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not sweep {session_dir}: {e}")
+    if removed:
+        logger.info(f"Deleted {removed} expired upload session dir(s) from {root}")
+    return removed
+
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class ImageUploadPipeline:
+    """
+    Stream ID image uploads to disk and store each distinct photo once.
+
+    Uploads are hashed while they are written, so exact re-uploads are detected
+    without re-reading the file. Only identical content counts as a duplicate;
+    near-identical photos (re-encoded, resized) are logged but stored as their own
+    file. The index is kept in index.json in the upload dir, so give each session
+    its own dir.
+    """
+
+    def __init__(self, upload_dir: Path, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.upload_dir = Path(upload_dir)
+        self.working_dir = self.upload_dir / "working"
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.index_path = self.upload_dir / "index.json"
+        self.index: Dict[str, Dict] = self._load_index()
+        self._lock = asyncio.Lock()
+
+    async def remove(self) -> None:
+        """Delete the upload dir with every stored image, e.g. when the session ends."""
+        async with self._lock:
+            await asyncio.to_thread(shutil.rmtree, self.upload_dir, True)
+            self.index = {}
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_dir, prefix=".index-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _find_similar(self, phash: str) -> Optional[Dict]:
+        for record in self.index.values():
+            if record.get("phash") and hamming_distance(record["phash"], phash) <= PHASH_SIMILAR_DISTANCE:
+                return record
+        return None
+
+    async def save_stream(self, chunks: AsyncIterator[bytes]) -> UploadResult:
+        """Write an upload chunk by chunk, validating the header before anything else is stored."""
+        fd, tmp_name = tempfile.mkstemp(dir=self.upload_dir, prefix=".upload-")
+        os.close(fd)
+        digest = hashlib.sha256()
+        image_format = None
+        size = 0
+        try:
+            async with aiofiles.open(tmp_name, "wb") as out:
+                async for chunk in chunks:
+                    if image_format is None:
+                        image_format = sniff_image_type(chunk[:16])
+                        if image_format is None:
+                            raise UploadRejected("File is not a PNG, JPEG, GIF or BMP image")
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadRejected(f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    await out.write(chunk)
+            if image_format is None:
+                raise UploadRejected("Upload is empty")
+            return await self._store(tmp_name, digest.hexdigest(), image_format)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+    async def save_file(self, source: str) -> UploadResult:
+        """Stream an existing local file (e.g. a path given in chat) into the upload dir."""
+        async def read_chunks() -> AsyncIterator[bytes]:
+            async with aiofiles.open(source, "rb") as f:
+                while True:
+                    chunk = await f.read(CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return await self.save_stream(read_chunks())
+
+    async def _store(self, tmp_name: str, sha256: str, image_format: str) -> UploadResult:
+        async with self._lock:
+            existing = self.index.get(sha256)
+            if existing:
+                logger.info(f"Duplicate upload of {existing['path']} (identical content)")
+                return UploadResult(**existing, duplicate_of=existing["path"])
+
+            stem = sha256[:16]
+            path = self.upload_dir / f"{stem}{EXTENSIONS[image_format]}"
+            os.replace(tmp_name, path)
+            try:
+                details = await asyncio.to_thread(_inspect_image, str(path), self.working_dir, stem)
+            except ImportError:
+                details = {}
+            except Exception as e:
+                path.unlink()
+                raise UploadRejected(f"Image could not be read: {e}")
+
+            similar = self._find_similar(details["phash"]) if details.get("phash") else None
+            if similar:
+                logger.info(f"Upload {path} looks like {similar['path']} (perceptual match); kept as a separate image")
+
+            record = {"path": str(path), "sha256": sha256, "image_format": image_format, **details}
+            self.index[sha256] = record
+            await asyncio.to_thread(self._save_index)
+            return UploadResult(**record)
@@ -0,0 +1,203 @@
+"""
+Validators for the chat workflow's identity and contact stages.
+
+Phone numbers are parsed locally. ID images are read by the warm daemon (OCR
+plus the ID parser), which keeps the OCR models out of every chat process. Each
+image's check starts as soon as it is uploaded and is cached for the session,
+so by the time the user names the parties the results are usually ready.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+import unicodedata
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from contract_client import DEFAULT_SOCKET, connect, request
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the daemon's reading of one ID image before treating it as unverified
+ID_CHECK_TIMEOUT = 60
+
+# Romanian numbers: mobile 07xx xxx xxx, landline 02x / 03x, all 10 digits with the trunk 0
+RO_MOBILE = re.compile(r"^7\d{8}$")
+RO_LANDLINE = re.compile(r"^[23]\d{8}$")
+# ITU-T E.164 country calling codes in use; a number's code is the first 1 to 3 digits found here
+_COUNTRY_CODE_RANGES = (
+    "1 7 20 27 30-34 36 39-41 43-49 51-58 60-66 81 82 84 86 90-95 98 211-213 216 218 220-258 260-269 "
+    "290 291 297-299 350-359 370-383 385-387 389 420 421 423 500-509 590-599 670 672-683 685-692 "
+    "800 808 850 852 853 855 856 870 878 880-883 886 888 960-968 970-977 979 992-996 998"
+)
+COUNTRY_CODES = {
+    str(code)
+    for part in _COUNTRY_CODE_RANGES.split()
+    for code in range(int(part.partition("-")[0]), int(part.partition("-")[2] or part.partition("-")[0]) + 1)
+}
+# National number lengths of common plans; other codes only get the E.164 bounds
+NATIONAL_LENGTHS = {
+    "1": (10, 10), "7": (10, 10), "33": (9, 9), "34": (9, 9), "36": (8, 9), "39": (6, 11), "41": (9, 9),
+    "43": (4, 13), "44": (9, 10), "49": (6, 13), "359": (7, 9), "373": (8, 8), "380": (9, 9), "381": (7, 12),
+}
+NAME_FORMAT = re.compile(r"^[^\W\d_]+(?:[ '-][^\W\d_]+)+$")
+
+_TRANSLITERATION = str.maketrans({"ș": "s", "ş": "s", "Ș": "S", "Ş": "S", "ț": "t", "ţ": "t", "Ț": "T", "Ţ": "T"})
+
+
+class PhoneCheck(BaseModel):
+    raw: str
+    valid: bool
+    normalized: Optional[str] = Field(None, description="E.164 form, e.g. +40712345678")
+    kind: Optional[str] = Field(None, description="ro_mobile, ro_landline or international")
+    reason: Optional[str] = None
+
+
+class IdentityCheck(BaseModel):
+    name: str
+    valid: bool
+    verified: bool = Field(False, description="Matched against the name read from an attached ID")
+    id_image: Optional[str] = None
+    reason: Optional[str] = None
+
+
+def country_code(international: str) -> Optional[str]:
+    return next((international[:length] for length in (1, 2, 3) if international[:length] in COUNTRY_CODES), None)
+
+
+def parse_phone(raw: str) -> PhoneCheck:
+    """
+    Normalize a Romanian or international phone number to E.164, or say why it is not one.
+
+    Numbers without + or 00 are read as Romanian; other countries need their prefix.
+    """
+    compact = re.sub(r"[\s.\-/()]", "", raw)
+    if not re.fullmatch(r"\+?\d+", compact):
+        return PhoneCheck(raw=raw, valid=False, reason="contains characters other than digits")
+    if compact.startswith("+"):
+        international = compact[1:]
+    elif compact.startswith("00"):
+        international = compact[2:]
+    elif compact.startswith("0"):
+        international = "40" + compact[1:]
+    elif len(compact) == 11 and compact.startswith("40"):
+        international = compact
+    else:
+        international = "40" + compact
+
+    if international.startswith("40"):
+        national = international[2:]
+        # "+40 07..." keeps the trunk zero by mistake
+        if len(national) == 10 and national.startswith("0"):
+            national = national[1:]
+        if RO_MOBILE.match(national):
+            return PhoneCheck(raw=raw, valid=True, normalized=f"+40{national}", kind="ro_mobile")
+        if RO_LANDLINE.match(national):
+            return PhoneCheck(raw=raw, valid=True, normalized=f"+40{national}", kind="ro_landline")
+        return PhoneCheck(raw=raw, valid=False, reason="not a Romanian mobile (07xx xxx xxx) or landline number")
+    code = country_code(international)
+    if code is None:
+        return PhoneCheck(raw=raw, valid=False, reason="unknown country code")
+    # E.164 allows at most 15 digits; no country has subscriber numbers shorter than 4
+    shortest, longest = NATIONAL_LENGTHS.get(code, (4, 15 - len(code)))
+    if not shortest <= len(international) - len(code) <= longest:
+        return PhoneCheck(raw=raw, valid=False, reason=f"wrong length for a number with country code +{code}")
+    return PhoneCheck(raw=raw, valid=True, normalized=f"+{international}", kind="international")
+
+
+def fold_name(name: str) -> str:
+    """
+    Uppercase ASCII name with tokens sorted, like entity_resolution.normalize_name.
+
+    Not imported from there: it loads src/models.py, which this folder's models.py shadows.
+    """
+    text = unicodedata.normalize("NFKD", name.translate(_TRANSLITERATION))
+    text = "".join(c for c in text if not unicodedata.combining(c)).upper()
+    return " ".join(sorted(re.sub(r"[^A-Z ]+", " ", text).split()))
+
+
+def names_match(given: str, on_id: str) -> bool:
+    """Same tokens, or one name contained in the other (middle names left out) with two tokens in common."""
+    given_tokens, id_tokens = set(fold_name(given).split()), set(fold_name(on_id).split())
+    if not given_tokens or not id_tokens:
+        return False
+    return given_tokens == id_tokens or (
+        len(given_tokens & id_tokens) >= 2 and (given_tokens <= id_tokens or id_tokens <= given_tokens)
+    )
+
+
+class SessionValidators:
+    """Validators for one chat session, caching every result for the session's lifetime."""
+
+    def __init__(self, daemon_socket: Optional[str] = None):
+        self.daemon_socket = daemon_socket or os.getenv("DAEMON_SOCKET", DEFAULT_SOCKET)
+        self.phones: Dict[str, PhoneCheck] = {}
+        # One task per image, so a check started at upload is shared by everything awaiting it later
+        self.ids: Dict[str, asyncio.Task] = {}
+
+    def check_phone(self, raw: str) -> PhoneCheck:
+        if raw not in self.phones:
+            self.phones[raw] = parse_phone(raw)
+        return self.phones[raw]
+
+    def daemon_available(self) -> bool:
+        try:
+            connect(self.daemon_socket).close()
+            return True
+        except OSError:
+            return False
+
+    def prefetch_ids(self, images: Dict[str, str]) -> None:
+        """Start reading each stored image (path -> copy to OCR) in the background."""
+        for path, ocr_path in images.items():
+            if path not in self.ids:
+                self.ids[path] = asyncio.create_task(self._read_id(ocr_path))
+
+    def _daemon_id_check(self, image: str) -> Optional[Dict[str, Any]]:
+        for event in request(self.daemon_socket, {"kind": "id_check", "payload": {"image": os.path.abspath(image)}}):
+            if event["event"] == "done":
+                return event["result"]
+            if event["event"] == "error":
+                raise RuntimeError(event["error"])
+        return None
+
+    async def _read_id(self, image: str) -> Optional[Dict[str, Any]]:
+        """What the daemon read from the image, or None when the image could not be checked."""
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(self._daemon_id_check, image), ID_CHECK_TIMEOUT)
+        except (FileNotFoundError, ConnectionRefusedError):
+            logger.warning(f"No contract daemon on {self.daemon_socket}; identities are checked for format only")
+        except asyncio.TimeoutError:
+            logger.warning(f"ID check of {image} took over {ID_CHECK_TIMEOUT}s; leaving it unverified")
+        except Exception as e:
+            logger.warning(f"ID check of {image} failed: {e}")
+        return None
+
+    async def check_identity(self, name: str, images: List[str]) -> IdentityCheck:
+        """Match a party's name against the holders read from the attached ID images."""
+        name = " ".join(name.split())
+        if not NAME_FORMAT.match(name):
+            return IdentityCheck(name=name, valid=False, reason="expected a full name (first and last name)")
+        self.prefetch_ids({image: image for image in images})
+        readings = await asyncio.gather(*(self.ids[image] for image in images))
+
+        read_names = []
+        for image, reading in zip(images, readings):
+            if reading and reading.get("name"):
+                read_names.append(reading["name"])
+                if names_match(name, reading["name"]):
+                    expiry = reading.get("expiry_date")
+                    if expiry and expiry < date.today().isoformat():
+                        return IdentityCheck(name=name, valid=False, id_image=image, reason=f"the ID expired on {expiry}")
+                    return IdentityCheck(name=name, valid=True, verified=True, id_image=image)
+        if read_names:
+            unread = len(images) - len(read_names)
+            hint = f"; {unread} ID(s) could not be read, a clearer photo may help" if unread else ""
+            return IdentityCheck(name=name, valid=False, reason=f"does not match any attached ID ({', '.join(read_names)}){hint}")
+        # No ID could be read (usually no daemon running): accept the name, but say it was not checked
+        return IdentityCheck(name=name, valid=True, reason="not verified against the attached IDs")
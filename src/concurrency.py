@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import httpx
+from openai import OpenAIError
+
+from deadlines import remaining
+from tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Fraction of the upstream's per-window allowance below which the limit stops growing and backs off
+RATE_LIMIT_LOW_WATERMARK = 0.05
+
+
+# Both subclass OpenAIError because the OpenAI client re-raises those as they are; any other exception
+# raised by the transport is retried with backoff first, which would defeat failing fast
+
+
+class CircuitOpen(OpenAIError):
+    """Raised without calling the upstream while it is considered down."""
+
+
+class LoadShed(OpenAIError):
+    """Raised when a request cannot get a slot in time (queue full, or the job deadline would pass first)."""
+
+
+def _header_float(headers: httpx.Headers, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Open after `failure_threshold` consecutive upstream failures (5xx, connection errors)
+    and fail fast for `cooldown` seconds; then let one probe through and close on success.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started: Optional[float] = None
+
+    def check(self) -> None:
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self.opened_at < self.cooldown:
+                raise CircuitOpen(f"Upstream unavailable, retrying after {self.cooldown:.0f}s cooldown")
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            # A probe that never reported back (e.g. cancelled) does not block the breaker forever
+            if self.probe_started is not None and now - self.probe_started < self.cooldown:
+                raise CircuitOpen("Upstream unavailable, waiting for probe request")
+            self.probe_started = now
+
+    def success(self) -> None:
+        if self.state != CLOSED:
+            logger.info("Circuit breaker closed, upstream recovered")
+        self.state = CLOSED
+        self.failures = 0
+        self.probe_started = None
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probe_started = None
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"Circuit breaker opened after {self.failures} consecutive upstream failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent upstream requests.
+
+    Each success adds 1/limit (about +1 per round trip at full load); a 429 or 5xx halves
+    the limit, at most once per `decrease_interval` so one burst of errors counts once.
+    The x-ratelimit-remaining-* headers trigger the same back-off before the upstream
+    starts refusing, and retry-after pauses new requests for the given time.
+    """
+
+    def __init__(
+        self,
+        initial: float = 8,
+        min_limit: float = 1,
+        max_limit: float = 64,
+        decrease_factor: float = 0.5,
+        decrease_interval: float = 1.0,
+        max_queue: Optional[int] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.max_queue = max_queue
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.counters = {"requests": 0, "throttled": 0, "server_errors": 0, "shed": 0, "circuit_open": 0}
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def acquire(self) -> None:
+        try:
+            self.breaker.check()
+        except CircuitOpen:
+            self.counters["circuit_open"] += 1
+            raise
+        while True:
+            pause = self.paused_until - time.monotonic()
+            left = remaining()
+            if left is not None and max(pause, 0) >= left:
+                self.counters["shed"] += 1
+                raise LoadShed(f"Upstream asked to wait {pause:.1f}s, more than the {left:.1f}s left for this job")
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return
+            if self.max_queue is not None and len(self._waiters) >= self.max_queue:
+                self.counters["shed"] += 1
+                raise LoadShed(f"{len(self._waiters)} requests already waiting for an upstream slot")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, left) if left is not None else await waiter
+            except asyncio.TimeoutError:
+                self.counters["shed"] += 1
+                raise LoadShed("Job deadline passed while waiting for an upstream slot")
+            except asyncio.CancelledError:
+                # Pass on a wake-up this waiter can no longer use
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease < self.decrease_interval:
+            return
+        self.last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        logger.info(f"Concurrency limit {previous:.1f} -> {self.limit:.1f} ({reason})")
+
+    def observe(self, status_code: int, headers: httpx.Headers) -> None:
+        """Adjust the limit from one upstream response."""
+        self.counters["requests"] += 1
+        retry_after = _header_float(headers, "retry-after")
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+        if status_code == 429:
+            self.counters["throttled"] += 1
+            self.breaker.success()
+            self._decrease("rate limited")
+        elif status_code >= 500:
+            self.counters["server_errors"] += 1
+            self.breaker.failure()
+            self._decrease(f"upstream error {status_code}")
+        else:
+            self.breaker.success()
+            if self._near_rate_limit(headers):
+                self._decrease("rate limit nearly exhausted")
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _near_rate_limit(self, headers: httpx.Headers) -> bool:
+        """Whether the upstream's remaining request or token allowance is almost used up."""
+        for kind in ("requests", "tokens"):
+            left = _header_float(headers, f"x-ratelimit-remaining-{kind}")
+            if left is None:
+                continue
+            floor = (_header_float(headers, f"x-ratelimit-limit-{kind}") or 0) * RATE_LIMIT_LOW_WATERMARK
+            if kind == "requests":
+                floor = max(floor, self.in_flight)
+            if left <= floor:
+                return True
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current limit and counters, for logs and benchmark reports."""
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "breaker": self.breaker.state,
+            **self.counters,
+        }
+
+
+class AdaptiveTransport(httpx.AsyncBaseTransport):
+    """httpx transport that takes a limiter slot for every request, including the OpenAI client's own retries."""
+
+    def __init__(self, limiter: AdaptiveLimiter, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.limiter.acquire()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            self.limiter.breaker.failure()
+            raise
+        finally:
+            self.limiter.release()
+        self.limiter.observe(response.status_code, response.headers)
+        current = current_span()
+        if current:
+            current.attributes["concurrency_limit"] = round(self.limiter.limit, 2)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 import logging
+from logging_setup import configure_logging
+from ocr_tuning import load_tuning
 
 # Load environment variables
 load_dotenv()
@@ -8,19 +10,146 @@ API_KEY = os.getenv('OPENAI_API_KEY')
 if not API_KEY:
     raise ValueError("OpenAI API key not found in environment variables")
 
+# Optional override, e.g. to point at the local fake server used by the benchmarks
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
 TAVILY_API_KEY = os.getenv('TAVILY_API_KEY')
 if not TAVILY_API_KEY:
     raise ValueError("Tavily API key not found in environment variables")
 
 DATA_FOLDER = 'data'
 
+# Number of documents extracted (OCR/PDF/text) at the same time
+EXTRACTION_CONCURRENCY = int(os.getenv('EXTRACTION_CONCURRENCY', '4'))
+
+# OCR languages: all that documents may use, the set used when a document gives no hint, and the cap
+# on memory held by loaded recognition models (least recently used readers are unloaded beyond it)
+OCR_LANGUAGES = [l.strip() for l in os.getenv('OCR_LANGUAGES', 'en,ro,hu,de,bg').split(',') if l.strip()]
+OCR_DEFAULT_LANGUAGES = [l.strip() for l in os.getenv('OCR_DEFAULT_LANGUAGES', 'en,ro').split(',') if l.strip()]
+OCR_POOL_MAX_MB = float(os.getenv('OCR_POOL_MAX_MB', '1024'))
+
+# OCR in this many worker processes forked after the models are loaded, so they share the weights
+# (Linux; 0 keeps OCR in threads), each limited to OCR_TORCH_THREADS torch threads (also applied to
+# in-process OCR; 0 means one per worker and torch's default in-process). Unless set here, both come
+# from the calibration saved for this node type by `python src/ocr_tuning.py calibrate`
+OCR_TUNING_FILE = os.getenv('OCR_TUNING_FILE', 'ocr_tuning.json')
+_ocr_tuning = load_tuning(OCR_TUNING_FILE)
+OCR_WORKERS = int(os.getenv('OCR_WORKERS') or _ocr_tuning.get('workers', 0))
+OCR_TORCH_THREADS = int(os.getenv('OCR_TORCH_THREADS') or _ocr_tuning.get('torch_threads', 0))
+if not os.getenv('EXTRACTION_CONCURRENCY'):
+    # Enough documents in flight to keep every OCR worker busy
+    EXTRACTION_CONCURRENCY = max(EXTRACTION_CONCURRENCY, OCR_WORKERS)
+
 TEMPLATES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 
+# Watch-folder ingestion (src/ingestion.py)
+INGESTION_MANIFEST = os.getenv('INGESTION_MANIFEST', 'ingestion_manifest.sqlite3')
+INGESTED_FOLDER = os.getenv('INGESTED_FOLDER', 'ingested')
+INGESTION_DEBOUNCE_SECONDS = float(os.getenv('INGESTION_DEBOUNCE_SECONDS', '2.0'))
+INGESTION_POLL_INTERVAL = float(os.getenv('INGESTION_POLL_INTERVAL', '5.0'))
+
+# Token budgets: per-call prompt limit, per-job total, and what to do with oversized inputs
+# (truncate, chunk or fail; templates only truncate or fail, since sections generated from pieces
+# of a template do not join into a coherent contract). Empty limits mean "model context window" / "unlimited".
+MAX_PROMPT_TOKENS_PER_CALL = int(os.getenv('MAX_PROMPT_TOKENS_PER_CALL') or 0) or None
+MAX_TOKENS_PER_JOB = int(os.getenv('MAX_TOKENS_PER_JOB') or 0) or None
+TOKEN_POLICY_EXTRACT_PII = os.getenv('TOKEN_POLICY_EXTRACT_PII', 'chunk')
+TOKEN_POLICY_CONSTRUCT = os.getenv('TOKEN_POLICY_CONSTRUCT', 'fail')
+if TOKEN_POLICY_CONSTRUCT not in ('fail', 'truncate'):
+    raise ValueError(f"Invalid TOKEN_POLICY_CONSTRUCT: {TOKEN_POLICY_CONSTRUCT}. Must be 'fail' or 'truncate'")
+
+# Documents longer than PII_CHUNK_TOKENS are split into overlapping page chunks for PII extraction,
+# with at most PII_CHUNK_CONCURRENCY chunks of one document in flight (and in memory) at a time
+PII_CHUNK_TOKENS = int(os.getenv('PII_CHUNK_TOKENS', '6000'))
+PII_CHUNK_OVERLAP_TOKENS = int(os.getenv('PII_CHUNK_OVERLAP_TOKENS', '200'))
+PII_CHUNK_CONCURRENCY = int(os.getenv('PII_CHUNK_CONCURRENCY', '4'))
+
+# Model cascade per task, cheapest first, e.g. "extract_pii=gpt-4o-mini>gpt-4o;construct_contract=gpt-4o".
+# Tasks not listed use the defaults in model_router.DEFAULT_ROUTES.
+MODEL_ROUTES = os.getenv('MODEL_ROUTES', '')
+
+# Deadlines: per-call timeout cap, optional per-job deadline (seconds) that every model call's timeout
+# is shortened to, and idempotent tasks whose slow calls are hedged with a second request after the p95 delay
+MODEL_CALL_TIMEOUT = float(os.getenv('MODEL_CALL_TIMEOUT', '120'))
+JOB_DEADLINE_SECONDS = float(os.getenv('JOB_DEADLINE_SECONDS') or 0) or None
+HEDGE_TASKS = [t.strip() for t in os.getenv('HEDGE_TASKS', 'extract_pii,validate').split(',') if t.strip()]
+HEDGE_DELAY_SECONDS = float(os.getenv('HEDGE_DELAY_SECONDS', '10'))
+
+# Adaptive (AIMD) limit on concurrent model requests, driven by 429s, 5xx and x-ratelimit headers,
+# plus a circuit breaker that fails fast after consecutive upstream failures
+ADAPTIVE_CONCURRENCY = os.getenv('ADAPTIVE_CONCURRENCY', '1') == '1'
+CONCURRENCY_INITIAL = int(os.getenv('CONCURRENCY_INITIAL', '8'))
+CONCURRENCY_MIN = int(os.getenv('CONCURRENCY_MIN', '1'))
+CONCURRENCY_MAX = int(os.getenv('CONCURRENCY_MAX', '64'))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv('BREAKER_COOLDOWN_SECONDS', '30'))
+
+# Optional SQLite file of generated contract sections by input hash, so unchanged sections are reused
+# across jobs. The sections contain party names and addresses (PII), so it is off by default (edits
+# within a job still reuse sections) and entries older than the TTL are deleted
+CONTRACT_SECTION_CACHE = os.getenv('CONTRACT_SECTION_CACHE', '')
+CONTRACT_SECTION_CACHE_TTL_DAYS = float(os.getenv('CONTRACT_SECTION_CACHE_TTL_DAYS', '7'))
+
+# Where extracted people and their roles are reviewed in one batch: terminal or web (a page on localhost)
+REVIEW_UI = os.getenv('REVIEW_UI', 'terminal')
+REVIEW_WEB_PORT = int(os.getenv('REVIEW_WEB_PORT', '8765'))
+
+# Job queue for headless contract jobs (src/worker.py): broker URL, lease length (extended while a job
+# runs; a crashed worker's jobs reappear after it), attempts before dead-lettering, and retry backoff
+JOB_QUEUE_URL = os.getenv('JOB_QUEUE_URL', 'sqlite:///jobs.sqlite3')
+JOB_VISIBILITY_TIMEOUT = float(os.getenv('JOB_VISIBILITY_TIMEOUT', '300'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF_BASE = float(os.getenv('JOB_BACKOFF_BASE', '10'))
+JOB_BACKOFF_MAX = float(os.getenv('JOB_BACKOFF_MAX', '600'))
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '2'))
+WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '2'))
+
+# Warm daemon (src/daemon.py) for contract_client.py: a Unix socket path, or host:port to listen on
+# localhost TCP instead, and how many jobs it runs at once
+DAEMON_SOCKET = os.getenv('DAEMON_SOCKET', 'contract_daemon.sock')
+DAEMON_CONCURRENCY = int(os.getenv('DAEMON_CONCURRENCY', '2'))
+
+# Sampling profiler (see profiling.py), also set with --profile/--profile-seconds: stages (span names,
+# or "all") and/or a window in seconds from start; SIGUSR2 then profiles another window on demand.
+# Collapsed stacks for flamegraph.pl/speedscope go to PROFILE_FOLDER, one file per job and stage
+PROFILE = os.getenv('PROFILE', '')
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS') or 0)
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', 'profiles')
+
+# Logging goes through a queue to a background writer (see logging_setup.py): JSON lines (LOG_FORMAT=text
+# for the old format), rotated by size, busy DEBUG call sites sampled, and payload bodies
+# (prompts, document text, HTTP request bodies) dropped unless LOG_PAYLOADS=1
+LOG_FILE = os.getenv('LOG_FILE', 'agent_workflow.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.1'))
+LOG_PAYLOADS = os.getenv('LOG_PAYLOADS', '0') == '1'
+
 # Set up logging
-logging.basicConfig(filename='agent_workflow.log', level=logging.DEBUG, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+configure_logging(
+    filename=LOG_FILE,
+    level=getattr(logging, LOG_LEVEL, logging.DEBUG),
+    json_format=LOG_FORMAT == 'json',
+    max_bytes=LOG_MAX_BYTES,
+    backup_count=LOG_BACKUP_COUNT,
+    debug_sample_rate=LOG_DEBUG_SAMPLE_RATE,
+    log_payloads=LOG_PAYLOADS,
+)
 
 # Add English language support
 LANGUAGE = 'en'
 
 OUTPUT_FOLDER = "output_contracts"
+
+# Comma-separated output formats: txt (always written), pdf, docx (needs python-docx)
+OUTPUT_FORMATS = [f.strip() for f in os.getenv('OUTPUT_FORMATS', 'txt').split(',') if f.strip()]
+
+# Minimum relative margin for picking the contract type without asking the user
+CONTRACT_TYPE_CONFIDENCE = float(os.getenv('CONTRACT_TYPE_CONFIDENCE', '0.35'))
+
+# Per-stage tracing spans (JSON Lines, written by a background thread); set TRACE_OTEL=1 to also export to OpenTelemetry
+TRACE_FILE = os.getenv('TRACE_FILE', 'pipeline_traces.jsonl')
+TRACE_OTEL = os.getenv('TRACE_OTEL', '0') == '1'
@@ -0,0 +1,122 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from config import CONTRACT_TYPE_CONFIDENCE
+from tracing import record_cache_hit
+
+# Similarity below this is treated as "no signal" regardless of the margin
+MIN_SIMILARITY = 0.05
+
+# Weight applied to keywords declared in the template metadata header
+KEYWORD_WEIGHT = 5.0
+
+STOPWORDS = {
+    "the", "and", "for", "with", "this", "that", "shall", "will", "any", "all", "are", "from",
+    "agreement", "party", "parties", "date", "name", "address", "residing", "between", "made",
+    "care", "din", "pentru", "prin", "sau", "este", "sunt", "catre", "intre",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class ClassificationResult(BaseModel):
+    contract_type: Optional[str] = Field(None, description="Best matching contract type")
+    template_name: Optional[str] = Field(None, description="Template file of the best match")
+    confidence: float = Field(0.0, description="Relative margin of the best match over the runner-up")
+    scores: Dict[str, float] = Field(default_factory=dict, description="Cosine similarity per template")
+
+    @property
+    def is_confident(self) -> bool:
+        return self.contract_type is not None and self.confidence >= CONTRACT_TYPE_CONFIDENCE
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and strip diacritics so 'vânzare' and 'vanzare' share a token."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(normalize_text(text)) if len(t) > 2 and t not in STOPWORDS]
+
+
+def template_contract_type(template_name: str, metadata: Optional[Dict[str, str]] = None) -> str:
+    """Map a template file name (e.g. 'it.consulting.txt') to its contract type ('it')."""
+    if metadata and metadata.get("contract_type"):
+        return metadata["contract_type"].lower()
+    return template_name.split(".")[0].lower()
+
+
+class TemplateIndex:
+    """Precomputed TF-IDF vectors for the loaded templates."""
+
+    def __init__(self, templates: Dict[str, Dict]):
+        self.names: List[str] = []
+        self.contract_types: Dict[str, str] = {}
+        term_counts: List[Counter] = []
+
+        for name, template in templates.items():
+            metadata = template.get("metadata", {})
+            counts = Counter(tokenize(template.get("content", "")))
+            for keyword in metadata.get("keywords", "").split(","):
+                for token in tokenize(keyword):
+                    counts[token] += KEYWORD_WEIGHT
+            self.names.append(name)
+            self.contract_types[name] = template_contract_type(name, metadata)
+            term_counts.append(counts)
+
+        document_frequency = Counter(token for counts in term_counts for token in counts)
+        total = len(term_counts)
+        self.idf: Dict[str, float] = {
+            token: math.log((1 + total) / (1 + df)) + 1.0 for token, df in document_frequency.items()
+        }
+        self.vectors: List[Dict[str, float]] = [self._vectorize(counts) for counts in term_counts]
+
+    def _vectorize(self, counts: Counter) -> Dict[str, float]:
+        weighted = {token: (1 + math.log(count)) * self.idf[token] for token, count in counts.items() if token in self.idf}
+        norm = math.sqrt(sum(w * w for w in weighted.values()))
+        return {token: w / norm for token, w in weighted.items()} if norm else {}
+
+    def score(self, text: str) -> Dict[str, float]:
+        """Cosine similarity of the text against every template."""
+        query = self._vectorize(Counter(tokenize(text)))
+        return {
+            name: sum(weight * vector.get(token, 0.0) for token, weight in query.items())
+            for name, vector in zip(self.names, self.vectors)
+        }
+
+
+_index_cache: Dict[Tuple[Tuple[str, int], ...], TemplateIndex] = {}
+
+
+def get_template_index(templates: Dict[str, Dict]) -> TemplateIndex:
+    """Return the cached index for this set of templates, building it on first use."""
+    fingerprint = tuple(sorted((name, hash(t.get("content", ""))) for name, t in templates.items()))
+    if fingerprint in _index_cache:
+        record_cache_hit()
+    else:
+        _index_cache[fingerprint] = TemplateIndex(templates)
+    return _index_cache[fingerprint]
+
+
+def classify_contract(text: str, templates: Dict[str, Dict]) -> ClassificationResult:
+    """Score document text against the templates and pick the most likely contract type."""
+    index = get_template_index(templates)
+    scores = index.score(text)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if not ranked or ranked[0][1] < MIN_SIMILARITY:
+        return ClassificationResult(scores=scores)
+
+    best_name, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    return ClassificationResult(
+        contract_type=index.contract_types[best_name],
+        template_name=best_name,
+        confidence=(best_score - runner_up) / best_score,
+        scores=scores,
+    )
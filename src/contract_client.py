@@ -0,0 +1,110 @@
+"""
+Thin client for the contract daemon (see daemon.py).
+
+Imports nothing from the pipeline, so it starts instantly; the daemon keeps the
+OCR readers, templates and model client warm and streams progress back while
+the job runs.
+
+    rye run python src/contract_client.py --documents data/id1.jpg data/id2.pdf --contract-type buy-sell
+    rye run python src/contract_client.py --status
+
+Protocol: one JSON request line, then JSON event lines from the daemon
+("accepted", "span" per finished pipeline span, and finally "done" or "error").
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_SOCKET = "contract_daemon.sock"
+
+
+def parse_pairs(pairs: Optional[List[str]], option: str) -> Dict[str, str]:
+    values = {}
+    for pair in pairs or []:
+        key, separator, value = pair.partition("=")
+        if not separator:
+            raise SystemExit(f"{option} expects key=value, got '{pair}'")
+        values[key.strip()] = value.strip()
+    return values
+
+
+def add_contract_arguments(parser: argparse.ArgumentParser, required: bool = True) -> None:
+    """Flags describing a contract job, shared with `worker.py enqueue`."""
+    parser.add_argument("--documents", nargs="+", required=required)
+    parser.add_argument("--contract-type", default=None)
+    parser.add_argument("--role", nargs="*", metavar="NAME=ROLE", help="Role of a person found in the documents; required when they name several people")
+    parser.add_argument("--address", default=None, help="Contract address (default: the first named party's)")
+    parser.add_argument("--info", nargs="*", metavar="KEY=VALUE", help="Additional contract details")
+    parser.add_argument("--output-folder", default=None)
+
+
+def contract_payload(args: argparse.Namespace) -> Dict[str, Any]:
+    # Paths are resolved here: the daemon or worker runs in another working directory
+    return {
+        "documents": [os.path.abspath(doc) for doc in args.documents],
+        "contract_type": args.contract_type,
+        "roles": parse_pairs(args.role, "--role"),
+        "address": args.address,
+        "additional_info": parse_pairs(args.info, "--info"),
+        "output_folder": os.path.abspath(args.output_folder) if args.output_folder else None,
+    }
+
+
+def connect(address: str) -> socket.socket:
+    """Connect to a Unix socket path, or to host:port for the TCP listener."""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return socket.create_connection((host or "127.0.0.1", int(port)))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+
+def request(address: str, message: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Send one request and yield the daemon's events until it closes the connection."""
+    with connect(address) as sock:
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile("r", encoding="utf-8") as lines:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Submit a contract job to the running daemon and follow its progress.")
+    parser.add_argument("--socket", default=os.getenv("DAEMON_SOCKET", DEFAULT_SOCKET),
+                        help="Daemon socket path, or host:port (default: %(default)s)")
+    parser.add_argument("--status", action="store_true", help="Show the daemon's status instead of submitting a job")
+    add_contract_arguments(parser, required=False)
+    args = parser.parse_args()
+    if not args.status and not args.documents:
+        parser.error("--documents is required to submit a job")
+
+    message = {"kind": "status"} if args.status else {"kind": "contract", "payload": contract_payload(args)}
+    started = time.perf_counter()
+    try:
+        for event in request(args.socket, message):
+            elapsed = time.perf_counter() - started
+            if event["event"] == "status":
+                print(json.dumps(event["status"], indent=2))
+            elif event["event"] == "accepted":
+                print(f"[{elapsed:6.2f}s] Job {event['job_id']} accepted ({event['running']} running)")
+            elif event["event"] == "span":
+                error = f" FAILED: {event['error']}" if event.get("error") else ""
+                print(f"[{elapsed:6.2f}s] {event['name']} {event['wall_time']:.2f}s{error}")
+            elif event["event"] == "done":
+                print(f"[{elapsed:6.2f}s] Contract saved to: {event['result']['contract_path']}")
+            elif event["event"] == "error":
+                print(f"[{elapsed:6.2f}s] Job failed: {event['error']}")
+                sys.exit(1)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No daemon is listening on {args.socket}. Start it with: python src/daemon.py")
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Contracts stored as sections, each regenerated only when its own inputs change.
+
+A template is split at its numbered headings ("3. Purchase Price"). Each section
+declares the inputs it uses (parties, the property address, individual
+additional_info keys), and its output is cached under a hash of the section
+template and those input values. Correcting one payment date then regenerates
+the payment section and reuses every other section as approved.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from models import ContractParties, ContractSection, SectionedContract
+
+logger = logging.getLogger(__name__)
+
+# Bump when the section prompt changes so cached sections are not reused with the old wording
+SECTION_PROMPT_VERSION = 1
+
+SECTION_HEADING = re.compile(r"^\s*(\d{1,2})\.\s+\S.*$", re.MULTILINE)
+PLACEHOLDER = re.compile(r"\[[^\]\n]+\]|\{[a-z_]+\}")
+
+ROLE_WORDS = re.compile(
+    r"seller|buyer|owner|renter|host|guest|landlord|tenant|consultant|client|party|parties|name",
+    re.IGNORECASE,
+)
+ADDRESS_WORDS = re.compile(r"property|premises|location|address", re.IGNORECASE)
+# Signature blocks are filled with the party names even without placeholders
+SIGNATURE = re.compile(r"signature", re.IGNORECASE)
+
+# Words that say nothing about where an additional_info value belongs
+GENERIC_KEY_WORDS = {"date", "amount", "details", "info", "value", "the", "of", "and"}
+# How additional_info keys are worded in the templates
+KEY_SYNONYMS = {
+    "advance": ["advance", "deposit"],
+    "final": ["final payment"],
+    "object": ["property", "object", "item", "services", "description"],
+    "payment": ["payment", "price"],
+}
+
+PARTIES, ADDRESS = "parties", "address"
+INFO_PREFIX = "additional_info."
+
+
+def split_sections(template: str) -> List[Tuple[str, str]]:
+    """(title, text) per numbered section; text before the first heading is the preamble."""
+    headings = list(SECTION_HEADING.finditer(template))
+    if not headings:
+        return [("Contract", template)]
+    sections = []
+    preamble = template[:headings[0].start()]
+    if preamble.strip():
+        sections.append(("Preamble", preamble))
+    for i, heading in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(template)
+        sections.append((heading.group(0).strip(), template[heading.start():end]))
+    return sections
+
+
+def has_party_placeholder(text: str) -> bool:
+    """Whether the section has a placeholder for a party ("[Seller's Name]"), not just their role."""
+    return any(ROLE_WORDS.search(placeholder) for placeholder in PLACEHOLDER.findall(text))
+
+
+def _key_terms(key: str) -> List[str]:
+    terms = []
+    for word in key.lower().replace("-", "_").split("_"):
+        if word and word not in GENERIC_KEY_WORDS:
+            terms.extend(KEY_SYNONYMS.get(word, [word]))
+    return terms
+
+
+def section_dependencies(sections: List[Tuple[str, str]], additional_info: Dict[str, str]) -> List[List[str]]:
+    """
+    Inputs each section uses, from its placeholders and wording.
+
+    A key of additional_info that no section mentions is given to every section, since
+    there is no telling where the model will use it.
+    """
+    dependencies: List[List[str]] = []
+    for _, text in sections:
+        deps = {PARTIES} if SIGNATURE.search(text) else set()
+        for placeholder in PLACEHOLDER.findall(text):
+            # "[Seller's Address]" needs both the party and the address
+            if ROLE_WORDS.search(placeholder):
+                deps.add(PARTIES)
+            if ADDRESS_WORDS.search(placeholder):
+                deps.add(ADDRESS)
+        dependencies.append(sorted(deps))
+
+    for key in additional_info:
+        terms = _key_terms(key)
+        matched = [
+            i for i, (_, text) in enumerate(sections)
+            if any(re.search(rf"\b{re.escape(term)}", text, re.IGNORECASE) for term in terms)
+        ]
+        for i in matched or range(len(sections)):
+            dependencies[i].append(f"{INFO_PREFIX}{key}")
+    return dependencies
+
+
+def section_inputs(
+    depends_on: List[str],
+    parties: ContractParties,
+    address: str,
+    additional_info: Dict[str, str],
+) -> Dict[str, Any]:
+    """The values a section is generated from; nothing else reaches its prompt or its hash."""
+    inputs: Dict[str, Any] = {}
+    for dependency in depends_on:
+        if dependency == PARTIES:
+            inputs[PARTIES] = [{"name": p.name, "roles": p.roles} for p in parties.parties]
+        elif dependency == ADDRESS:
+            inputs[ADDRESS] = address
+        elif dependency.startswith(INFO_PREFIX):
+            inputs[dependency] = additional_info.get(dependency[len(INFO_PREFIX):], "")
+    return inputs
+
+
+def input_hash(contract_type: str, template: str, inputs: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {"version": SECTION_PROMPT_VERSION, "contract_type": contract_type, "template": template, "inputs": inputs},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SectionCache:
+    """
+    Generated section text by input hash (SQLite), shared across jobs and runs.
+
+    Sections hold party names and addresses, so entries expire after `ttl_seconds`.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sections (input_hash TEXT PRIMARY KEY, title TEXT, content TEXT, created_at REAL)"
+        )
+        self.prune()
+
+    def prune(self) -> None:
+        deleted = self.conn.execute("DELETE FROM sections WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+        self.conn.commit()
+        if deleted:
+            logger.info(f"Deleted {deleted} expired contract sections from the cache")
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT content FROM sections WHERE input_hash = ? AND created_at >= ?",
+            (key, time.time() - self.ttl_seconds),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, title: str, content: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sections (input_hash, title, content, created_at) VALUES (?, ?, ?, ?)",
+            (key, title, content, time.time()),
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# generate(title, section template, inputs) -> section text
+SectionGenerator = Callable[[str, str, Dict[str, Any]], Awaitable[str]]
+
+
+async def build_contract(
+    contract_type: str,
+    parties: ContractParties,
+    address: str,
+    additional_info: Dict[str, str],
+    template: str,
+    generate: SectionGenerator,
+    previous: Optional[SectionedContract] = None,
+    cache: Optional[SectionCache] = None,
+) -> SectionedContract:
+    """
+    Build a contract section by section, generating only sections whose inputs changed.
+
+    Args:
+        generate: Coroutine producing the text of one section.
+        previous: The contract being edited; its sections are reused when their hash matches.
+        cache: Persistent cache consulted for sections not found in `previous`.
+    """
+    split = split_sections(template)
+    dependencies = section_dependencies(split, additional_info)
+    known = {section.input_hash: section.content for section in (previous.sections if previous else [])}
+
+    sections: List[ContractSection] = []
+    pending = []
+    for (title, text), depends_on in zip(split, dependencies):
+        inputs = section_inputs(depends_on, parties, address, additional_info)
+        section = ContractSection(title=title, template=text, depends_on=depends_on, input_hash=input_hash(contract_type, text, inputs))
+        cached = known.get(section.input_hash)
+        if cached is None and cache:
+            cached = cache.get(section.input_hash)
+        if cached is None:
+            pending.append((section, inputs))
+        else:
+            section.content = cached
+        sections.append(section)
+
+    contents = await asyncio.gather(*(generate(section.title, section.template, inputs) for section, inputs in pending))
+    for (section, _), content in zip(pending, contents):
+        section.content = content
+        if cache:
+            cache.put(section.input_hash, section.title, content)
+
+    logger.info(f"Contract built: {len(pending)} of {len(sections)} sections generated, the rest reused")
+    return SectionedContract(contract_type=contract_type, sections=sections, regenerated=[s.title for s, _ in pending])
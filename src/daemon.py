@@ -0,0 +1,265 @@
+"""
+Warm contract daemon.
+
+Pays the cold start once (imports, EasyOCR detector and readers, template
+registry and its classifier index, the pooled model client) and then runs
+contract jobs submitted over a Unix socket (or localhost TCP) by
+contract_client.py, streaming each finished pipeline span back to the client
+as progress. Small jobs take only the time of their actual work.
+
+    rye run python src/daemon.py
+    rye run python src/contract_client.py --documents data/id1.jpg data/id2.pdf --contract-type buy-sell
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import signal
+import stat
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from config import (
+    DAEMON_CONCURRENCY,
+    DAEMON_SOCKET,
+    JOB_DEADLINE_SECONDS,
+    MAX_TOKENS_PER_JOB,
+    PROFILE,
+    PROFILE_FOLDER,
+    PROFILE_INTERVAL_MS,
+    PROFILE_SECONDS,
+    TRACE_FILE,
+    TRACE_OTEL,
+)
+from contract_classifier import get_template_index
+from contract_client import connect
+from deadlines import deadline
+from document_processing import ocr_pool, ocr_workers, start_ocr_workers
+from jobs import JOB_HANDLERS, get_templates
+from openai_client import limiter
+from output_writer import shutdown_render_pool
+from profiling import add_profile_arguments, configure_profiling
+from model_router import routing_report, start_job_routing
+from token_budget import start_job_budget
+from tracing import Span, configure_tracing, span, start_trace, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressExporter:
+    """Forwards each finished span to the connection that submitted its job."""
+
+    def __init__(self):
+        self.listeners: Dict[str, Callable[[Span], None]] = {}
+
+    def export(self, finished: Span) -> None:
+        listener = self.listeners.get(finished.trace_id)
+        if listener:
+            listener(finished)
+
+
+async def warm_up() -> Dict[str, float]:
+    """Load everything a job would otherwise load on first use; returns seconds per part."""
+    timings = {}
+    started = time.perf_counter()
+    templates = await asyncio.to_thread(get_templates)
+    get_template_index(templates)
+    timings["templates"] = round(time.perf_counter() - started, 3)
+
+    if ocr_workers and ocr_workers.running:
+        # Forked by main() before the event loop started
+        timings["ocr"] = ocr_workers.start_seconds
+        return timings
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(ocr_pool.warm_up)
+    except Exception as e:
+        # Jobs with images will load the readers themselves (and report the error if it persists)
+        logger.warning(f"Could not preload OCR readers: {e}")
+    timings["ocr"] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ContractDaemon:
+    def __init__(self, address: str = DAEMON_SOCKET, concurrency: int = DAEMON_CONCURRENCY, handlers: Optional[Dict[str, Callable]] = None):
+        self.address = address
+        self.handlers = handlers or JOB_HANDLERS
+        self.slots = asyncio.Semaphore(concurrency)
+        self.progress = ProgressExporter()
+        tracer.add_exporter(self.progress)
+        self.started_at = time.time()
+        self.warmup: Dict[str, float] = {}
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 1),
+            "warmup": self.warmup,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "ocr_readers": ocr_pool.readers.snapshot(),
+            "ocr_workers": ocr_workers.memory_report() if ocr_workers and ocr_workers.running else None,
+            "upstream_concurrency": limiter.snapshot(),
+        }
+
+    async def _execute(self, job_id: str, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.slots:
+            self.running += 1
+            start_trace(job_id)
+            budget = start_job_budget(MAX_TOKENS_PER_JOB)
+            routes = start_job_routing()
+            try:
+                with span("job", kind=kind, job_id=job_id), deadline(JOB_DEADLINE_SECONDS):
+                    result = await self.handlers[kind](payload)
+                self.completed += 1
+                return result
+            except BaseException:
+                self.failed += 1
+                raise
+            finally:
+                self.running -= 1
+                logger.info(f"Token usage for job {job_id}: {budget.summary()}")
+                logger.info(f"Model routing for job {job_id}: {routing_report(routes)}")
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, event: Dict[str, Any]) -> None:
+        writer.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _cancel_on_disconnect(reader: asyncio.StreamReader, task: asyncio.Task) -> None:
+        # Clients send nothing after the request line, so end of stream means they went away
+        while await reader.read(4096):
+            pass
+        task.cancel()
+
+    async def _run_job(self, kind: str, payload: Dict[str, Any], reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        job_id = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+
+        def on_span(finished: Span) -> None:
+            event = {"event": "span", "name": finished.name, "wall_time": round(finished.wall_time, 3), "error": finished.error}
+            # Spans of OCR and rendering finish in worker threads
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        self.progress.listeners[job_id] = on_span
+        task = asyncio.create_task(self._execute(job_id, kind, payload))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        watcher = asyncio.create_task(self._cancel_on_disconnect(reader, task))
+        try:
+            await self._send(writer, {"event": "accepted", "job_id": job_id, "running": self.running})
+            while (event := await events.get()) is not None:
+                await self._send(writer, event)
+            if task.cancelled():
+                logger.info(f"Job {job_id} cancelled: its client disconnected")
+                return
+            try:
+                await self._send(writer, {"event": "done", "job_id": job_id, "result": task.result()})
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+                await self._send(writer, {"event": "error", "job_id": job_id, "error": f"{type(e).__name__}: {e}"})
+        except (ConnectionError, asyncio.CancelledError):
+            # The client went away (or the daemon is stopping); nobody is waiting for the contract
+            task.cancel()
+            raise
+        finally:
+            watcher.cancel()
+            self.progress.listeners.pop(job_id, None)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                request = json.loads(await reader.readline())
+            except ValueError:
+                await self._send(writer, {"event": "error", "error": "Request must be one line of JSON"})
+                return
+            kind = request.get("kind")
+            if kind == "status":
+                await self._send(writer, {"event": "status", "status": self.status()})
+            elif kind in self.handlers:
+                await self._run_job(kind, request.get("payload") or {}, reader, writer)
+            else:
+                await self._send(writer, {"event": "error", "error": f"Unknown request kind: {kind}"})
+        except ConnectionError:
+            logger.info("Client disconnected before its job finished")
+        finally:
+            writer.close()
+
+    async def _listen(self) -> asyncio.AbstractServer:
+        host, separator, port = self.address.rpartition(":")
+        if separator and port.isdigit():
+            # Payloads name the files a job reads and the folder it writes, so never listen beyond this host
+            if not is_loopback(host or "127.0.0.1"):
+                raise SystemExit(f"Refusing to listen on {host}: the daemon only accepts loopback addresses")
+            return await asyncio.start_server(self._handle, host or "127.0.0.1", int(port))
+        if os.path.exists(self.address):
+            try:
+                connect(self.address).close()
+            except ConnectionRefusedError:
+                os.unlink(self.address)  # left behind by a daemon that did not shut down cleanly
+            else:
+                raise SystemExit(f"A daemon is already listening on {self.address}")
+        server = await asyncio.start_unix_server(self._handle, self.address)
+        # Jobs read any file the daemon can; only its owner may submit them
+        os.chmod(self.address, stat.S_IRUSR | stat.S_IWUSR)
+        return server
+
+    async def serve(self) -> None:
+        self.warmup = await warm_up()
+        logger.info(f"Daemon warm-up: {self.warmup}")
+        server = await self._listen()
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        print(f"Daemon {os.getpid()} ready on {self.address} (warm-up {self.warmup})")
+        try:
+            async with server:
+                await stopping.wait()
+        finally:
+            if not self.address.rpartition(":")[2].isdigit() and os.path.exists(self.address):
+                os.unlink(self.address)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Keep the contract pipeline warm and run jobs from contract_client.py.")
+    parser.add_argument("--socket", default=DAEMON_SOCKET, help="Unix socket path, or host:port for localhost TCP (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=DAEMON_CONCURRENCY)
+    add_profile_arguments(parser, PROFILE, PROFILE_SECONDS)
+    args = parser.parse_args()
+
+    try:
+        # Forked first, while this is still the only thread; the workers share the loaded models
+        start_ocr_workers()
+    except Exception as e:
+        logger.warning(f"Could not start OCR workers, reading images in threads: {e}")
+    configure_tracing(TRACE_FILE, otel=TRACE_OTEL)
+    configure_profiling(args.profile.split(","), args.profile_seconds, PROFILE_INTERVAL_MS, PROFILE_FOLDER)
+    try:
+        asyncio.run(ContractDaemon(args.socket, args.concurrency).serve())
+    finally:
+        shutdown_render_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the job's deadline has passed before or during a model call."""
+
+
+# Absolute expiry (time.monotonic()) of the innermost deadline in this context
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    Bound everything awaited in the block (one contract job, one ingested file) to `seconds`.
+
+    Nested deadlines can only shorten the enclosing one; None leaves it unchanged.
+    """
+    outer = _deadline.get()
+    if seconds is None:
+        yield outer
+        return
+    expires = time.monotonic() + seconds
+    if outer is not None:
+        expires = min(expires, outer)
+    token = _deadline.set(expires)
+    try:
+        yield expires
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def call_timeout(default: Optional[float]) -> Optional[float]:
+    """Timeout for the next call: the per-call default, shortened to the time the job has left."""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded("Job deadline exceeded")
+    return left if default is None else min(default, left)
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies per key, used to pick hedging delays."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples: Dict[Any, Deque[float]] = {}
+
+    def record(self, key: Any, seconds: float) -> None:
+        self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: Any, pct: float) -> Optional[float]:
+        """The pct-th percentile for key, or None until enough calls have been seen."""
+        samples = self.samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def hedged(call: Callable[[], Awaitable[T]], delay: float) -> Tuple[T, bool, bool]:
+    """
+    Await call(); if it has not finished after `delay`, start an identical second call.
+
+    The first successful result wins and the other request is cancelled. Only use this
+    for idempotent calls. Returns (result, whether the hedge was sent, whether it won).
+    """
+    tasks: List[asyncio.Future] = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return tasks[0].result(), False, False
+
+        tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), True, task is tasks[1]
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,58 +1,137 @@
 import os
 import asyncio
+import logging
 import aiofiles
-from typing import List, Dict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from langchain_community.document_loaders import PyPDFLoader
 
-import easyocr
-from config import DATA_FOLDER
+from config import DATA_FOLDER, EXTRACTION_CONCURRENCY, OCR_LANGUAGES, OCR_DEFAULT_LANGUAGES, OCR_POOL_MAX_MB, OCR_WORKERS, OCR_TORCH_THREADS
+from ocr_pool import OCRPool
+from ocr_workers import ForkedOCRWorkers, fork_available, set_torch_threads
+from token_budget import PAGE_BREAK
+from tracing import span
 
-# Initialize EasyOCR reader
-reader = easyocr.Reader(['en', 'ro'])
+logger = logging.getLogger(__name__)
+
+# OCR readers per language set, loaded on first use and shared by every job in the process
+ocr_pool = OCRPool(OCR_LANGUAGES, OCR_DEFAULT_LANGUAGES, OCR_POOL_MAX_MB)
+
+# With OCR_WORKERS set, images are read in processes forked from this one once those readers are loaded
+ocr_workers = ForkedOCRWorkers(ocr_pool, OCR_WORKERS, OCR_TORCH_THREADS or 1) if OCR_WORKERS and fork_available() else None
+if ocr_workers is None and OCR_TORCH_THREADS:
+    # OCR runs in this process, so the configured or calibrated thread count applies here
+    set_torch_threads(OCR_TORCH_THREADS)
+
+class ExtractionError(Exception):
+    """A document's text could not be extracted."""
+
+def start_ocr_workers() -> None:
+    """Fork the OCR workers, if configured; call from the main thread before the event loop and other threads start."""
+    if ocr_workers:
+        ocr_workers.start()
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.txt')
 
 # Get documents from the data folder
-def get_documents() -> List[str]:
-    os.makedirs(DATA_FOLDER, exist_ok=True)
-    all_files = os.listdir(DATA_FOLDER)
-    documents = [
-        os.path.join(DATA_FOLDER, f)
-        for f in all_files
-        if f.lower().endswith(('.pdf', '.jpg', '.jpeg', '.png', '.txt'))
-    ]
+def get_documents(folder: str = DATA_FOLDER, recursive: bool = False) -> List[str]:
+    with span("document_scan", folder=folder, recursive=recursive) as scan:
+        os.makedirs(folder, exist_ok=True)
+        if recursive:
+            documents = [
+                os.path.join(root, f)
+                for root, _, files in os.walk(folder)
+                for f in files
+                if f.lower().endswith(SUPPORTED_EXTENSIONS)
+            ]
+        else:
+            documents = [
+                os.path.join(folder, f)
+                for f in os.listdir(folder)
+                if f.lower().endswith(SUPPORTED_EXTENSIONS)
+            ]
+        scan.attributes["documents"] = len(documents)
     return documents
 
-# Extract text from a file
-async def extract_text(file_path: str) -> str:
+def document_kind(file_path: str) -> str:
+    """Classify a file by the extraction path it takes: pdf, ocr or text."""
     if file_path.lower().endswith('.pdf'):
-        try:
-            loader = PyPDFLoader(file_path)
-            pages = await asyncio.to_thread(loader.load)
-            return "\n".join(page.page_content for page in pages)
-        except ImportError:
-            return "Error: PyPDFLoader not available. Please install langchain."
-    elif file_path.lower().endswith(('.jpg', '.jpeg', '.png')):
-        try:
-            def process_image():
-                results = reader.readtext(file_path)
-                return ' '.join([result[1] for result in results])
-            return await asyncio.to_thread(process_image)
-        except Exception as e:
-            return f"Error processing image: {str(e)}"
-    else:
-        try:
-            async with aiofiles.open(file_path, mode='r') as f:
-                return await f.read()
-        except Exception as e:
-            return f"Error reading file: {str(e)}"
+        return "pdf"
+    if file_path.lower().endswith(('.jpg', '.jpeg', '.png')):
+        return "ocr"
+    return "text"
+
+# Extract text from a file; raises ExtractionError when it cannot be read
+async def extract_text(file_path: str) -> str:
+    kind = document_kind(file_path)
+    with span(f"extract_text.{kind}", started=False, file=os.path.basename(file_path)) as current:
+        if kind == "pdf":
+            try:
+                loader = PyPDFLoader(file_path)
+                def load_pdf():
+                    current.mark_started()
+                    return loader.load()
+                pages = await asyncio.to_thread(load_pdf)
+                current.attributes["pages"] = len(pages)
+                # Page breaks let PII extraction chunk long documents along page boundaries
+                return PAGE_BREAK.join(page.page_content for page in pages)
+            except ImportError as e:
+                raise ExtractionError("PyPDFLoader not available. Please install langchain.") from e
+        elif kind == "ocr":
+            try:
+                if ocr_workers and ocr_workers.running:
+                    current.mark_started()
+                    results, languages = await ocr_workers.readtext(file_path)
+                    current.attributes["languages"] = "+".join(languages)
+                    return '\n'.join([result[1] for result in results])
+
+                def process_image():
+                    current.mark_started()
+                    results, languages = ocr_pool.readtext(file_path)
+                    current.attributes["languages"] = "+".join(languages)
+                    # One line per detected text box, so labelled fields and MRZ lines stay separable
+                    return '\n'.join([result[1] for result in results])
+                return await asyncio.to_thread(process_image)
+            except Exception as e:
+                raise ExtractionError(f"Error processing image {file_path}: {e}") from e
+        else:
+            current.mark_started()
+            try:
+                async with aiofiles.open(file_path, mode='r') as f:
+                    return await f.read()
+            except Exception as e:
+                raise ExtractionError(f"Error reading file {file_path}: {e}") from e
+
+async def iter_documents(
+    documents: Optional[List[str]] = None, concurrency: int = EXTRACTION_CONCURRENCY, strict: bool = False
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Extract documents concurrently and yield (path, text) in completion order.
+
+    Keyed by path, since files in different folders can share a name. A document that cannot be
+    read is logged and skipped, or with strict=True raises ExtractionError.
+    """
+    documents = get_documents() if documents is None else documents
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def extract(doc: str) -> Tuple[str, Optional[str]]:
+        async with semaphore:
+            try:
+                return doc, await extract_text(doc)
+            except Exception as e:
+                if strict:
+                    raise e if isinstance(e, ExtractionError) else ExtractionError(f"Error processing file {doc}: {e}") from e
+                logger.warning(f"Skipping {doc}: {e}")
+                return doc, None
+
+    for next_done in asyncio.as_completed([extract(doc) for doc in documents]):
+        doc, text = await next_done
+        if text is not None:
+            yield doc, text
+
 async def process_documents() -> Dict[str, str]:
-    documents = get_documents()
     results = {}
-    for doc in documents:
-        try:
-            text = await extract_text(doc)
-            results[os.path.basename(doc)] = text
-        except Exception as e:
-            results[os.path.basename(doc)] = f"Error processing file: {str(e)}"
+    async for name, text in iter_documents():
+        results[name] = text
     return results
 
 # Load templates from the specified folder
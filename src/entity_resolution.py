@@ -0,0 +1,226 @@
+"""
+Merge records of the same person found in several documents.
+
+Names and addresses are normalized, records are grouped by blocking keys so only
+plausible pairs are compared, and pairs inside a block are scored at once with
+character-trigram similarity matrices. Matches are merged with union-find into
+one ResolvedParty per person, which keeps the documents it came from.
+
+    rye run python src/entity_resolution.py --folder ingested
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from models import PIIData, ResolvedParty
+
+logger = logging.getLogger(__name__)
+
+# Minimum name similarity, and minimum weighted name/address similarity, for two records to be one person
+NAME_THRESHOLD = 0.8
+MATCH_THRESHOLD = 0.8
+NAME_WEIGHT = 0.7
+
+# Blocks larger than this (very common names) are skipped; their records can still meet through other keys
+MAX_BLOCK_SIZE = 5000
+# Rows scored per matrix product, bounding memory for large blocks
+SCORE_BATCH = 1024
+
+ADDRESS_ABBREVIATIONS = {
+    "STRADA": "STR",
+    "BULEVARDUL": "BD",
+    "BDUL": "BD",
+    "BLVD": "BD",
+    "SOSEAUA": "SOS",
+    "CALEA": "CAL",
+    "NUMARUL": "NR",
+    "NUMAR": "NR",
+    "BLOC": "BL",
+    "BLOCUL": "BL",
+    "SCARA": "SC",
+    "ETAJ": "ET",
+    "ETAJUL": "ET",
+    "APARTAMENT": "AP",
+    "APARTAMENTUL": "AP",
+    "APT": "AP",
+    "SECTORUL": "SECTOR",
+    "SECT": "SECTOR",
+    "MUNICIPIUL": "MUN",
+    "JUDETUL": "JUD",
+}
+
+# Romanian letters with comma and cedilla below are both in use; NFKD handles the rest
+_TRANSLITERATION = str.maketrans({"ș": "s", "ş": "s", "Ș": "S", "Ş": "S", "ț": "t", "ţ": "t", "Ț": "T", "Ţ": "T"})
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.translate(_TRANSLITERATION))
+    text = "".join(c for c in text if not unicodedata.combining(c)).upper()
+    return re.sub(r"[^A-Z0-9 ]+", " ", text)
+
+
+def normalize_name(name: str) -> str:
+    """Uppercase ASCII name with tokens sorted, so "Ion Popescu" and "POPESCU ION" compare equal."""
+    return " ".join(sorted(_fold(name).split()))
+
+
+def normalize_address(address: str) -> str:
+    tokens = [ADDRESS_ABBREVIATIONS.get(token, token) for token in _fold(address).split()]
+    return " ".join(tokens)
+
+
+def blocking_keys(normalized_name: str) -> Set[str]:
+    """
+    One key per pair of name tokens (first three letters of each), so records meet when any
+    two name parts agree, e.g. when one document omits a middle name.
+    """
+    prefixes = sorted({token[:3] for token in normalized_name.split() if len(token) > 1})
+    if len(prefixes) == 1:
+        return set(prefixes)
+    return {f"{a}|{b}" for i, a in enumerate(prefixes) for b in prefixes[i + 1:]}
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity_matrix(texts: Sequence[str]) -> np.ndarray:
+    """Pairwise Dice similarity of character trigram sets, computed as one matrix product."""
+    grams = [_trigrams(text) for text in texts]
+    vocabulary: Dict[str, int] = {}
+    for gram_set in grams:
+        for gram in gram_set:
+            vocabulary.setdefault(gram, len(vocabulary))
+    vectors = np.zeros((len(texts), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, gram_set in enumerate(grams):
+        vectors[row, [vocabulary[g] for g in gram_set]] = 1.0
+    sizes = vectors.sum(axis=1)
+
+    scores = np.empty((len(texts), len(texts)), dtype=np.float32)
+    for start in range(0, len(texts), SCORE_BATCH):
+        shared = vectors[start:start + SCORE_BATCH] @ vectors.T
+        totals = sizes[start:start + SCORE_BATCH, None] + sizes[None, :]
+        scores[start:start + SCORE_BATCH] = np.divide(2 * shared, totals, out=np.zeros_like(shared), where=totals > 0)
+    return scores
+
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def _canonical(values: Iterable[str]) -> str:
+    """Most frequent spelling; among equally frequent ones the longest (most complete)."""
+    counts = Counter(v.strip() for v in values if v and v.strip())
+    if not counts:
+        return ""
+    return max(counts, key=lambda v: (counts[v], len(v)))
+
+
+def cluster(records: Sequence[Tuple[str, PIIData]]) -> List[List[int]]:
+    """Group indexes of records that refer to the same person, in order of first appearance."""
+    names = [normalize_name(pii.name) for _, pii in records]
+    addresses = [normalize_address(pii.address) for _, pii in records]
+
+    blocks: Dict[str, List[int]] = defaultdict(list)
+    for index, name in enumerate(names):
+        for key in blocking_keys(name):
+            blocks[key].append(index)
+
+    groups = UnionFind(len(records))
+    compared = 0
+    for key, members in blocks.items():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BLOCK_SIZE:
+            logger.debug(f"Skipping block '{key}' with {len(members)} records")
+            continue
+        name_scores = similarity_matrix([names[i] for i in members])
+        address_scores = similarity_matrix([addresses[i] for i in members])
+        # A record without an address should not block a match on a strong name
+        has_address = np.array([bool(addresses[i]) for i in members])
+        address_scores[~has_address, :] = 1.0
+        address_scores[:, ~has_address] = 1.0
+        combined = NAME_WEIGHT * name_scores + (1 - NAME_WEIGHT) * address_scores
+        matches = np.argwhere(np.triu((name_scores >= NAME_THRESHOLD) & (combined >= MATCH_THRESHOLD), k=1))
+        compared += len(members) * (len(members) - 1) // 2
+        for a, b in matches:
+            groups.union(members[a], members[b])
+
+    clusters: Dict[int, List[int]] = defaultdict(list)
+    for index in range(len(records)):
+        clusters[groups.find(index)].append(index)
+    logger.debug(f"Clustered {len(records)} PII records into {len(clusters)} groups ({compared} pairs compared)")
+    return list(clusters.values())
+
+
+def merge_records(records: Sequence[Tuple[str, PIIData]], indexes: Sequence[int]) -> ResolvedParty:
+    """One party from a cluster of records, with the most common spelling of each field."""
+    return ResolvedParty(
+        name=_canonical(records[i][1].name for i in indexes),
+        address=_canonical(records[i][1].address for i in indexes),
+        source_documents=list(dict.fromkeys(records[i][0] for i in indexes)),
+    )
+
+
+def resolve(records: Sequence[Tuple[str, PIIData]]) -> List[ResolvedParty]:
+    """
+    Merge (source document, PII) records that refer to the same person.
+
+    Args:
+        records: Extracted PII with the document each record came from.
+
+    Returns:
+        List[ResolvedParty]: One party per person, in order of first appearance.
+    """
+    parties = [merge_records(records, indexes) for indexes in cluster(records)]
+    logger.info(f"Resolved {len(records)} PII records into {len(parties)} parties")
+    return parties
+
+
+def resolve_documents(extracted: Dict[str, List[PIIData]]) -> List[ResolvedParty]:
+    """Resolve PII extracted per document (document name -> records)."""
+    return resolve([(document, pii) for document, pii_list in extracted.items() for pii in pii_list])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Merge people found across ingested documents.")
+    parser.add_argument("--folder", default="ingested", help="Folder with JSON results from ingestion.py")
+    parser.add_argument("--output", default="resolved_parties.json")
+    args = parser.parse_args()
+
+    extracted: Dict[str, List[PIIData]] = {}
+    for path in sorted(glob.glob(os.path.join(args.folder, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        extracted[payload.get("source", path)] = [PIIData(**pii) for pii in payload.get("pii", [])]
+
+    parties = resolve_documents(extracted)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump([party.model_dump() for party in parties], f, ensure_ascii=False, indent=2)
+    print(f"{sum(len(p) for p in extracted.values())} records from {len(extracted)} documents -> {len(parties)} parties")
+    print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Deterministic PII extraction for ID cards and passports.
+
+Reads the machine-readable zone (ICAO 9303 TD1, TD2 and TD3, with check digits)
+and the labelled fields of Romanian identity cards (Nume, Prenume, Domiciliu)
+from OCR output, so clean ID documents need no model call.
+"""
+import logging
+import re
+from collections import Counter
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from entity_resolution import normalize_name
+from models import PIIData
+
+logger = logging.getLogger(__name__)
+
+# Line length and line count of each MRZ format
+MRZ_FORMATS = {"TD1": (30, 3), "TD2": (36, 2), "TD3": (44, 2)}
+
+# Common OCR confusions, applied only where the MRZ layout says a field is numeric or alphabetic
+TO_DIGIT = str.maketrans({"O": "0", "Q": "0", "D": "0", "U": "0", "I": "1", "L": "1", "Z": "2", "S": "5", "B": "8", "G": "6"})
+TO_LETTER = str.maketrans({"0": "O", "1": "I", "2": "Z", "5": "S", "8": "B", "6": "G"})
+
+MRZ_CHARS = re.compile(r"^[A-Z0-9<]{5,}$")
+
+# Field labels on Romanian identity cards; values run until the next known label
+LABELS = {
+    "last_name": r"Nume\s*/\s*Nom\s*/\s*Last\s*name|\bNume\b",
+    "first_name": r"Prenume\s*/\s*Pr.nom\s*/\s*First\s*name|\bPrenume\b",
+    "address": r"Domiciliu\s*/\s*Adresse\s*/\s*Address|\bDomiciliu\b",
+    "other": (
+        r"Cet.ten\S*|Nationalit\S*|Loc\s+na.tere\S*|Lieu\s+de\s+naissance|Place\s+of\s+birth|\bSex\b|\bSexe\b"
+        r"|Emis.\s+de|Delivr.e\s+par|Issued\s+by|Valabilitate\S*|Validit\S*|\bCNP\b|\bSERIA\b"
+        r"|Data\s+na.terii|Date\s+of\s+birth|CARTE\s+DE\s+IDENTITATE|IDENTITY\s+CARD"
+    ),
+    # Party roles in deeds and contracts, which end a field value just like a label
+    "role": (
+        r"\b(?:V.nz.tor|Cump.r.tor|Proprietar|Chiria.|Locator|Locatar|Prestator|Beneficiar|Client"
+        r"|Seller|Buyer|Owner|Tenant|Landlord|Consultant)(?:ul|ii|i|a)?\b"
+    ),
+}
+_LABEL_PATTERN = re.compile("|".join(f"(?P<{key}>{pattern})" for key, pattern in LABELS.items()), re.IGNORECASE)
+
+NAME_VALUE = re.compile(r"^[A-Za-zĂÂÎȘŞȚŢăâîșşțţÉéÖöÜü' -]{2,60}$")
+ID_HEADER = re.compile(r"CARTE\s+DE\s+IDENTITATE|CARTE\s+D.IDENTIT|IDENTITY\s+CARD", re.IGNORECASE)
+ADDRESS_HINT = re.compile(r"\d|\b(str|nr|bd|bl|ap|sat|com|jud|mun|ora[sș]|sector)\b", re.IGNORECASE)
+
+
+class MRZResult(BaseModel):
+    format: str
+    document_type: str
+    issuing_country: str
+    surname: str
+    given_names: str
+    document_number: str
+    nationality: str
+    birth_date: Optional[str] = None
+    sex: str
+    expiry_date: Optional[str] = None
+    checks: Dict[str, bool] = Field(default_factory=dict, description="Check digit results per field")
+    names_truncated: bool = False
+
+    @property
+    def valid(self) -> bool:
+        return bool(self.checks) and all(self.checks.values())
+
+    @property
+    def name(self) -> str:
+        return f"{self.surname} {self.given_names}".strip()
+
+
+def check_digit(field: str) -> str:
+    """ICAO 9303 check digit: weights 7, 3, 1 over digits, letters A=10..Z=35 and '<'=0."""
+    total = 0
+    for i, char in enumerate(field):
+        if char.isdigit():
+            value = int(char)
+        elif char.isalpha():
+            value = ord(char) - ord("A") + 10
+        else:
+            value = 0
+        total += value * (7, 3, 1)[i % 3]
+    return str(total % 10)
+
+
+def _check(field: str, digit: str) -> bool:
+    # An empty optional field may carry '<' instead of 0
+    return check_digit(field) == digit or (digit == "<" and set(field) <= {"<"})
+
+
+def _digits(field: str) -> str:
+    return field.translate(TO_DIGIT)
+
+
+def _letters(field: str) -> str:
+    return field.translate(TO_LETTER)
+
+
+def _mrz_date(value: str, future: bool) -> Optional[str]:
+    """YYMMDD to ISO; birth dates are in the past, expiry dates up to a few decades ahead."""
+    if not value.isdigit():
+        return None
+    year, month, day = int(value[:2]), int(value[2:4]), int(value[4:6])
+    current = date.today().year % 100
+    century = 2000 if (year <= current + 30 if future else year <= current) else 1900
+    try:
+        return date(century + year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def _names(field: str) -> Tuple[str, str, bool]:
+    surname, _, given = _letters(field).partition("<<")
+    clean = lambda part: " ".join(p for p in part.split("<") if p)
+    return clean(surname), clean(given), not field.endswith("<")
+
+
+def _parse_td1(lines: List[str]) -> MRZResult:
+    line1, line2, line3 = lines
+    number = line1[5:14]
+    birth, expiry = _digits(line2[0:6]), _digits(line2[8:14])
+    surname, given, truncated = _names(line3)
+    composite = line1[5:30] + _digits(line2[0:7]) + _digits(line2[8:15]) + line2[18:29]
+    return MRZResult(
+        format="TD1",
+        document_type=_letters(line1[0:2]).rstrip("<"),
+        issuing_country=_letters(line1[2:5]),
+        surname=surname,
+        given_names=given,
+        document_number=number.rstrip("<"),
+        nationality=_letters(line2[15:18]),
+        birth_date=_mrz_date(birth, future=False),
+        sex=line2[7],
+        expiry_date=_mrz_date(expiry, future=True),
+        checks={
+            "document_number": _check(number, _digits(line1[14])),
+            "birth_date": _check(birth, _digits(line2[6])),
+            "expiry_date": _check(expiry, _digits(line2[14])),
+            "composite": _check(composite, _digits(line2[29])),
+        },
+        names_truncated=truncated,
+    )
+
+
+def _parse_td2_td3(lines: List[str], mrz_format: str) -> MRZResult:
+    line1, line2 = lines
+    number = line2[0:9]
+    birth, expiry = _digits(line2[13:19]), _digits(line2[21:27])
+    surname, given, truncated = _names(line1[5:])
+    end = len(line2) - 1
+    checks = {
+        "document_number": _check(number, _digits(line2[9])),
+        "birth_date": _check(birth, _digits(line2[19])),
+        "expiry_date": _check(expiry, _digits(line2[27])),
+        "composite": _check(line2[0:10] + _digits(line2[13:20]) + _digits(line2[21:28]) + line2[28:end], _digits(line2[end])),
+    }
+    if mrz_format == "TD3":
+        checks["personal_number"] = _check(line2[28:42], line2[42] if line2[42] == "<" else _digits(line2[42]))
+    return MRZResult(
+        format=mrz_format,
+        document_type=_letters(line1[0:2]).rstrip("<"),
+        issuing_country=_letters(line1[2:5]),
+        surname=surname,
+        given_names=given,
+        document_number=number.rstrip("<"),
+        nationality=_letters(line2[10:13]),
+        birth_date=_mrz_date(birth, future=False),
+        sex=line2[20],
+        expiry_date=_mrz_date(expiry, future=True),
+        checks=checks,
+        names_truncated=truncated,
+    )
+
+
+def _mrz_line(raw: str) -> Optional[str]:
+    """The line with OCR spacing removed if it looks like (part of) an MRZ line, else None."""
+    line = raw.replace(" ", "").replace("«", "<").upper()
+    if MRZ_CHARS.match(line) and ("<" in line or len(line) >= 28):
+        return line
+    return None
+
+
+def _fit(line: str, length: int) -> Optional[str]:
+    """Tolerate OCR dropping or adding a couple of trailing filler characters."""
+    if abs(len(line) - length) > 2:
+        return None
+    return line[:length].ljust(length, "<")
+
+
+def find_mrz(text: str) -> Optional[Tuple[str, List[str]]]:
+    """Locate MRZ lines in OCR output and return (format, lines)."""
+    candidates = []
+    for raw in text.splitlines():
+        line = _mrz_line(raw)
+        if line:
+            candidates.append(line)
+        elif candidates and len(candidates) >= 2:
+            break
+        else:
+            candidates = []
+
+    for mrz_format, (length, count) in MRZ_FORMATS.items():
+        for start in range(len(candidates) - count + 1):
+            lines = [_fit(line, length) for line in candidates[start:start + count]]
+            if all(lines):
+                return mrz_format, lines
+
+    # OCR may split one MRZ line into several boxes; try the MRZ characters as one stream
+    stream = "".join(candidates)
+    for mrz_format, (length, count) in MRZ_FORMATS.items():
+        if abs(len(stream) - length * count) <= 2:
+            stream = stream[:length * count].ljust(length * count, "<")
+            return mrz_format, [stream[i:i + length] for i in range(0, length * count, length)]
+    return None
+
+
+def parse_mrz(text: str) -> Optional[MRZResult]:
+    found = find_mrz(text)
+    if not found:
+        return None
+    mrz_format, lines = found
+    try:
+        return _parse_td1(lines) if mrz_format == "TD1" else _parse_td2_td3(lines, mrz_format)
+    except (IndexError, ValueError) as e:
+        logger.debug(f"MRZ found but not parseable: {e}")
+        return None
+
+
+def parse_labelled_fields(text: str) -> Dict[str, str]:
+    """Values of the Nume, Prenume and Domiciliu fields, each running until the next label or the MRZ."""
+    matches = list(_LABEL_PATTERN.finditer(text))
+    fields: Dict[str, str] = {}
+    for i, match in enumerate(matches):
+        key = match.lastgroup
+        if key in ("other", "role") or key in fields:
+            continue
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        value_lines = []
+        for line in text[match.end():end].splitlines():
+            if _mrz_line(line):
+                break
+            value_lines.append(line.strip().lstrip(":;-").strip())
+        value = " ".join(part for part in value_lines if part)
+        if value:
+            fields[key] = value
+    return fields
+
+
+def parse_id_document(text: str) -> Optional[PIIData]:
+    """
+    Extract the holder's name and address without a model call.
+
+    Returns None unless the text is a single ID document (a valid MRZ or an identity card
+    header, and each field label at most once, so deeds naming several parties go to the
+    model) and the result is confident: an address from the Domiciliu field, and a name
+    either from an MRZ whose check digits all pass or from both name fields, with the two
+    agreeing when both are present.
+    """
+    mrz = parse_mrz(text)
+    if mrz and not mrz.valid:
+        logger.debug(f"MRZ check digits failed: {mrz.checks}")
+        mrz = None
+    if not mrz and not ID_HEADER.search(text):
+        return None
+    labels = Counter(match.lastgroup for match in _LABEL_PATTERN.finditer(text))
+    if any(labels[key] > 1 for key in ("last_name", "first_name", "address")):
+        logger.debug(f"Field labels repeat, not a single ID document: {dict(labels)}")
+        return None
+    fields = parse_labelled_fields(text)
+
+    address = fields.get("address", "")
+    if len(address) < 8 or not ADDRESS_HINT.search(address):
+        return None
+
+    label_name = None
+    if NAME_VALUE.match(fields.get("last_name", "")) and NAME_VALUE.match(fields.get("first_name", "")):
+        label_name = f"{fields['last_name']} {fields['first_name']}"
+
+    if mrz and label_name:
+        mrz_tokens, printed_tokens = normalize_name(mrz.name).split(), normalize_name(label_name).split()
+        # The MRZ spells names without diacritics and may cut long ones short
+        truncated_match = mrz.names_truncated and all(
+            any(printed.startswith(token) for printed in printed_tokens) for token in mrz_tokens
+        )
+        if mrz_tokens != printed_tokens and not truncated_match:
+            logger.debug(f"MRZ name '{mrz.name}' does not match printed name '{label_name}'")
+            return None
+    name = label_name or (mrz.name if mrz else None)
+    if not name:
+        return None
+    return PIIData(name=name, address=address)
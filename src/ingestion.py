@@ -0,0 +1,375 @@
+"""
+Incremental watch-folder ingestion.
+
+Watches the data folder recursively (inotify when available, polling otherwise),
+waits until files stop changing, and extracts text and PII only from files that
+are new or changed according to a persistent SQLite manifest.
+
+    rye run python src/ingestion.py --folder data
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import (
+    DATA_FOLDER,
+    EXTRACTION_CONCURRENCY,
+    INGESTED_FOLDER,
+    INGESTION_DEBOUNCE_SECONDS,
+    INGESTION_MANIFEST,
+    INGESTION_POLL_INTERVAL,
+    JOB_DEADLINE_SECONDS,
+    OCR_TORCH_THREADS,
+    OCR_TUNING_FILE,
+)
+from deadlines import deadline
+from document_processing import SUPPORTED_EXTENSIONS, extract_text, get_documents, ocr_workers, start_ocr_workers
+from ocr_tuning import load_tuning
+from output_writer import atomic_write_bytes
+from tracing import span, start_trace
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+PENDING, PROCESSING, DONE, FAILED = "pending", "processing", "done", "failed"
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    SQLite record of every file seen: path, size, mtime, hash and processing status.
+
+    The daemon calls it from worker threads (hashing a large scan takes a while), so the
+    connection is shared under a lock.
+    """
+
+    def __init__(self, path: str = INGESTION_MANIFEST):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha256 TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result_path TEXT,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self.conn.commit()
+
+    def get(self, path: str) -> Optional[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+
+    def reset_interrupted(self) -> int:
+        """Files left in 'processing' by a crash or restart go back to pending."""
+        with self.lock:
+            cursor = self.conn.execute("UPDATE files SET status = ? WHERE status = ?", (PENDING, PROCESSING))
+            self.conn.commit()
+        return cursor.rowcount
+
+    def _update(self, sql: str, params: tuple) -> None:
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def needs_processing(self, path: str, size: int, mtime: float) -> Tuple[bool, Optional[str]]:
+        """
+        Decide whether a stable file must be processed. Blocks while hashing; run it in a thread.
+
+        Returns:
+            Tuple[bool, Optional[str]]: Whether to process it, and its hash if one was computed.
+        """
+        row = self.get(path)
+        if row and row["size"] == size and row["mtime"] == mtime:
+            if row["status"] == DONE or (row["status"] == FAILED and row["attempts"] >= MAX_ATTEMPTS):
+                return False, row["sha256"]
+            return True, row["sha256"]
+
+        sha256 = file_sha256(path)
+        if row and row["sha256"] == sha256 and row["status"] == DONE:
+            # Touched but not modified (e.g. copied with a new mtime)
+            self._update("UPDATE files SET size = ?, mtime = ?, updated_at = ? WHERE path = ?", (size, mtime, time.time(), path))
+            return False, sha256
+        if row and row["sha256"] != sha256:
+            # Content changed: start counting attempts again
+            self._update("UPDATE files SET attempts = 0 WHERE path = ?", (path,))
+        return True, sha256
+
+    def mark(self, path: str, status: str, size: int, mtime: float, sha256: Optional[str], error: Optional[str] = None, result_path: Optional[str] = None) -> None:
+        attempts_increment = 1 if status == PROCESSING else 0
+        self._update(
+            """INSERT INTO files (path, size, mtime, sha256, status, attempts, error, result_path, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(path) DO UPDATE SET
+                   size = excluded.size, mtime = excluded.mtime, sha256 = excluded.sha256,
+                   status = excluded.status, attempts = files.attempts + ?,
+                   error = excluded.error, result_path = COALESCE(excluded.result_path, files.result_path),
+                   updated_at = excluded.updated_at""",
+            (path, size, mtime, sha256, status, attempts_increment, error, result_path, time.time(), attempts_increment),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return {row[0]: row[1] for row in self.conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status")}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class Debouncer:
+    """Report files only once their size and mtime have been unchanged for `quiet_seconds`."""
+
+    def __init__(self, quiet_seconds: float = INGESTION_DEBOUNCE_SECONDS):
+        self.quiet_seconds = quiet_seconds
+        self._seen: Dict[str, Tuple[int, float, float]] = {}
+
+    def observe(self, paths: Iterable[str]) -> None:
+        now = time.monotonic()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._seen.pop(path, None)
+                continue
+            previous = self._seen.get(path)
+            if previous is None or previous[:2] != (stat.st_size, stat.st_mtime):
+                self._seen[path] = (stat.st_size, stat.st_mtime, now)
+
+    def ready(self) -> List[Tuple[str, int, float]]:
+        """Pop the files that have settled, re-checking their stat so late writes restart the timer."""
+        now = time.monotonic()
+        settled = []
+        for path, (size, mtime, changed_at) in list(self._seen.items()):
+            if now - changed_at < self.quiet_seconds:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._seen[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self._seen[path] = (stat.st_size, stat.st_mtime, now)
+                continue
+            del self._seen[path]
+            settled.append((path, size, mtime))
+        return settled
+
+
+class PollingWatcher:
+    """Rescan the folder tree every `interval` seconds."""
+
+    def __init__(self, folder: str, interval: float = INGESTION_POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+
+    async def watch(self, on_paths: Callable[[List[str]], None]) -> None:
+        while True:
+            on_paths(await asyncio.to_thread(get_documents, self.folder, True))
+            await asyncio.sleep(self.interval)
+
+
+class InotifyWatcher:
+    """Linux inotify watcher (needs the optional inotify_simple package); watches subfolders as they appear."""
+
+    def __init__(self, folder: str, rescan_interval: float = 300.0):
+        from inotify_simple import INotify, flags
+
+        self.folder = folder
+        self.flags = flags
+        self.inotify = INotify()
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY
+        self.watches: Dict[int, str] = {}
+        self.rescan_interval = rescan_interval
+        for root, _, _ in os.walk(folder):
+            self._add_watch(root)
+
+    def _add_watch(self, path: str) -> None:
+        self.watches[self.inotify.add_watch(path, self.mask)] = path
+
+    def _read(self) -> Tuple[List[str], bool]:
+        changed, overflow = [], False
+        for event in self.inotify.read(timeout=1000):
+            if event.mask & self.flags.Q_OVERFLOW:
+                overflow = True
+                continue
+            parent = self.watches.get(event.wd)
+            if parent is None:
+                continue
+            path = os.path.join(parent, event.name)
+            if event.mask & self.flags.ISDIR:
+                self._add_watch(path)
+                # Files may have landed before the watch existed
+                changed.extend(get_documents(path, True))
+            elif path.lower().endswith(SUPPORTED_EXTENSIONS):
+                changed.append(path)
+        return changed, overflow
+
+    async def watch(self, on_paths: Callable[[List[str]], None]) -> None:
+        on_paths(await asyncio.to_thread(get_documents, self.folder, True))
+        last_rescan = time.monotonic()
+        while True:
+            changed, overflow = await asyncio.to_thread(self._read)
+            if overflow or time.monotonic() - last_rescan > self.rescan_interval:
+                # Safety net for dropped events
+                changed = await asyncio.to_thread(get_documents, self.folder, True)
+                last_rescan = time.monotonic()
+            if changed:
+                on_paths(changed)
+
+
+def create_watcher(folder: str, force_polling: bool = False):
+    if not force_polling:
+        try:
+            return InotifyWatcher(folder)
+        except (ImportError, OSError) as e:
+            logger.info(f"inotify unavailable ({e}), falling back to polling")
+    return PollingWatcher(folder)
+
+
+async def ingest_file(path: str, sha256: str) -> str:
+    """Default handler: extract text and PII and save them as JSON under INGESTED_FOLDER."""
+    from ai_functions import extract_pii
+
+    text = await extract_text(path)
+    pii = await extract_pii(text)
+    # Name by content hash so same-named files in different subfolders never collide
+    result_path = os.path.join(INGESTED_FOLDER, f"{os.path.basename(path)}.{sha256[:12]}.json")
+    payload = {
+        "source": path,
+        "sha256": sha256,
+        "text": text,
+        "pii": [p.model_dump() for p in pii],
+    }
+    await asyncio.to_thread(atomic_write_bytes, result_path, json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8"))
+    return result_path
+
+
+class IngestionDaemon:
+    def __init__(
+        self,
+        folder: str = DATA_FOLDER,
+        manifest: Optional[Manifest] = None,
+        handler: Callable[[str, str], Awaitable[str]] = ingest_file,
+        concurrency: int = EXTRACTION_CONCURRENCY,
+        force_polling: bool = False,
+    ):
+        self.folder = folder
+        self.manifest = manifest or Manifest()
+        self.handler = handler
+        self.debouncer = Debouncer()
+        self.watcher = create_watcher(folder, force_polling)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def _process(self, path: str, size: int, mtime: float) -> None:
+        """Hash and check the file against the manifest, then ingest it if it is new or changed."""
+        try:
+            async with self.semaphore:
+                # Hashing and manifest writes block, so they run in threads and leave the loop to the watcher
+                try:
+                    process, sha256 = await asyncio.to_thread(self.manifest.needs_processing, path, size, mtime)
+                except FileNotFoundError:
+                    return
+                if not process:
+                    return
+                start_trace()
+                await asyncio.to_thread(self.manifest.mark, path, PROCESSING, size, mtime, sha256)
+                try:
+                    with span("ingest_file", file=os.path.basename(path)), deadline(JOB_DEADLINE_SECONDS):
+                        result_path = await self.handler(path, sha256)
+                    await asyncio.to_thread(self.manifest.mark, path, DONE, size, mtime, sha256, result_path=result_path)
+                    logger.info(f"Ingested {path} -> {result_path}")
+                except Exception as e:
+                    await asyncio.to_thread(self.manifest.mark, path, FAILED, size, mtime, sha256, error=str(e))
+                    logger.error(f"Failed to ingest {path}: {e}")
+        finally:
+            self.in_flight.discard(path)
+
+    def _dispatch_settled(self) -> None:
+        for path, size, mtime in self.debouncer.ready():
+            if path in self.in_flight:
+                # Changed while being processed; look at it again once the current run ends
+                self.debouncer.observe([path])
+                continue
+            self.in_flight.add(path)
+            task = asyncio.create_task(self._process(path, size, mtime))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, once: bool = False) -> None:
+        """Watch and process until cancelled; with once=True, drain the current folder contents and stop."""
+        os.makedirs(self.folder, exist_ok=True)
+        reset = await asyncio.to_thread(self.manifest.reset_interrupted)
+        if reset:
+            logger.info(f"Re-queued {reset} file(s) interrupted by the previous run")
+
+        if once:
+            self.debouncer.quiet_seconds = 0
+            self.debouncer.observe(get_documents(self.folder, recursive=True))
+            self._dispatch_settled()
+            await asyncio.gather(*self.tasks)
+            return
+
+        watch_task = asyncio.create_task(self.watcher.watch(self.debouncer.observe))
+        try:
+            while True:
+                await asyncio.sleep(min(1.0, max(self.debouncer.quiet_seconds / 2, 0.1)))
+                if watch_task.done():
+                    watch_task.result()
+                self._dispatch_settled()
+        finally:
+            watch_task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Watch a folder and ingest new or changed documents.")
+    parser.add_argument("--folder", default=DATA_FOLDER)
+    parser.add_argument("--once", action="store_true", help="Process what is there now and exit")
+    parser.add_argument("--poll", action="store_true", help="Use polling even when inotify is available")
+    args = parser.parse_args()
+
+    # Before the watcher and the event loop start any threads
+    start_ocr_workers()
+    daemon = IngestionDaemon(args.folder, force_polling=args.poll)
+    print(f"Watching {os.path.abspath(args.folder)} with {type(daemon.watcher).__name__}")
+    tuned = " (calibrated for this node)" if load_tuning(OCR_TUNING_FILE) else ""
+    if ocr_workers:
+        print(f"OCR: {ocr_workers.workers} worker(s), {ocr_workers.torch_threads} torch thread(s) each{tuned}")
+    else:
+        print(f"OCR: in-process, {OCR_TORCH_THREADS or 'default'} torch thread(s){tuned}")
+    try:
+        asyncio.run(daemon.run(once=args.once))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Manifest status: {daemon.manifest.counts()}")
+        daemon.manifest.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Job queue with leases, so several workers (and hosts) can share one backlog.
+
+A worker leases a job for a visibility timeout and keeps extending the lease
+while it runs. A job whose lease runs out (the worker crashed or hung) becomes
+visible again and is leased by another worker. Failures are retried with
+exponential backoff; jobs that keep failing, or fail permanently, are moved
+to the dead-letter state for inspection and manual requeue.
+
+SQLiteJobQueue is the built-in backend, for workers on one host; workers on
+several hosts need a broker plugged in by implementing JobQueue and registering
+a URL scheme with register_backend.
+"""
+import json
+import os
+import random
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+QUEUED, LEASED, DONE, DEAD = "queued", "leased", "done", "dead"
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_BASE = 10.0
+DEFAULT_BACKOFF_MAX = 600.0
+
+# SQLite's WAL index lives in shared memory, which these do not share between hosts
+NETWORK_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "ceph", "glusterfs", "lustre", "9p", "gpfs",
+    "fuse.sshfs", "fuse.glusterfs", "fuse.cephfs", "fuse.s3fs",
+}
+
+
+class PermanentJobError(Exception):
+    """A failure retrying cannot fix (bad payload, missing input); the job is dead-lettered at once."""
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and was taken over by another worker."""
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    payload: Dict[str, Any] = Field(default_factory=dict)
+    status: str = QUEUED
+    attempts: int = 0
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    lease_id: Optional[str] = None
+    lease_owner: Optional[str] = None
+    lease_expires: Optional[float] = None
+    available_at: float = 0.0
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+
+def backoff_delay(attempts: int, base: float = DEFAULT_BACKOFF_BASE, maximum: float = DEFAULT_BACKOFF_MAX) -> float:
+    """Exponential backoff with full jitter, so failed jobs from one outage do not retry in lockstep."""
+    return random.uniform(0, min(maximum, base * 2 ** max(attempts - 1, 0)))
+
+
+class JobQueue(ABC):
+    """Interface every backend implements. Lease ids guard against a worker finishing a job it no longer owns."""
+
+    @abstractmethod
+    def enqueue(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None, delay: float = 0.0) -> str:
+        ...
+
+    @abstractmethod
+    def lease(self, worker: str, visibility_timeout: float) -> Optional[Job]:
+        """Take the next visible job, or None. Counts as an attempt."""
+        ...
+
+    @abstractmethod
+    def extend(self, job: Job, visibility_timeout: float) -> None:
+        """Push the lease deadline out; raises LeaseLost if the job has been leased by someone else."""
+        ...
+
+    @abstractmethod
+    def complete(self, job: Job, result: Optional[Dict[str, Any]] = None) -> None:
+        ...
+
+    @abstractmethod
+    def fail(self, job: Job, error: str, permanent: bool = False) -> str:
+        """Record a failed attempt; returns the new status (queued for a retry, or dead)."""
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def requeue(self, job_id: str) -> bool:
+        """Give a dead job a fresh set of attempts."""
+        ...
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Job]:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Type of the filesystem holding path, from /proc/mounts (None where that is not available)."""
+    directory = os.path.dirname(os.path.realpath(path))
+    best, fs_type = "", None
+    try:
+        with open("/proc/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                # Spaces and tabs in mount points are written as octal escapes
+                mount_point = fields[1].encode().decode("unicode_escape")
+                if len(mount_point) > len(best) and (directory + "/").startswith(mount_point.rstrip("/") + "/"):
+                    best, fs_type = mount_point, fields[2]
+    except (OSError, IndexError):
+        return None
+    return fs_type
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Jobs in one SQLite file, for any number of worker processes on one host. Leasing runs in an
+    IMMEDIATE transaction, so two workers never lease the same job. The file must not be on a
+    network filesystem: WAL mode coordinates through shared memory that hosts do not share.
+
+    Calls block for up to the 30s busy timeout while another process holds the write lock, so
+    async callers run them in a thread; the connection is shared by those threads under a lock.
+    """
+
+    def __init__(self, path: str, backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_max: float = DEFAULT_BACKOFF_MAX):
+        fs_type = filesystem_type(path) if path != ":memory:" else None
+        if fs_type in NETWORK_FILESYSTEMS:
+            raise ValueError(
+                f"Job queue {path} is on a network filesystem ({fs_type}); the SQLite queue only works for workers on one host. "
+                "Register a broker for several hosts with job_queue.register_backend"
+            )
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                lease_id TEXT,
+                lease_owner TEXT,
+                lease_expires REAL,
+                available_at REAL NOT NULL,
+                error TEXT,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (status, available_at)")
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Job:
+        data = dict(row)
+        data["payload"] = json.loads(data["payload"])
+        data["result"] = json.loads(data["result"]) if data["result"] else None
+        return Job(**data)
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None, delay: float = 0.0) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                """INSERT INTO jobs (id, kind, payload, status, max_attempts, available_at, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job_id, kind, json.dumps(payload), QUEUED, max_attempts or DEFAULT_MAX_ATTEMPTS, now + delay, now, now),
+            )
+        return job_id
+
+    def lease(self, worker: str, visibility_timeout: float) -> Optional[Job]:
+        with self.lock:
+            return self._lease(worker, visibility_timeout)
+
+    def _lease(self, worker: str, visibility_timeout: float) -> Optional[Job]:
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases whose job has no attempts left go to the dead letters instead of running again
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = COALESCE(error, 'lease expired'), lease_id = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_expires <= ? AND attempts >= max_attempts",
+                (DEAD, now, LEASED, now),
+            )
+            row = self.conn.execute(
+                "SELECT id FROM jobs WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires <= ?) "
+                "ORDER BY available_at LIMIT 1",
+                (QUEUED, now, LEASED, now),
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            lease_id = uuid.uuid4().hex
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_id = ?, lease_owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                (LEASED, lease_id, worker, now + visibility_timeout, now, row["id"]),
+            )
+            job = self._job(self.conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+            self.conn.execute("COMMIT")
+            return job
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _update_leased(self, job: Job, sql: str, params: tuple) -> None:
+        with self.lock:
+            cursor = self.conn.execute(f"{sql} WHERE id = ? AND lease_id = ?", params + (job.id, job.lease_id))
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"Lease on job {job.id} was lost to another worker")
+
+    def extend(self, job: Job, visibility_timeout: float) -> None:
+        now = time.time()
+        self._update_leased(job, "UPDATE jobs SET lease_expires = ?, updated_at = ?", (now + visibility_timeout, now))
+
+    def complete(self, job: Job, result: Optional[Dict[str, Any]] = None) -> None:
+        self._update_leased(
+            job,
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_id = NULL, lease_expires = NULL, updated_at = ?",
+            (DONE, json.dumps(result) if result is not None else None, time.time()),
+        )
+
+    def fail(self, job: Job, error: str, permanent: bool = False) -> str:
+        now = time.time()
+        if permanent or job.attempts >= job.max_attempts:
+            status, available_at = DEAD, now
+        else:
+            status, available_at = QUEUED, now + backoff_delay(job.attempts, self.backoff_base, self.backoff_max)
+        self._update_leased(
+            job,
+            "UPDATE jobs SET status = ?, error = ?, available_at = ?, lease_id = NULL, lease_expires = NULL, updated_at = ?",
+            (status, error, available_at, now),
+        )
+        return status
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def requeue(self, job_id: str) -> bool:
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, available_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), time.time(), job_id, DEAD),
+            )
+        return cursor.rowcount > 0
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return {row[0]: row[1] for row in self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Job]:
+        with self.lock:
+            if status:
+                rows = self.conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT ?", (status, limit))
+            else:
+                rows = self.conn.execute("SELECT * FROM jobs ORDER BY created_at LIMIT ?", (limit,))
+            return [self._job(row) for row in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+BACKENDS: Dict[str, Callable[..., JobQueue]] = {
+    "sqlite": SQLiteJobQueue,
+}
+
+
+def register_backend(scheme: str, factory: Callable[..., JobQueue]) -> None:
+    """Make open_queue accept `<scheme>://<location>` URLs for another broker; factory(location, **options)."""
+    BACKENDS[scheme] = factory
+
+
+def open_queue(url: str, **options: Any) -> JobQueue:
+    """Open a queue from a URL such as sqlite:////var/lib/contracts/jobs.sqlite3 (a bare path means SQLite)."""
+    scheme, separator, location = url.partition("://")
+    if not separator:
+        scheme, location = "sqlite", url
+    elif scheme == "sqlite" and location.startswith("/"):
+        # sqlite:///relative/path and sqlite:////absolute/path, as in SQLAlchemy URLs
+        location = location[1:]
+    if scheme not in BACKENDS:
+        raise ValueError(f"Unsupported job queue backend: {scheme}. Must be one of {', '.join(BACKENDS)}")
+    return BACKENDS[scheme](location, **options)
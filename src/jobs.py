@@ -0,0 +1,174 @@
+"""
+Contract jobs that run without prompts, for queue workers (see worker.py).
+
+A job payload replaces the interactive answers:
+
+    {
+        "documents": ["data/id_seller.jpg", "data/id_buyer.pdf"],
+        "contract_type": "buy-sell",              # optional, detected from the documents when omitted
+        "roles": {"Ion Popescu": "Seller"},       # required when the documents name more than one person
+        "address": "Str. Lalelelor nr. 10",       # optional, otherwise the first named party's address
+        "additional_info": {"advance": "1000 EUR", "object_description": "apartment"},
+        "output_folder": "output_contracts"       # optional
+    }
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import ai_functions
+from config import OUTPUT_FOLDER, OUTPUT_FORMATS, TEMPLATES_FOLDER
+from contract_classifier import classify_contract
+from document_processing import document_kind, extract_text, iter_documents, load_templates
+from entity_resolution import normalize_name, resolve_documents
+from id_parser import NAME_VALUE, parse_id_document, parse_labelled_fields, parse_mrz
+from job_queue import PermanentJobError
+from models import ContractParties, ContractParty, ResolvedParty
+from output_writer import write_contract, write_sections
+from role_options import get_role_options
+from template_manager import TemplateManager
+from tracing import current_trace_id, span
+from validators import ContractRoleValidator
+
+logger = logging.getLogger(__name__)
+
+_templates: Optional[Dict[str, Dict[str, str]]] = None
+
+
+def get_templates() -> Dict[str, Dict[str, str]]:
+    """The template registry, loaded once per process so workers and the daemon reuse it across jobs."""
+    global _templates
+    if _templates is None:
+        _templates = load_templates(TEMPLATES_FOLDER)
+    return _templates
+
+
+def assign_roles(people: List[ResolvedParty], contract_type: str, roles: Optional[Dict[str, str]] = None) -> ContractParties:
+    """Parties from the payload's name -> role map; without one, only a single person gets a role by default."""
+    if roles:
+        by_name = {normalize_name(person.name): person for person in people}
+        parties = []
+        for name, role in roles.items():
+            person = by_name.get(normalize_name(name))
+            if person is None:
+                raise PermanentJobError(f"{name} was not found in the documents")
+            parties.append(ContractParty(name=person.name, roles=[role]))
+        return ContractParties(parties=parties)
+
+    if len(people) > 1:
+        # Document order says nothing about who sells and who buys
+        names = ", ".join(person.name for person in people)
+        raise PermanentJobError(f"Found {len(people)} people ({names}); pass their roles in the job payload")
+    options = get_role_options(contract_type)
+    if not options:
+        raise PermanentJobError(f"No roles known for contract type {contract_type}; pass them in the job payload")
+    return ContractParties(parties=[ContractParty(name=people[0].name, roles=[options[0]])])
+
+
+def contract_address(people: List[ResolvedParty], parties: ContractParties, address: Optional[str] = None) -> str:
+    """The payload's address, or the address found for the first named party."""
+    if address:
+        return address
+    by_name = {person.name: person for person in people}
+    first = by_name[parties.parties[0].name]
+    if not first.address:
+        raise PermanentJobError(f"No address found for {first.name}; pass it in the job payload")
+    return first.address
+
+
+async def run_contract_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build a contract from the documents in the payload and write it to the output folder.
+
+    Raises PermanentJobError for payloads no retry can fix; anything else is retried by the worker.
+    """
+    documents = payload.get("documents") or []
+    if not documents:
+        raise PermanentJobError("Job payload has no documents")
+    missing = [doc for doc in documents if not os.path.exists(doc)]
+    if missing:
+        raise PermanentJobError(f"Documents not found: {', '.join(missing)}")
+
+    templates = await asyncio.to_thread(get_templates)
+    # ExtractionError is retried by the worker like any other transient failure
+    texts = {path: text async for path, text in iter_documents(documents, strict=True)}
+
+    pii_lists = await asyncio.gather(*(ai_functions.extract_pii(text) for text in texts.values()))
+    people = resolve_documents(dict(zip(texts, pii_lists)))
+    if not people:
+        raise PermanentJobError("No people found in the documents")
+
+    contract_type = payload.get("contract_type")
+    if not contract_type:
+        result = classify_contract("\n".join(texts.values()), templates)
+        if not result.is_confident:
+            raise PermanentJobError(f"Contract type is ambiguous (best guess: {result.contract_type}); pass it in the job payload")
+        contract_type = result.contract_type
+    try:
+        contract_type = ContractRoleValidator.validate_contract_type(contract_type)
+        template = TemplateManager(templates).get_template(contract_type)
+    except (ValueError, FileNotFoundError) as e:
+        raise PermanentJobError(str(e)) from e
+
+    parties = assign_roles(people, contract_type, payload.get("roles"))
+    address = contract_address(people, parties, payload.get("address"))
+    additional_info = {key: str(value) for key, value in (payload.get("additional_info") or {}).items()}
+
+    with span("contract_job", contract_type=contract_type, documents=len(documents), people=len(people)):
+        sections = await ai_functions.construct_contract_sections(
+            contract_type=contract_type,
+            parties=parties,
+            address=address,
+            additional_info=additional_info,
+            template=template
+        )
+        paths = await write_contract(
+            sections.text(), contract_type, payload.get("output_folder") or OUTPUT_FOLDER, OUTPUT_FORMATS, job_id=current_trace_id()
+        )
+        await write_sections(paths["txt"], sections.model_dump_json(indent=2))
+
+    logger.info(f"Contract job wrote {paths['txt']}")
+    return {
+        "contract_path": paths["txt"],
+        "outputs": paths,
+        "contract_type": contract_type,
+        "parties": [party.model_dump() for party in parties.parties],
+    }
+
+
+async def run_id_check(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    OCR one ID image and read the holder from it without a model call, for the chatbot's identity stage.
+
+    The name comes from a confident parse when there is one, else from a valid MRZ or the printed name fields.
+    """
+    image = payload.get("image")
+    if not image or not os.path.exists(image):
+        raise PermanentJobError(f"ID image not found: {image}")
+    if document_kind(image) == "text":
+        raise PermanentJobError(f"Not an image or PDF: {image}")
+
+    text = await extract_text(image)
+    mrz = parse_mrz(text)
+    if mrz and not mrz.valid:
+        mrz = None
+    pii = parse_id_document(text)
+    fields = parse_labelled_fields(text)
+    name = pii.name if pii else None
+    if not name and mrz:
+        name = mrz.name
+    if not name and NAME_VALUE.match(fields.get("last_name", "")) and NAME_VALUE.match(fields.get("first_name", "")):
+        name = f"{fields['last_name']} {fields['first_name']}"
+    return {
+        "name": name,
+        "address": pii.address if pii else fields.get("address"),
+        "confident": pii is not None,
+        "expiry_date": mrz.expiry_date if mrz else None,
+    }
+
+
+JOB_HANDLERS = {
+    "contract": run_contract_job,
+    "id_check": run_id_check,
+}
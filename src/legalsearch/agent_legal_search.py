@@ -1,8 +1,17 @@
 import os
+import sys
+from pathlib import Path
 from typing import Annotated
 from dotenv import load_dotenv
 from openai import OpenAI
 
+# Shared pipeline helpers live in the parent src folder
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from token_budget import TRUNCATE, guard_messages, record_usage
+
+# Prompt tokens allowed per research call; longer prompts are truncated
+MAX_PROMPT_TOKENS = 16_000
+
 
 
 
@@ -99,12 +108,13 @@ Your task is to:
 def ask_openai(prompt: str) -> str:
     response = client.chat.completions.create(
         model="gpt-4o-mini",  # Using latest model
-        messages=[
+        messages=guard_messages([
             {"role": "user", "content": prompt}
-        ],
+        ], "gpt-4o-mini", MAX_PROMPT_TOKENS, TRUNCATE),
         max_tokens=500,
         temperature=0.5
     )
+    record_usage(response.usage)
     return response.choices[0].message.content
 
 # Example Workflow
@@ -0,0 +1,175 @@
+"""
+Non-blocking logging.
+
+Callers only put records on an in-memory queue; a background QueueListener thread
+formats them (JSON lines or the classic text format) and writes them to a
+size-rotated file, so no disk I/O happens on the event loop. High-volume DEBUG
+call sites are sampled, and payloads (document text, prompts, request bodies)
+are dropped unless LOG_PAYLOADS is enabled.
+"""
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from tracing import current_trace_id
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# HTTP client libraries log full request bodies (prompts, document text) at DEBUG
+PAYLOAD_LOGGERS = ("openai", "httpx", "httpcore", "instructor")
+
+# Every DEBUG call site logs this many records in full before sampling starts
+SAMPLE_AFTER = 20
+
+# Attributes of every LogRecord; anything else was passed with `extra=` and goes into the JSON output
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class DebugSampler(logging.Filter):
+    """Keep the first SAMPLE_AFTER DEBUG records of each call site, then one in every 1/rate."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.counts: Dict[Tuple[str, int], int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        site = (record.pathname, record.lineno)
+        self.counts[site] += 1
+        count = self.counts[site]
+        if count <= SAMPLE_AFTER:
+            return True
+        # Deterministic: keep a record whenever the running total crosses a whole number
+        return int(count * self.rate) != int((count - 1) * self.rate)
+
+
+class PayloadFilter(logging.Filter):
+    """Drop payload bodies: the `payload` extra field and DEBUG output of the HTTP client libraries."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and record.name.startswith(PAYLOAD_LOGGERS):
+            return False
+        if hasattr(record, "payload"):
+            record.payload = "[omitted]"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the standard fields, the job's trace id and any `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that captures the trace id while still in the caller's context
+    and leaves all formatting to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.trace_id = current_trace_id()
+        # Resolve the message and traceback now: args and exc_info may not survive the hand-off
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(
+    filename: Optional[str] = None,
+    level: int = logging.DEBUG,
+    json_format: bool = True,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    debug_sample_rate: float = 1.0,
+    log_payloads: bool = False,
+) -> None:
+    """
+    Route all logging through a queue to a background writer; safe to call more than once.
+
+    Args:
+        filename: Log file, rotated at `max_bytes`; None logs to stderr.
+        level: Root logger level.
+        json_format: JSON lines, or the classic text format when False.
+        debug_sample_rate: Fraction of DEBUG records kept per call site once it gets busy.
+        log_payloads: Keep payload bodies (prompts, document text, request bodies) in the log.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if filename:
+        target: logging.Handler = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        target = logging.StreamHandler()
+    target.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = ContextQueueHandler(records)
+    handler.addFilter(DebugSampler(debug_sample_rate))
+    if not log_payloads:
+        handler.addFilter(PayloadFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+@contextlib.contextmanager
+def logging_paused():
+    """Stop the writer thread for the duration (records queue up meanwhile), e.g. while forking."""
+    listener = _listener
+    if listener is not None:
+        listener.stop()
+    try:
+        yield
+    finally:
+        if listener is not None:
+            listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
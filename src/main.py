@@ -1,18 +1,29 @@
+import argparse
 import asyncio
 import nest_asyncio
 import logging
 import os
 import traceback
-from document_processing import process_documents, load_templates
+from document_processing import iter_documents, process_documents, load_templates, start_ocr_workers
 from ai_functions import extract_pii, identify_parties, construct_contract, determine_contract_details, determine_contract_type
 from utils import verify_information
 from models import PIIData, ContractParties, Contract, AgentState, ContractDetails, ContractParty
-from config import TEMPLATES_FOLDER, OUTPUT_FOLDER
-from typing import List, Dict
+from config import TEMPLATES_FOLDER, OUTPUT_FOLDER, OUTPUT_FORMATS, TRACE_FILE, TRACE_OTEL, MAX_TOKENS_PER_JOB, JOB_DEADLINE_SECONDS, REVIEW_UI, REVIEW_WEB_PORT, PROFILE, PROFILE_SECONDS, PROFILE_INTERVAL_MS, PROFILE_FOLDER
+from typing import List, Dict, Optional
 from template_manager import TemplateManager
+from contract_classifier import classify_contract, template_contract_type
+from tracing import configure_tracing, current_trace_id, span, start_trace
+from output_writer import shutdown_render_pool, write_contract, write_sections
+from stage_graph import Stage, StageGraph, Stream
+from token_budget import start_job_budget
+from model_router import routing_report, start_job_routing
+from openai_client import limiter
+from deadlines import deadline
+from review_queue import run_review
+from role_options import get_role_options
 import ai_functions
+from profiling import add_profile_arguments, configure_profiling
 from prompts import SYSTEM_PROMPT 
-from datetime import datetime
 
 
 # Apply nest_asyncio to allow nested asyncio calls
@@ -21,13 +32,57 @@ nest_asyncio.apply()
 # Maximum number of retries allowed during PII verification
 MAX_RETRIES = 3
 
-# Set up logging
-logging.basicConfig(filename='agent_workflow.log', level=logging.DEBUG, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+configure_tracing(TRACE_FILE, otel=TRACE_OTEL)
 
 print(f"Current working directory: {os.getcwd()}")
 print(f"Templates folder path: {os.path.abspath(TEMPLATES_FOLDER)}")
 
+async def extract_document_pii(documents: Stream, extracted_pii: Stream) -> None:
+    """
+    Extract PII from each document as soon as its text is available.
+    
+    Args:
+        documents (Stream): Stream of (path, text) pairs from the extraction stage.
+        extracted_pii (Stream): Receives (path, PII list) pairs in the order extraction finishes.
+    """
+    async def extract(doc: str, text: str) -> None:
+        await extracted_pii.put((doc, await extract_pii(text)))
+
+    tasks = []
+    async for doc, text in documents:
+        tasks.append(asyncio.create_task(extract(doc, text)))
+    await asyncio.gather(*tasks)
+
+async def review_extracted_pii(
+    state: AgentState,
+    extracted_pii: Stream,
+    contract_roles: Optional[Stream] = None,
+    prompt_lock: Optional[asyncio.Lock] = None,
+) -> None:
+    """
+    Let the user confirm or correct every person, and their role, in one batch.
+    
+    The review starts while documents are still being extracted; people appear on the
+    review screen as their documents finish.
+    
+    Args:
+        state (AgentState): The current state of the agent.
+        extracted_pii (Stream): (path, PII list) pairs from the extraction stage.
+        contract_roles (Optional[Stream]): Yields the roles once the contract type is known;
+            without it the roles come from the contract type already in the state.
+        prompt_lock (Optional[asyncio.Lock]): Shared by the stages that prompt in the terminal.
+    """
+    roles = None
+    if contract_roles is None and state.contract_details:
+        roles = get_role_options(state.contract_details.contract_type)
+    verified_pii_data, parties = await run_review(
+        extracted_pii, roles, ui=REVIEW_UI, port=REVIEW_WEB_PORT, pending_roles=contract_roles, prompt_lock=prompt_lock
+    )
+    state.verified_pii_data = verified_pii_data
+    if parties:
+        state.parties = parties
+    print(f"Verified PII data: {len(state.verified_pii_data)} entries")
+
 async def process_pii_extraction(state: AgentState, documents: Dict[str, str]) -> None:
     """
     Extract and verify PII from documents.
@@ -36,47 +91,65 @@ async def process_pii_extraction(state: AgentState, documents: Dict[str, str]) -
         state (AgentState): The current state of the agent.
         documents (Dict[str, str]): The processed documents.
     """
-    verified_pii_data = []
-    for doc, text in documents.items():
-        pii_list: List[PIIData] = await extract_pii(text)
-        for pii in pii_list:
-            print("Please verify the following information:")
-            print(f"Name: {pii.name}")
-            print(f"Address: {pii.address}")
-            is_correct = input("Is this information correct? (yes/no): ").lower()
-            if is_correct == 'yes':
-                verified_pii_data.append(pii)
-            else:
-                name = input("Please provide the correct name: ")
-                address = input("Please provide the correct address: ")
-                verified_pii_data.append(PIIData(name=name, address=address))
-    
-    state.verified_pii_data = verified_pii_data
-    print(f"Verified PII data: {len(state.verified_pii_data)} entries")
+    texts, extracted = Stream("documents"), Stream("extracted_pii")
+    for item in documents.items():
+        await texts.put(item)
+    await texts.close()
+
+    async def extract_all() -> None:
+        try:
+            await extract_document_pii(texts, extracted)
+        except BaseException as e:
+            await extracted.close(e)
+            raise
+        await extracted.close()
+
+    extraction = asyncio.create_task(extract_all())
+    await review_extracted_pii(state, extracted)
+    await extraction
 
-async def determine_contract_type(state: AgentState, templates: Dict[str, Dict]) -> None:
+async def determine_contract_type(
+    state: AgentState,
+    templates: Dict[str, Dict],
+    documents: Optional[Dict[str, str]] = None,
+    prompt_lock: Optional[asyncio.Lock] = None,
+) -> None:
     """
-    Allow the user to choose the contract type based on available templates.
+    Determine the contract type from the document content, asking the user only when ambiguous.
     
     Args:
         state (AgentState): The current state of the agent.
         templates (Dict[str, Dict]): The loaded contract templates.
+        documents (Optional[Dict[str, str]]): The processed documents used for classification.
+        prompt_lock (Optional[asyncio.Lock]): Held while asking, so the question does not
+            interleave with the review prompt.
     """
-    available_templates = list(templates.keys())
-    print("\nAvailable contract types:")
-    print("1. airbnb")
-    print("2. buy-sell")
-    print("3. it")
+    if documents:
+        result = classify_contract("\n".join(documents.values()), templates)
+        logging.debug(f"Contract type scores: {result.scores} (confidence {result.confidence:.2f})")
+        if result.is_confident:
+            state.contract_details = ContractDetails(contract_type=result.contract_type, additional_info={})
+            print(f"\nDetected contract type: {result.contract_type} (confidence {result.confidence:.2f})")
+            return
+        if result.contract_type:
+            print(f"\nContract type is ambiguous (best guess: {result.contract_type}).")
 
-    while True:
-        contract_type = input("Please choose a contract type (1-3): ")
-        if contract_type in ["1", "2", "3"]:
-            contract_type = {"1": "airbnb", "2": "buy-sell", "3": "it"}.get(contract_type)
-            state.contract_details = ContractDetails(contract_type=contract_type, additional_info={})
-            print(f"\nSelected contract type: {state.contract_details.contract_type}")
-            break
-        else:
-            print(f"Invalid choice. Please enter a number between 1 and 3.")
+    contract_types = sorted({template_contract_type(name, t.get("metadata")) for name, t in templates.items()})
+    async with prompt_lock or asyncio.Lock():
+        print("\nAvailable contract types:")
+        for i, contract_type in enumerate(contract_types, start=1):
+            print(f"{i}. {contract_type}")
+
+        while True:
+            # Asked in a thread, so extraction and the review keep running meanwhile
+            selection = (await asyncio.to_thread(input, f"Please choose a contract type (1-{len(contract_types)}): ")).strip()
+            if selection.isdigit() and 1 <= int(selection) <= len(contract_types):
+                contract_type = contract_types[int(selection) - 1]
+                state.contract_details = ContractDetails(contract_type=contract_type, additional_info={})
+                print(f"\nSelected contract type: {state.contract_details.contract_type}")
+                break
+            else:
+                print(f"Invalid choice. Please enter a number between 1 and {len(contract_types)}.")
 
 async def identify_contract_parties(state: AgentState) -> None:
     """
@@ -89,11 +162,33 @@ async def identify_contract_parties(state: AgentState) -> None:
         print("Contract type has not been determined yet. Please determine the contract type first.")
         return
     
-    state.parties = await ai_functions.identify_parties(state.verified_pii_data, state.contract_details.contract_type)
+    # Roles already confirmed in the batch review need no further prompts
+    if not state.parties:
+        with span("identify_parties", contract_type=state.contract_details.contract_type, people=len(state.verified_pii_data)):
+            state.parties = await ai_functions.identify_parties(state.verified_pii_data, state.contract_details.contract_type)
     print("\nIdentified parties:")
     for party in state.parties.parties:
         print(f"{', '.join(party.roles)}: {party.name}")
 
+async def save_contract(state: AgentState) -> str:
+    """
+    Write the contract in the configured formats, plus its sections (with input hashes)
+    next to the text file so a later edit can start from them.
+    
+    Args:
+        state (AgentState): The current state of the agent.
+    """
+    contract_type = state.contract_details.contract_type
+    paths = await write_contract(state.contract.content, contract_type, OUTPUT_FOLDER, OUTPUT_FORMATS, job_id=current_trace_id())
+    filepath = paths["txt"]
+    for fmt, path in paths.items():
+        if fmt != "txt":
+            print(f"Contract {fmt.upper()} saved to: {path}")
+    if state.contract_sections:
+        await write_sections(filepath, state.contract_sections.model_dump_json(indent=2))
+    print(f"Contract has been saved to: {filepath}")
+    return filepath
+
 async def construct_final_contract(state: AgentState, template_manager: TemplateManager) -> str:
     """
     Construct the final contract based on the determined details and parties.
@@ -105,6 +200,7 @@ async def construct_final_contract(state: AgentState, template_manager: Template
     if not state.contract_details or not state.parties:
         print("Contract details or parties have not been determined yet. Please complete these steps first.")
         return None
+    filepath = None
     
     contract_type = state.contract_details.contract_type
     address = state.verified_pii_data[0].address if state.verified_pii_data else "Address not provided"
@@ -113,32 +209,66 @@ async def construct_final_contract(state: AgentState, template_manager: Template
     template = template_manager.get_template(contract_type)
     
     try:
-        state.contract = await ai_functions.construct_contract(
+        state.contract_sections = await ai_functions.construct_contract_sections(
             contract_type=contract_type,
             parties=state.parties,
             address=address,
             additional_info=additional_info,
-            template=template
+            template=template,
+            previous=state.contract_sections
         )
+        state.contract = Contract(content=state.contract_sections.text())
         print("Contract constructed.")
         
-        # Create output folder if it doesn't exist
-        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-        
-        # Generate a unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{contract_type}_{timestamp}.txt"
-        filepath = os.path.join(OUTPUT_FOLDER, filename)
-        
-        # Save the contract to a file
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(state.contract.content)
-        
-        print(f"Contract has been saved to: {filepath}")
+        # Save the contract (and any extra formats) without blocking the event loop
+        filepath = await save_contract(state)
     except Exception as e:
         print(f"Error constructing contract: {str(e)}")
     return filepath
 
+async def edit_contract_fields(state: AgentState, template_manager: TemplateManager, contract_path: Optional[str]) -> Optional[str]:
+    """
+    Let the user correct a field of the finished contract and regenerate only the sections that use it.
+    
+    Args:
+        state (AgentState): The current state of the agent.
+        template_manager (TemplateManager): The template manager instance.
+        contract_path (Optional[str]): Path of the contract written by the construct stage.
+    """
+    if not state.contract_sections:
+        return contract_path
+
+    while True:
+        fields = [("address", "Address")]
+        fields += [(f"info:{key}", key.replace("_", " ").capitalize()) for key in state.contract_details.additional_info]
+        fields += [(f"party:{i}", f"Name of {', '.join(party.roles)}") for i, party in enumerate(state.parties.parties)]
+        print("\nFields used in the contract:")
+        for i, (_, label) in enumerate(fields, start=1):
+            print(f"{i}. {label}")
+        selection = input(f"Select a field to change (1-{len(fields)}), or press Enter to finish: ").strip()
+        if not selection:
+            return contract_path
+        if not selection.isdigit() or not 1 <= int(selection) <= len(fields):
+            print(f"Invalid choice. Please enter a number between 1 and {len(fields)}.")
+            continue
+
+        field, label = fields[int(selection) - 1]
+        value = input(f"New value for {label}: ").strip()
+        if field == "address":
+            if state.verified_pii_data:
+                state.verified_pii_data[0].address = value
+            else:
+                state.verified_pii_data.append(PIIData(name="", address=value))
+        elif field.startswith("info:"):
+            state.contract_details.additional_info[field[len("info:"):]] = value
+        else:
+            state.parties.parties[int(field[len("party:"):])].name = value
+
+        path = await construct_final_contract(state, template_manager)
+        if path:
+            contract_path = path
+            print(f"Regenerated {len(state.contract_sections.regenerated)} of {len(state.contract_sections.sections)} sections.")
+
 async def collect_payment_details(state: AgentState) -> None:
     """
     Collect payment details for buy-sell contracts.
@@ -182,23 +312,79 @@ async def collect_object_details(state: AgentState) -> None:
     state.contract_details.object_description = object_description
     state.contract_details.additional_info["object_description"] = object_description
 
-async def agent_workflow() -> None:
+def build_workflow_graph() -> StageGraph:
     """
-    Main agent workflow for processing documents and constructing a contract.
+    Describe the workflow as stages with explicit inputs and outputs.
+    
+    Document extraction streams into PII extraction, so a document's PII request starts
+    while later documents are still being OCR'd, and templates load in parallel.
+    PII results stream into the batch review, which starts at once, so the reviewer confirms
+    people while later documents are still being OCR'd and extracted; their roles are
+    proposed as soon as the contract type is known. The review and the contract type
+    question share a prompt lock; later interactive stages are chained with `after`.
     """
-    try:
-        templates = load_templates(TEMPLATES_FOLDER)
-        template_manager = TemplateManager(templates)
-        documents = await process_documents()
+    async def load_template_registry():
+        templates = await asyncio.to_thread(load_templates, TEMPLATES_FOLDER)
+        return {"templates": templates, "template_manager": TemplateManager(templates)}
+
+    async def extract_documents(documents: Stream):
+        async for item in iter_documents():
+            await documents.put(item)
+
+    async def collect_documents(documents: Stream):
+        texts = dict(await documents.collect())
         print("Documents processed.")
-        state = AgentState()
-        
-        await process_pii_extraction(state, documents)
-        await determine_contract_type(state, templates)
+        return texts
+
+    async def review(state, extracted_pii, contract_roles, prompt_lock):
+        await review_extracted_pii(state, extracted_pii, contract_roles, prompt_lock)
+
+    async def choose_contract_type(state, templates, document_texts, prompt_lock, contract_roles: Stream):
+        await determine_contract_type(state, templates, document_texts, prompt_lock)
+        await contract_roles.put(get_role_options(state.contract_details.contract_type))
+
+    async def parties(state):
         await identify_contract_parties(state)
+
+    async def object_details(state):
         await collect_object_details(state)
+
+    async def payment_details(state):
         await collect_payment_details(state)
-        filepath = await construct_final_contract(state, template_manager)
+
+    async def construct(state, template_manager):
+        return await construct_final_contract(state, template_manager)
+
+    async def edit(state, template_manager, contract_path):
+        return await edit_contract_fields(state, template_manager, contract_path)
+
+    return StageGraph([
+        Stage("load_templates", load_template_registry, outputs=["templates", "template_manager"]),
+        Stage("extract_documents", extract_documents, streams=["documents"]),
+        Stage("collect_documents", collect_documents, inputs=["documents"], outputs=["document_texts"]),
+        Stage("extract_pii", extract_document_pii, inputs=["documents"], streams=["extracted_pii"]),
+        Stage("contract_type", choose_contract_type, inputs=["state", "templates", "document_texts", "prompt_lock"], streams=["contract_roles"]),
+        Stage("review_pii", review, inputs=["state", "extracted_pii", "contract_roles", "prompt_lock"]),
+        Stage("identify_parties", parties, inputs=["state"], after=["review_pii", "contract_type"]),
+        Stage("object_details", object_details, inputs=["state"], after=["identify_parties"]),
+        Stage("payment_details", payment_details, inputs=["state"], after=["object_details"]),
+        Stage("construct_contract", construct, inputs=["state", "template_manager"], outputs=["contract_path"], after=["payment_details"]),
+        Stage("edit_contract", edit, inputs=["state", "template_manager", "contract_path"], outputs=["final_contract_path"]),
+    ])
+
+async def agent_workflow() -> None:
+    """
+    Main agent workflow for processing documents and constructing a contract.
+    """
+    trace_id = start_trace()
+    budget = start_job_budget(MAX_TOKENS_PER_JOB)
+    routes = start_job_routing()
+    logging.info(f"Starting contract job {trace_id}")
+    state = AgentState()
+    try:
+        with deadline(JOB_DEADLINE_SECONDS):
+            results = await build_workflow_graph().run({"state": state, "prompt_lock": asyncio.Lock()})
+        filepath = results.get("final_contract_path") or results.get("contract_path")
         
         if state.contract:
             print("\nFinal contract:")
@@ -212,8 +398,18 @@ async def agent_workflow() -> None:
         print(f"An error occurred: {str(e)}")
         logging.error(f"Error in agent_workflow: {str(e)}", exc_info=True)
     finally:
+        logging.info(f"Token usage for job {trace_id}: {budget.summary()}")
+        logging.info(f"Model routing for job {trace_id}: {routing_report(routes)}")
+        logging.info(f"Upstream concurrency for job {trace_id}: {limiter.snapshot()}")
+        shutdown_render_pool()
         print("\nContract automation process has been completed.")
         input("Press Enter to exit...")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a contract from the documents in the data folder.")
+    add_profile_arguments(parser, PROFILE, PROFILE_SECONDS)
+    args = parser.parse_args()
+    # Before profiling or the event loop start any threads
+    start_ocr_workers()
+    configure_profiling(args.profile.split(","), args.profile_seconds, PROFILE_INTERVAL_MS, PROFILE_FOLDER)
     asyncio.run(agent_workflow())
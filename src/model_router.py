@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from instructor.exceptions import InstructorRetryException
+from openai import APIError, APITimeoutError
+from pydantic import ValidationError
+
+from concurrency import CircuitOpen, LoadShed
+from deadlines import DeadlineExceeded, LatencyTracker, call_timeout, hedged, remaining
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Models tried in order for each task. A later model is only called when the result of the
+# previous one fails the response schema or the task's local checks.
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "extract_pii": ["gpt-4o-mini", "gpt-4o"],
+    "contract_details": ["gpt-4o-mini", "gpt-4o"],
+    "construct_contract": ["gpt-4o-mini", "gpt-4o"],
+    "agent_action": ["gpt-4o-mini", "gpt-4o"],
+    "validate": ["gpt-4o-mini"],
+}
+
+# Upper bound for a single model call (including instructor's own retries) when the job has no tighter deadline
+DEFAULT_CALL_TIMEOUT = 120.0
+
+# Hedging delay used until enough calls have been seen to know the route's p95 latency
+DEFAULT_HEDGE_DELAY = 10.0
+
+# A check on a parsed result: returns why the result is not good enough, or None to accept it
+Validator = Callable[[Any], Optional[str]]
+
+
+def parse_routes(spec: str, defaults: Optional[Dict[str, List[str]]] = None) -> Dict[str, List[str]]:
+    """
+    Parse route overrides such as "extract_pii=gpt-4o-mini>gpt-4o;construct_contract=gpt-4o".
+
+    Tasks that are not mentioned keep their default route.
+    """
+    routes = {task: list(models) for task, models in (DEFAULT_ROUTES if defaults is None else defaults).items()}
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        task, _, models = entry.partition("=")
+        models_list = [model.strip() for model in models.split(">") if model.strip()]
+        if not task.strip() or not models_list:
+            raise ValueError(f"Invalid model route: '{entry}'. Expected task=model[>model...]")
+        routes[task.strip()] = models_list
+    return routes
+
+
+def _failure_reason(error: BaseException) -> Optional[str]:
+    """
+    Classify a failed attempt: "timeout", "schema" (the output did not validate), or None for
+    errors escalation cannot fix. Instructor wraps whatever ended its retries, so look at the causes.
+    """
+    while error is not None:
+        if isinstance(error, (CircuitOpen, LoadShed)):
+            return None
+        if isinstance(error, (asyncio.TimeoutError, APITimeoutError)):
+            return "timeout"
+        if isinstance(error, APIError):
+            return None
+        if isinstance(error, ValidationError):
+            return "schema"
+        error = error.__cause__ or error.__context__
+    return "schema"
+
+
+def _find_cause(error: BaseException, types: tuple) -> Optional[BaseException]:
+    while error is not None and not isinstance(error, types):
+        error = error.__cause__ or error.__context__
+    return error
+
+
+class RouteStats:
+    """Per-task counters: which model served each call and how often the cheap model was not enough."""
+
+    def __init__(self):
+        self.calls = 0
+        self.escalations = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.served_by: Dict[str, int] = {}
+        self.reasons: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "escalations": self.escalations,
+            "escalation_rate": round(self.escalations / self.calls, 4) if self.calls else 0.0,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "served_by": dict(self.served_by),
+            "reasons": dict(self.reasons),
+        }
+
+    def merge(self, other: "RouteStats") -> None:
+        for counter in ("calls", "escalations", "failures", "timeouts", "hedges", "hedge_wins"):
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        for mine, theirs in ((self.served_by, other.served_by), (self.reasons, other.reasons)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+
+
+# Routing stats of the running job; processes such as the daemon run many jobs, so the router's own
+# totals cannot be reported per job
+_job_routes: ContextVar[Optional[Dict[str, RouteStats]]] = ContextVar("job_routes", default=None)
+
+
+def start_job_routing() -> Dict[str, RouteStats]:
+    """Collect routing stats for the current context (one per contract job)."""
+    routes: Dict[str, RouteStats] = {}
+    _job_routes.set(routes)
+    return routes
+
+
+def routing_report(routes: Dict[str, RouteStats]) -> Dict[str, Dict[str, Any]]:
+    return {task: stats.to_dict() for task, stats in routes.items()}
+
+
+class ModelRouter:
+    """
+    Send each task to its cheapest configured model and escalate only when needed.
+
+    A result is escalated to the next model of the route when it does not parse into
+    the response model, or when a task validator rejects it (e.g. an implausible name
+    or an empty contract). The last model's result is returned even if a validator
+    still rejects it, as a single-model call would have.
+
+    Every call gets a timeout of at most `call_timeout`, shortened to whatever is left
+    of the job deadline (see deadlines.deadline). Calls for `hedge_tasks`, which must be
+    idempotent, are hedged: when the first request is slower than the route's p95, an
+    identical second request is sent and the first result to arrive is used.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        routes: Optional[Dict[str, List[str]]] = None,
+        call_timeout: Optional[float] = DEFAULT_CALL_TIMEOUT,
+        hedge_tasks: Iterable[str] = (),
+        hedge_delay: float = DEFAULT_HEDGE_DELAY,
+    ):
+        self.client = client
+        self.routes = routes or parse_routes("")
+        self.call_timeout = call_timeout
+        self.hedge_tasks = set(hedge_tasks)
+        self.hedge_delay = hedge_delay
+        self.latency = LatencyTracker()
+        self.stats: Dict[str, RouteStats] = {}
+
+    def route(self, task: str) -> List[str]:
+        if task not in self.routes:
+            raise ValueError(f"No model route configured for task '{task}'")
+        return self.routes[task]
+
+    async def create(self, task: str, validator: Optional[Validator] = None, **kwargs: Any) -> Any:
+        """Run chat.completions.create through the task's route; kwargs are passed through except `model`."""
+        models = self.route(task)
+        # Counted per call, then added to the process totals and to the current job's stats
+        stats = RouteStats()
+        stats.calls += 1
+        try:
+            return await self._create(task, models, stats, validator, kwargs)
+        finally:
+            for routes in (self.stats, _job_routes.get()):
+                if routes is not None:
+                    routes.setdefault(task, RouteStats()).merge(stats)
+
+    async def _create(self, task: str, models: List[str], stats: RouteStats, validator: Optional[Validator], kwargs: Dict[str, Any]) -> Any:
+        for tier, model in enumerate(models):
+            last = tier == len(models) - 1
+            with span(f"route.{task}", model=model, tier=tier) as attempt:
+                try:
+                    result = await self._call(task, model, stats, kwargs)
+                except (asyncio.TimeoutError, APIError, CircuitOpen, LoadShed, InstructorRetryException, ValidationError) as e:
+                    reason = _failure_reason(e)
+                    if reason == "timeout":
+                        stats.timeouts += 1
+                        left = remaining()
+                        if left is not None and left <= 0:
+                            stats.failures += 1
+                            raise DeadlineExceeded(f"Job deadline exceeded during {task}") from e
+                    if reason is None or last:
+                        stats.failures += 1
+                        # Surface fail-fast errors from the transport rather than the client's wrapper around them
+                        cause = _find_cause(e, (CircuitOpen, LoadShed))
+                        if cause is not None and cause is not e:
+                            raise cause from e
+                        raise
+                    logger.info(f"{task}: {model} failed ({reason}), escalating: {e}")
+                else:
+                    reason = validator(result) if validator else None
+                    if reason is None or last:
+                        if reason:
+                            logger.warning(f"{task}: accepting result of {model} despite failed check: {reason}")
+                        stats.served_by[model] = stats.served_by.get(model, 0) + 1
+                        return result
+                    logger.info(f"{task}: {model} result rejected ({reason}), escalating")
+                attempt.attributes["escalated"] = reason
+            if tier == 0:
+                stats.escalations += 1
+            stats.reasons[reason] = stats.reasons.get(reason, 0) + 1
+
+    async def _call(self, task: str, model: str, stats: RouteStats, kwargs: Dict[str, Any]) -> Any:
+        timeout = call_timeout(self.call_timeout)
+        if timeout is not None:
+            kwargs = {**kwargs, "timeout": timeout}
+
+        async def request() -> Any:
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(self.client.chat.completions.create(model=model, **kwargs), timeout)
+            except asyncio.CancelledError:
+                # A request cut short by its hedge still took at least this long; keeps p95 from drifting down
+                self.latency.record((task, model), time.monotonic() - started)
+                raise
+            self.latency.record((task, model), time.monotonic() - started)
+            return result
+
+        if task not in self.hedge_tasks:
+            return await request()
+        delay = self.latency.percentile((task, model), 95) or self.hedge_delay
+        result, sent, won = await hedged(request, delay)
+        stats.hedges += sent
+        stats.hedge_wins += won
+        return result
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Totals since the process started; see start_job_routing for one job's stats."""
+        return routing_report(self.stats)
@@ -3,7 +3,8 @@ from pydantic import Field, BaseModel
 from typing import List, Optional, Dict, Union, Any
 from validators import ContractRoleValidator
 from role_options import get_role_options
-from openai_client import client
+from openai_client import router
+from token_budget import guard_messages
 
 
 # Pydantic Models with llm_validator for enhanced validation
@@ -16,16 +17,20 @@ class PIIData(OpenAISchema):
         if len(self.name) <= 3 or len(self.address) <= 5:
             return False
         
-        result = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{
+        result = await router.create(
+            "validate",
+            messages=guard_messages([{
                 "role": "user",
                 "content": f"Verify if the following data is valid:\nName: {self.name}\nAddress: {self.address}"
-            }],
+            }], router.route("validate")),
             response_model=bool
         )
         return result
 
+class ResolvedParty(PIIData):
+    """One person after merging the PII records found for them across documents."""
+    source_documents: List[str] = Field(default_factory=list, description="Documents the person was found in")
+
 class ContractParty(OpenAISchema):
     name: str = Field(..., description="Party's name")
     roles: List[str] = Field(..., description="Party's roles in the contract")
@@ -35,12 +40,12 @@ class ContractParty(OpenAISchema):
         if not all(role in ContractRoleValidator.valid_roles for role in self.roles):
             return False
             
-        result = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{
+        result = await router.create(
+            "validate",
+            messages=guard_messages([{
                 "role": "user",
                 "content": f"Verify if roles {self.roles} are appropriate for person {self.name}"
-            }],
+            }], router.route("validate")),
             response_model=bool
         )
         return result
@@ -54,12 +59,12 @@ class ContractParties(OpenAISchema):
             return False
             
         parties_info = ", ".join([f"{party.name} ({', '.join(party.roles)})" for party in self.parties])
-        result = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{
+        result = await router.create(
+            "validate",
+            messages=guard_messages([{
                 "role": "user",
                 "content": f"Verify if the following parties and their roles are assigned correctly:\n{parties_info}"
-            }],
+            }], router.route("validate")),
             response_model=bool
         )
         return result
@@ -75,12 +80,12 @@ class ContractDetails(OpenAISchema):
                 (self.object_description is None or len(self.object_description) > 10)):
             return False
             
-        result = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{
+        result = await router.create(
+            "validate",
+            messages=guard_messages([{
                 "role": "user",
                 "content": f"Verify if the contract details are valid:\nType: {self.contract_type}\nDescription: {self.object_description}"
-            }],
+            }], router.route("validate")),
             response_model=bool
         )
         return result
@@ -93,16 +98,32 @@ class Contract(OpenAISchema):
         if len(self.content) <= 100:
             return False
             
-        result = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{
+        result = await router.create(
+            "validate",
+            messages=guard_messages([{
                 "role": "user",
                 "content": f"Verify if this contract contains all necessary sections:\n{self.content[:500]}..."
-            }],
+            }], router.route("validate")),
             response_model=bool
         )
         return result
 
+class ContractSection(BaseModel):
+    """One numbered section of a contract and the hash of the inputs it was generated from."""
+    title: str
+    template: str
+    depends_on: List[str] = Field(default_factory=list, description="Inputs the section uses")
+    input_hash: str = ""
+    content: str = ""
+
+class SectionedContract(BaseModel):
+    contract_type: str
+    sections: List[ContractSection] = Field(default_factory=list)
+    regenerated: List[str] = Field(default_factory=list, description="Sections generated (not reused) in the last build")
+
+    def text(self) -> str:
+        return "\n\n".join(section.content.strip() for section in self.sections if section.content.strip())
+
 # Define AgentAction before AgentState to avoid NameError
 class AgentAction(OpenAISchema):
     action: str = Field(..., description="Action to be performed by the agent")
@@ -114,12 +135,12 @@ class AgentAction(OpenAISchema):
         if len(self.action) == 0 or len(self.reason) <= 10:
             return False
             
-        result = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{
+        result = await router.create(
+            "validate",
+            messages=guard_messages([{
                 "role": "user",
                 "content": f"Verify if this action is valid:\nAction: {self.action}\nReason: {self.reason}"
-            }],
+            }], router.route("validate")),
             response_model=bool
         )
         return result
@@ -129,6 +150,7 @@ class AgentState(BaseModel):
     contract_details: Optional[ContractDetails] = None
     parties: Optional[ContractParties] = None
     contract: Optional[Contract] = None
+    contract_sections: Optional[SectionedContract] = None
     data: Dict[str, Any] = Field(default_factory=dict, description="Dynamic data")
     history: List[AgentAction] = Field(default_factory=list, description="Agent's action history")
 
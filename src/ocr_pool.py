@@ -0,0 +1,227 @@
+"""
+OCR with the smallest EasyOCR model set per document.
+
+Text detection (CRAFT) does not depend on the language, so one detector-only
+reader finds the text boxes. A few of the largest boxes are then recognized by a
+probe reader to tell the script (Latin or Cyrillic) and the language apart, and
+the document is recognized by a reader for just those languages. Recognition
+readers are kept in an LRU pool capped by the memory of their models, and are
+reused across documents and jobs.
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import easyocr
+
+logger = logging.getLogger(__name__)
+
+LATIN_LANGUAGES = ("ro", "hu", "de")
+CYRILLIC_LANGUAGES = ("bg",)
+
+# Boxes recognized by the probe; the largest boxes are usually labels and names with the most letters
+PROBE_BOXES = 8
+# Below this mean confidence of the Latin probe, the Cyrillic probe is tried as well
+CYRILLIC_PROBE_CONFIDENCE = 0.5
+# Languages scoring at least this fraction of the best one are recognized too (bilingual documents)
+SECONDARY_LANGUAGE_RATIO = 0.5
+# Assumed model size when it cannot be measured
+DEFAULT_READER_MB = 100.0
+
+# Letters and words that give a language away in OCR output of IDs, bills and contracts
+LANGUAGE_HINTS: Dict[str, Tuple[str, Sequence[str]]] = {
+    "ro": ("ăâîșşțţ", ("str", "nr", "jud", "mun", "domiciliu", "nume", "prenume", "si", "și", "strada")),
+    "hu": ("őűáéíóú", ("utca", "és", "név", "születési", "lakcím", "anyja", "kiállító")),
+    "de": ("ßäöü", ("straße", "strasse", "und", "geburtsdatum", "anschrift", "wohnort", "vorname")),
+}
+
+Box = List[int]
+
+
+def language_scores(text: str) -> Dict[str, float]:
+    """Score each Latin language by its distinctive letters (weighted up) and common words."""
+    lowered = text.lower()
+    words = re.findall(r"\w+", lowered)
+    scores = {}
+    for language, (letters, hint_words) in LANGUAGE_HINTS.items():
+        score = 2.0 * sum(lowered.count(letter) for letter in letters)
+        score += sum(1 for word in words if word in hint_words)
+        scores[language] = score
+    return scores
+
+
+def choose_latin_languages(text: str, default: Sequence[str]) -> Tuple[str, ...]:
+    scores = language_scores(text)
+    best = max(scores.values(), default=0)
+    if best <= 0:
+        return tuple(sorted(set(default)))
+    chosen = {language for language, score in scores.items() if score >= best * SECONDARY_LANGUAGE_RATIO}
+    return tuple(sorted(chosen | {"en"}))
+
+
+def model_megabytes(reader: "easyocr.Reader") -> float:
+    """Memory held by a reader's networks, from their parameters and buffers."""
+    total = 0
+    for name in ("detector", "recognizer"):
+        module = getattr(reader, name, None)
+        if module is None or not hasattr(module, "parameters"):
+            continue
+        tensors = list(module.parameters()) + list(module.buffers())
+        total += sum(t.numel() * t.element_size() for t in tensors)
+    return total / (1024 * 1024) or DEFAULT_READER_MB
+
+
+class _Entry:
+    def __init__(self, reader: "easyocr.Reader", size_mb: float):
+        self.reader = reader
+        self.size_mb = size_mb
+        self.in_use = 0
+
+
+class ReaderPool:
+    """
+    Recognition readers keyed by language set, evicted least recently used first once their
+    models exceed `max_mb`. Readers in use are never evicted, so the cap can be exceeded
+    while more language sets are in use at once than fit.
+    """
+
+    def __init__(self, max_mb: float, loader: Optional[Callable[[Tuple[str, ...]], "easyocr.Reader"]] = None):
+        self.max_mb = max_mb
+        self.loader = loader or (lambda languages: easyocr.Reader(list(languages), detector=False, verbose=False))
+        self.entries: "OrderedDict[Tuple[str, ...], _Entry]" = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._loading: Dict[Tuple[str, ...], threading.Lock] = {}
+
+    @property
+    def resident_mb(self) -> float:
+        return sum(entry.size_mb for entry in self.entries.values())
+
+    @contextmanager
+    def reader(self, languages: Sequence[str]) -> Iterator["easyocr.Reader"]:
+        key = tuple(sorted(set(languages)))
+        entry = self._acquire(key)
+        try:
+            yield entry.reader
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+
+    def _acquire(self, key: Tuple[str, ...]) -> _Entry:
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        # One thread loads a given language set; others wait for it instead of loading a copy
+        with loading:
+            with self._lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    entry.in_use += 1
+                    return entry
+            reader = self.loader(key)
+            entry = _Entry(reader, model_megabytes(reader))
+            with self._lock:
+                self.loads += 1
+                entry.in_use += 1
+                self.entries[key] = entry
+                self._evict()
+            logger.info(f"Loaded OCR reader {'+'.join(key)} ({entry.size_mb:.0f} MB, {self.resident_mb:.0f} MB resident)")
+            return entry
+
+    def _evict(self) -> None:
+        for key in list(self.entries):
+            if self.resident_mb <= self.max_mb:
+                return
+            if self.entries[key].in_use == 0:
+                del self.entries[key]
+                self.evictions += 1
+                logger.info(f"Evicted OCR reader {'+'.join(key)} to stay under {self.max_mb:.0f} MB")
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "readers": ["+".join(key) for key in self.entries],
+                "resident_mb": round(self.resident_mb, 1),
+                "max_mb": self.max_mb,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+class OCRPool:
+    """Detect text once, pick languages from a probe of the largest boxes, then recognize with a matching reader."""
+
+    def __init__(self, languages: Sequence[str], default_languages: Sequence[str], max_mb: float):
+        self.latin = tuple(sorted({"en", *(l for l in languages if l in LATIN_LANGUAGES)}))
+        self.cyrillic = tuple(sorted({"en", *(l for l in languages if l in CYRILLIC_LANGUAGES)}))
+        self.default_languages = tuple(default_languages)
+        self.readers = ReaderPool(max_mb)
+        # Set by warm_up(every_set=True): the only readers used from then on
+        self.resident_sets: List[Tuple[str, ...]] = []
+        self._detector: Optional["easyocr.Reader"] = None
+        self._detector_lock = threading.Lock()
+
+    @property
+    def detector(self) -> "easyocr.Reader":
+        with self._detector_lock:
+            if self._detector is None:
+                self._detector = easyocr.Reader(["en"], recognizer=False, verbose=False)
+            return self._detector
+
+    def warm_up(self, every_set: bool = False) -> None:
+        """
+        Load the detector, the probe reader and the default reader ahead of the first document.
+
+        With every_set (before forking workers) the Cyrillic probe is loaded as well, and documents
+        are then only read with these readers, so no worker loads a private copy of a model.
+        """
+        self.detector  # loaded on first access
+        sets = [self.latin, self.default_languages]
+        if every_set and len(self.cyrillic) > 1:
+            sets.append(self.cyrillic)
+        # Held together, so a cap smaller than all of them cannot evict one loaded earlier
+        with ExitStack() as held:
+            for languages in sets:
+                held.enter_context(self.readers.reader(languages))
+        if every_set:
+            # Nothing is loaded after this, so the cap would only evict readers the workers share
+            self.readers.max_mb = max(self.readers.max_mb, self.readers.resident_mb)
+            self.resident_sets = sorted(self.readers.entries, key=len)
+
+    def resident_languages(self, languages: Tuple[str, ...]) -> Tuple[str, ...]:
+        """
+        The smallest loaded set covering `languages`, once the readers are fixed. Readers of one
+        script share the recognition model, so a wider set reads the narrower one's text.
+        """
+        if not self.resident_sets:
+            return languages
+        wanted = set(languages)
+        default = tuple(sorted(set(self.default_languages)))
+        return next((key for key in self.resident_sets if wanted <= set(key)), default)
+
+    def detect_languages(self, image: str, boxes: List[Box]) -> Tuple[str, ...]:
+        """Choose the language set for a document from a recognition pass over its largest boxes."""
+        largest = sorted(boxes, key=lambda b: (b[1] - b[0]) * (b[3] - b[2]), reverse=True)[:PROBE_BOXES]
+        if not largest:
+            return self.default_languages
+        with self.readers.reader(self.latin) as probe:
+            latin = probe.recognize(image, horizontal_list=largest, free_list=[])
+        confidence = sum(r[2] for r in latin) / len(latin) if latin else 0.0
+        if len(self.cyrillic) > 1 and confidence < CYRILLIC_PROBE_CONFIDENCE:
+            with self.readers.reader(self.cyrillic) as probe:
+                cyrillic = probe.recognize(image, horizontal_list=largest, free_list=[])
+            if cyrillic and sum(r[2] for r in cyrillic) / len(cyrillic) > confidence:
+                return self.cyrillic
+        return choose_latin_languages(" ".join(r[1] for r in latin), self.default_languages)
+
+    def readtext(self, image: str) -> Tuple[List[tuple], Tuple[str, ...]]:
+        """EasyOCR results (box, text, confidence) for an image file, and the languages used."""
+        horizontal, free = self.detector.detect(image)
+        horizontal, free = horizontal[0], free[0]
+        languages = self.resident_languages(self.detect_languages(image, horizontal))
+        with self.readers.reader(languages) as reader:
+            return reader.recognize(image, horizontal_list=horizontal, free_list=free), languages
@@ -0,0 +1,161 @@
+"""
+OCR throughput calibration per node type.
+
+Benchmarks a sample of real documents across OCR worker counts and torch thread
+counts, and saves the fastest combination for this kind of node (CPU model and
+core count) in OCR_TUNING_FILE. config.py applies the saved values on every
+start unless OCR_WORKERS / OCR_TORCH_THREADS are set explicitly, so ingestion,
+the daemon and main.py all run OCR with the tuned settings.
+
+    rye run python src/ocr_tuning.py calibrate data/*.jpg --sample 12
+    rye run python src/ocr_tuning.py show
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from output_writer import atomic_write_bytes
+
+
+def node_type() -> str:
+    """Key for nodes expected to tune the same: CPU model and core count."""
+    model = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{model} x{os.cpu_count()}"
+
+
+def read_tunings(path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_tuning(path: str) -> Dict[str, Any]:
+    """The saved tuning for this node type, or {} when it has not been calibrated."""
+    return read_tunings(path).get(node_type(), {}) if path else {}
+
+
+def save_tuning(path: str, tuning: Dict[str, Any]) -> None:
+    tunings = read_tunings(path)
+    tunings[node_type()] = tuning
+    atomic_write_bytes(path, json.dumps(tunings, indent=2).encode("utf-8"))
+
+
+def candidate_settings(cpus: int, workers: Optional[Sequence[int]] = None, threads: Optional[Sequence[int]] = None) -> List[Dict[str, int]]:
+    """Worker and thread counts to try; by default powers of two that do not oversubscribe the cores."""
+    powers = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= cpus] + ([cpus] if cpus & (cpus - 1) else [])
+    # Counts given explicitly are all tried, oversubscribed or not
+    explicit = bool(workers or threads)
+    return [
+        {"workers": w, "torch_threads": t}
+        for w in workers or powers
+        for t in threads or [1, 2, 4]
+        if explicit or w * t <= cpus
+    ]
+
+
+async def _measure(pool, images: List[str], rounds: int) -> float:
+    # The first pass runs untimed: each worker allocates its buffers on the first image it reads
+    await asyncio.gather(*(pool.readtext(image) for image in images[: pool.workers]))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(pool.readtext(image) for image in images))
+    return len(images) * rounds / (time.perf_counter() - started)
+
+
+def calibrate(
+    images: List[str],
+    settings: List[Dict[str, int]],
+    rounds: int = 1,
+    max_memory_mb: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Time OCR of `images` with each setting; returns the fastest that fits in `max_memory_mb` (total PSS)."""
+    from config import OCR_DEFAULT_LANGUAGES, OCR_LANGUAGES, OCR_POOL_MAX_MB
+    from ocr_pool import OCRPool
+    from ocr_workers import ForkedOCRWorkers, fork_available
+
+    if not fork_available():
+        raise SystemExit("Calibration runs OCR in forked workers, which needs the fork start method (Linux)")
+    ocr = OCRPool(OCR_LANGUAGES, OCR_DEFAULT_LANGUAGES, OCR_POOL_MAX_MB)
+    results = []
+    for setting in settings:
+        pool = ForkedOCRWorkers(ocr, setting["workers"], setting["torch_threads"])
+        pool.start()
+        try:
+            throughput = asyncio.run(_measure(pool, images, rounds))
+            memory = pool.memory_report().get("total_pss_mb")
+        finally:
+            # Wait for the pool's threads to exit, so the next setting forks a single-threaded parent
+            pool.shutdown(wait=True)
+        result = {**setting, "images_per_second": round(throughput, 3), "total_pss_mb": memory}
+        print(f"workers={setting['workers']:<3} torch_threads={setting['torch_threads']:<2} "
+              f"{throughput:7.2f} images/s  PSS {memory} MB")
+        results.append(result)
+
+    fitting = [r for r in results if max_memory_mb is None or r["total_pss_mb"] is None or r["total_pss_mb"] <= max_memory_mb]
+    if not fitting:
+        raise SystemExit(f"No setting stayed under {max_memory_mb} MB")
+    best = max(fitting, key=lambda r: r["images_per_second"])
+    return {
+        "workers": best["workers"],
+        "torch_threads": best["torch_threads"],
+        "images_per_second": best["images_per_second"],
+        "host": socket.gethostname(),
+        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "images": len(images),
+        "results": results,
+    }
+
+
+def _counts(value: Optional[str]) -> Optional[List[int]]:
+    return [int(n) for n in value.split(",") if n.strip()] if value else None
+
+
+def main() -> None:
+    from config import OCR_TUNING_FILE
+
+    parser = argparse.ArgumentParser(description="Find the fastest OCR worker and torch thread counts for this node type.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("calibrate", help="Benchmark sample documents and save the best setting")
+    run.add_argument("images", nargs="+", help="Sample images, ideally typical of production")
+    run.add_argument("--sample", type=int, default=0, help="Use this many randomly chosen images")
+    run.add_argument("--workers", default=None, help="Comma-separated worker counts (default: powers of two up to the cores)")
+    run.add_argument("--threads", default=None, help="Comma-separated torch thread counts (default: 1,2,4)")
+    run.add_argument("--rounds", type=int, default=1)
+    run.add_argument("--max-memory-mb", type=float, default=None, help="Skip settings whose total PSS exceeds this")
+    run.add_argument("--dry-run", action="store_true", help="Report the best setting without saving it")
+    commands.add_parser("show", help="Show the saved setting for this node type")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        tuning = load_tuning(OCR_TUNING_FILE)
+        print(f"{node_type()}: {json.dumps(tuning, indent=2) if tuning else 'not calibrated'}")
+        return
+
+    images = random.sample(args.images, min(args.sample, len(args.images))) if args.sample else args.images
+    settings = candidate_settings(os.cpu_count() or 1, _counts(args.workers), _counts(args.threads))
+    print(f"Calibrating {len(settings)} settings on {len(images)} image(s) for {node_type()}")
+    tuning = calibrate(images, settings, args.rounds, args.max_memory_mb)
+    print(f"Best: workers={tuning['workers']} torch_threads={tuning['torch_threads']} ({tuning['images_per_second']} images/s)")
+    if not args.dry_run:
+        save_tuning(OCR_TUNING_FILE, tuning)
+        print(f"Saved to {OCR_TUNING_FILE}")
+
+
+if __name__ == "__main__":
+    main()
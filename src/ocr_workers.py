@@ -0,0 +1,218 @@
+"""
+OCR in forked worker processes that share the parent's model weights.
+
+The parent loads the detector and a reader for every language set the workers
+use (the Latin and Cyrillic probes and the default set) once, freezes the
+garbage collector and then forks the workers. The weights are inherited copy-on-write
+and only ever read, so N workers cost about one copy of the models plus each
+worker's own activations, instead of N copies. Per-process RSS and PSS come from
+/proc, so the sharing can be checked on a real node:
+
+    rye run python src/ocr_workers.py --workers 8 data/*.jpg
+
+Needs the fork start method (Linux); elsewhere OCR stays in threads. The pool
+is forked from the main thread at startup, before the event loop and its worker
+threads exist (see document_processing.start_ocr_workers); forking a process
+with other threads running can leave a child stuck on a lock one of them held.
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from logging_setup import logging_paused
+from ocr_pool import OCRPool
+
+logger = logging.getLogger(__name__)
+
+# Set in the parent before forking; the workers inherit it with the readers already loaded
+_shared_ocr: Optional[OCRPool] = None
+
+
+def fork_available() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def memory_usage(pid: int) -> Optional[Dict[str, float]]:
+    """RSS, PSS and shared/private memory of a process in MB, from /proc/<pid>/smaps_rollup."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "pss_mb": round(fields.get("Pss", 0.0), 1),
+        "shared_mb": round(fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def set_torch_threads(threads: int) -> None:
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _init_worker(torch_threads: int) -> None:
+    # The parent's logging queue has no listener thread in the child
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.StreamHandler())
+    root.setLevel(logging.WARNING)
+    # One intra-op thread per worker: the workers are the parallelism, extra torch threads only contend
+    set_torch_threads(torch_threads)
+
+
+def _worker_pid(_: int) -> int:
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _readtext(image: str) -> Tuple[List[tuple], Tuple[str, ...]]:
+    results, languages = _shared_ocr.readtext(image)
+    # Boxes are numpy values; plain lists pickle smaller and faster
+    return [([[int(x), int(y)] for x, y in box], text, float(confidence)) for box, text, confidence in results], languages
+
+
+class ForkedOCRWorkers:
+    """A process pool forked from a parent that has already loaded the OCR models."""
+
+    def __init__(self, ocr: OCRPool, workers: int, torch_threads: int = 1):
+        self.ocr = ocr
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.pids: List[int] = []
+        self.start_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Load the models, then fork the workers; call from the main thread before the event loop starts."""
+        global _shared_ocr
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("OCR workers must be forked from the main thread")
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("OCR workers must be forked before the event loop starts")
+        with self._lock:
+            if self.executor is not None:
+                return
+            started = time.perf_counter()
+            self.ocr.warm_up(every_set=True)
+            _shared_ocr = self.ocr
+            # Move everything loaded so far out of the collector's reach, so collections in the
+            # workers do not write to (and thereby copy) the pages holding the parent's objects
+            gc.collect()
+            gc.freeze()
+            with logging_paused():
+                others = [t.name for t in threading.enumerate() if t is not threading.current_thread()]
+                if others:
+                    logger.warning(f"Forking OCR workers while other threads run: {', '.join(others)}")
+                executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=_init_worker,
+                    initargs=(self.torch_threads,),
+                )
+                # Fork every worker now, while the parent holds nothing but the loaded models
+                self.pids = sorted(set(executor.map(_worker_pid, range(self.workers * 2))))
+            self.executor = executor
+            self.start_seconds = round(time.perf_counter() - started, 3)
+            logger.info(f"Forked {self.workers} OCR workers in {self.start_seconds:.1f}s: {self.memory_report()}")
+
+    @property
+    def running(self) -> bool:
+        return self.executor is not None
+
+    async def readtext(self, image: str) -> Tuple[List[tuple], Tuple[str, ...]]:
+        if self.executor is None:
+            raise RuntimeError("OCR workers are not running; start them from the main thread at startup")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, _readtext, image)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory). Forking again now would fork a threaded process,
+            # so OCR runs in threads until the next restart
+            logger.error(f"OCR worker pool broke while reading {image}; falling back to in-process OCR")
+            self.shutdown()
+            raise
+
+    def memory_report(self) -> Dict[str, object]:
+        """Memory of the parent and of each worker; the PSS total is what the pool really costs."""
+        workers = {pid: memory_usage(pid) for pid in self.pids}
+        parent = memory_usage(os.getpid())
+        report: Dict[str, object] = {"parent": parent, "workers": workers}
+        measured = [m for m in [parent, *workers.values()] if m]
+        if measured:
+            report["total_rss_mb"] = round(sum(m["rss_mb"] for m in measured), 1)
+            report["total_pss_mb"] = round(sum(m["pss_mb"] for m in measured), 1)
+        return report
+
+    def shutdown(self, wait: bool = False) -> None:
+        with self._lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait, cancel_futures=True)
+                self.executor = None
+                self.pids = []
+
+
+def print_memory_report(report: Dict[str, object]) -> None:
+    rows = [("parent", report["parent"])] + [(f"worker {pid}", usage) for pid, usage in report["workers"].items()]
+    print(f"{'process':<16}{'RSS MB':>10}{'PSS MB':>10}{'shared MB':>11}{'private MB':>12}")
+    for name, usage in rows:
+        if usage:
+            print(f"{name:<16}{usage['rss_mb']:>10}{usage['pss_mb']:>10}{usage['shared_mb']:>11}{usage['private_mb']:>12}")
+    if "total_pss_mb" in report:
+        print(f"Total RSS {report['total_rss_mb']} MB (counts shared pages once per process), total PSS {report['total_pss_mb']} MB")
+
+
+async def _run_sample(workers: ForkedOCRWorkers, images: List[str]) -> None:
+    started = time.perf_counter()
+    results = await asyncio.gather(*(workers.readtext(image) for image in images), return_exceptions=True)
+    for image, result in zip(images, results):
+        status = f"error: {result}" if isinstance(result, BaseException) else f"{len(result[0])} boxes, {'+'.join(result[1])}"
+        print(f"{os.path.basename(image)}: {status}")
+    print(f"{len(images)} image(s) in {time.perf_counter() - started:.1f}s")
+
+
+def main() -> None:
+    from config import OCR_DEFAULT_LANGUAGES, OCR_LANGUAGES, OCR_POOL_MAX_MB, OCR_TORCH_THREADS, OCR_WORKERS
+
+    parser = argparse.ArgumentParser(description="Run images through forked OCR workers and report their memory.")
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--workers", type=int, default=OCR_WORKERS or os.cpu_count())
+    parser.add_argument("--torch-threads", type=int, default=OCR_TORCH_THREADS or 1)
+    args = parser.parse_args()
+    if not fork_available():
+        raise SystemExit("Forked OCR workers need the fork start method (Linux)")
+
+    workers = ForkedOCRWorkers(OCRPool(OCR_LANGUAGES, OCR_DEFAULT_LANGUAGES, OCR_POOL_MAX_MB), args.workers, args.torch_threads)
+    workers.start()
+    print(f"After forking {args.workers} workers:")
+    print_memory_report(workers.memory_report())
+    if args.images:
+        asyncio.run(_run_sample(workers, args.images))
+        print("After OCR:")
+        print_memory_report(workers.memory_report())
+    workers.shutdown()
+
+
+if __name__ == "__main__":
+    main()
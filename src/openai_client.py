@@ -1,9 +1,46 @@
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 import instructor
-from config import API_KEY
+from config import (
+    API_KEY,
+    OPENAI_BASE_URL,
+    MODEL_ROUTES,
+    MODEL_CALL_TIMEOUT,
+    HEDGE_TASKS,
+    HEDGE_DELAY_SECONDS,
+    ADAPTIVE_CONCURRENCY,
+    CONCURRENCY_INITIAL,
+    CONCURRENCY_MIN,
+    CONCURRENCY_MAX,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_COOLDOWN_SECONDS,
+)
+from concurrency import AdaptiveLimiter, AdaptiveTransport, CircuitBreaker
+from model_router import ModelRouter, parse_routes
+from tracing import instrument_client
+from token_budget import track_usage
+
+# Shared limit on concurrent requests to the API; limiter.snapshot() reports the current limit
+limiter = AdaptiveLimiter(
+    initial=CONCURRENCY_INITIAL,
+    min_limit=CONCURRENCY_MIN,
+    max_limit=CONCURRENCY_MAX,
+    breaker=CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN_SECONDS),
+)
+http_client = DefaultAsyncHttpxClient(transport=AdaptiveTransport(limiter)) if ADAPTIVE_CONCURRENCY else None
 
 # Initialize OpenAI client with Instructor
 client = instructor.from_openai(
-    AsyncOpenAI(api_key=API_KEY), 
+    AsyncOpenAI(api_key=API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client), 
     mode=instructor.Mode.TOOLS_STRICT  
 )
+instrument_client(client)
+track_usage(client)
+
+# Per-task model cascades; use router.create(task, ...) instead of picking a model
+router = ModelRouter(
+    client,
+    parse_routes(MODEL_ROUTES),
+    call_timeout=MODEL_CALL_TIMEOUT,
+    hedge_tasks=HEDGE_TASKS,
+    hedge_delay=HEDGE_DELAY_SECONDS,
+)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ("txt", "pdf", "docx")
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+
+
+def unique_stem(contract_type: str, job_id: Optional[str] = None) -> str:
+    """Collision-free file stem: microsecond timestamp plus the job id or a random suffix."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    suffix = job_id or uuid.uuid4().hex[:8]
+    return f"{contract_type}_{timestamp}_{suffix}"
+
+
+def atomic_write_bytes(path: str, data: bytes) -> str:
+    """Write to a temp file in the target folder, fsync it, then rename it into place."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-", suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def render_pdf(content: str) -> bytes:
+    """Render plain contract text to PDF with pymupdf, flowing onto as many pages as needed."""
+    import fitz
+
+    document = fitz.open()
+    page_rect = fitz.paper_rect("a4")
+    margin = 56
+    remaining = content
+    while remaining:
+        page = document.new_page(width=page_rect.width, height=page_rect.height)
+        writer = fitz.TextWriter(page_rect)
+        box = fitz.Rect(margin, margin, page_rect.width - margin, page_rect.height - margin)
+        overflow = writer.fill_textbox(box, remaining, fontsize=10, font=fitz.Font("helv"))
+        writer.write_text(page)
+        # fill_textbox returns the lines that did not fit
+        remaining = "\n".join(line for line, _ in overflow) if overflow else ""
+    if document.page_count == 0:
+        document.new_page()
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def render_docx(content: str) -> bytes:
+    """Render plain contract text to DOCX (requires the optional python-docx package)."""
+    import io
+    from docx import Document
+
+    document = Document()
+    for paragraph in content.split("\n\n"):
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def _render_and_write(path: str, content: str, fmt: str) -> str:
+    """Runs in the render pool: render one format and write it atomically."""
+    data = render_pdf(content) if fmt == "pdf" else render_docx(content)
+    return atomic_write_bytes(path, data)
+
+
+def get_render_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=max_workers)
+    return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=True)
+        _render_pool = None
+
+
+async def write_contract(
+    content: str,
+    contract_type: str,
+    output_folder: str,
+    formats: Optional[List[str]] = None,
+    job_id: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Save a contract in the requested formats without blocking the event loop.
+
+    The text file is written in a worker thread; PDF and DOCX are rendered in a
+    process pool. Every file is written atomically under a collision-free name.
+
+    Returns:
+        Dict[str, str]: Output path per format that was written.
+    """
+    # The text file is the primary output and is always written
+    formats = ["txt"] + [f.lower() for f in (formats or []) if f.lower() != "txt"]
+    unsupported = [f for f in formats if f not in SUPPORTED_FORMATS]
+    if unsupported:
+        raise ValueError(f"Unsupported output format(s): {', '.join(unsupported)}. Must be one of {', '.join(SUPPORTED_FORMATS)}")
+
+    base_name = unique_stem(contract_type, job_id)
+    paths = {fmt: os.path.join(output_folder, f"{base_name}.{fmt}") for fmt in formats}
+    loop = asyncio.get_running_loop()
+
+    with span("output_write", formats=",".join(formats), chars=len(content)):
+        tasks = {}
+        for fmt, path in paths.items():
+            if fmt == "txt":
+                tasks[fmt] = asyncio.to_thread(atomic_write_bytes, path, content.encode("utf-8"))
+            else:
+                tasks[fmt] = loop.run_in_executor(get_render_pool(), _render_and_write, path, content, fmt)
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    written = {}
+    for fmt, result in zip(tasks, results):
+        if isinstance(result, ImportError):
+            logger.warning(f"Skipping {fmt} output, renderer not installed: {result}")
+        elif isinstance(result, BaseException):
+            logger.error(f"Failed to write {fmt} output: {result}")
+        else:
+            written[fmt] = result
+    if "txt" not in written:
+        raise IOError(f"Contract text could not be written to {paths['txt']}")
+    return written
+
+
+async def write_sections(txt_path: str, sections_json: str) -> str:
+    """Save a contract's sections (with their input hashes) next to its text file, for later edits."""
+    path = os.path.splitext(txt_path)[0] + ".sections.json"
+    return await asyncio.to_thread(atomic_write_bytes, path, sections_json.encode("utf-8"))
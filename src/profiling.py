@@ -0,0 +1,225 @@
+"""
+On-demand sampling profiler.
+
+While a profiled stage or time window is open, a background thread samples the
+stack of every thread (sys._current_frames) at a fixed interval. Samples are
+written as collapsed stacks ("frame;frame;frame count", the input of
+flamegraph.pl, inferno and speedscope), one file per job and stage, with the job
+id, stage and thread name as the root frames. Time inside C extensions (EasyOCR
+and torch, pydantic-core, PDF parsing) shows up under the Python frame that called
+them, and time waiting on the network as the event loop parked in its selector.
+
+Stages are matched by tracing span name, so anything wrapped in tracing.span can
+be profiled. When profiling is off, the only cost is one attribute check per span.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ALL_STAGES = "all"
+
+# Leaf frames of threads that are parked with nothing to do; their samples are noise
+IDLE_FRAMES = {
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+    ("threading.py", "wait"),
+    ("handlers.py", "_monitor"),
+}
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame) -> Tuple[Optional[str], bool]:
+    """A thread's stack as `root;...;leaf`, and whether the thread is idle."""
+    labels: List[str] = []
+    leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels)), leaf in IDLE_FRAMES
+
+
+class ProfileWindow:
+    def __init__(self, job_id: str, stage: str):
+        self.job_id = job_id
+        self.stage = stage
+        self.samples: Counter = Counter()
+        self.started_at = time.time()
+        self.open = 1
+
+    def folded(self) -> str:
+        root = f"job {self.job_id};stage {self.stage}"
+        return "".join(f"{root};{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class SamplingProfiler:
+    """
+    Samples all threads while at least one window is open.
+
+    Windows are process-wide: a window records every thread while it is open, so
+    stages that overlap in time share samples. Concurrent spans with the same job
+    and stage (e.g. one PII extraction per document) share one window.
+    """
+
+    def __init__(self, stages: Sequence[str] = (), interval: float = 0.01, folder: str = "profiles", include_idle: bool = False):
+        self.stages = {s.strip() for s in stages if s.strip()}
+        self.interval = interval
+        self.folder = folder
+        self.include_idle = include_idle
+        self.windows: Dict[Tuple[str, str], ProfileWindow] = {}
+        self.sampling_seconds = 0.0
+        # Reentrant: the SIGUSR2 handler may open a window while the main thread holds the lock
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def wants(self, name: str) -> bool:
+        if ALL_STAGES in self.stages:
+            # Stage spans only, so nested spans do not open a window of their own
+            return name.startswith("stage.") or name in ("job", "chat_turn")
+        return name in self.stages or (name.startswith("stage.") and name[len("stage."):] in self.stages)
+
+    def enter(self, name: str, trace_id: str) -> Optional[ProfileWindow]:
+        """Open (or join) the window for a span; returns None when the span is not profiled."""
+        if not self.wants(name):
+            return None
+        return self.open_window(trace_id, name)
+
+    def open_window(self, job_id: str, stage: str) -> ProfileWindow:
+        key = (job_id, stage)
+        with self._lock:
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = ProfileWindow(job_id, stage)
+            else:
+                window.open += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return window
+
+    def exit(self, window: ProfileWindow) -> Optional[str]:
+        """Close a window; the last span to leave it writes the profile. Returns its path."""
+        with self._lock:
+            window.open -= 1
+            if window.open > 0:
+                return None
+            self.windows.pop((window.job_id, window.stage), None)
+        return self.write(window)
+
+    def write(self, window: ProfileWindow) -> Optional[str]:
+        total = sum(window.samples.values())
+        if not total:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        safe_stage = "".join(c if c.isalnum() or c in "-_." else "_" for c in window.stage)
+        path = os.path.join(self.folder, f"{window.job_id[:16]}.{safe_stage}.{int(window.started_at)}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(window.folded())
+        elapsed = time.time() - window.started_at
+        logger.info(
+            f"Profile of {window.stage} for job {window.job_id}: {total} samples over {elapsed:.1f}s -> {path} "
+            f"(sampler time so far {self.sampling_seconds:.2f}s)"
+        )
+        return path
+
+    def time_window(self, seconds: float, label: str = "window") -> None:
+        """Profile the whole process for the next `seconds`, from any thread (e.g. a signal handler)."""
+        window = self.open_window(f"process-{os.getpid()}", f"{label}-{int(time.time())}")
+        timer = threading.Timer(seconds, self.exit, args=(window,))
+        timer.daemon = True
+        timer.start()
+
+    def sample(self) -> None:
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack, idle = collapse_stack(frame)
+            if idle and not self.include_idle:
+                continue
+            stacks.append(f"thread {names.get(ident, ident)};{stack}")
+        with self._lock:
+            for window in self.windows.values():
+                window.samples.update(stacks)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                idle = not self.windows
+            if idle:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            started = time.perf_counter()
+            self.sample()
+            spent = time.perf_counter() - started
+            self.sampling_seconds += spent
+            time.sleep(max(self.interval - spent, self.interval / 10))
+
+
+def configure_profiling(
+    stages: Sequence[str] = (),
+    seconds: float = 0.0,
+    interval_ms: float = 10.0,
+    folder: str = "profiles",
+    on_signal: bool = True,
+) -> Optional[SamplingProfiler]:
+    """
+    Install the profiler if any stage or time window is requested; otherwise leave profiling off.
+
+    Args:
+        stages: Span names to profile (e.g. extract_pii, construct_contract), or "all" for every stage.
+        seconds: Profile the whole process for this long from now.
+        interval_ms: Sampling interval.
+        folder: Where the .folded files go.
+        on_signal: With profiling on, SIGUSR2 profiles the next `seconds` (30 if unset) on demand.
+    """
+    stages = [s for s in stages if s.strip()]
+    if not stages and not seconds:
+        tracer.profiler = None
+        return None
+    profiler = SamplingProfiler(stages, interval_ms / 1000, folder)
+    tracer.profiler = profiler
+    if seconds:
+        profiler.time_window(seconds)
+    if on_signal and hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.time_window(seconds or 30, "signal"))
+    logger.info(f"Sampling profiler on: stages={','.join(stages) or '-'} window={seconds or 0}s every {interval_ms}ms -> {folder}")
+    return profiler
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser, stages: str = "", seconds: float = 0.0) -> None:
+    """The --profile and --profile-seconds flags shared by the entry points."""
+    parser.add_argument("--profile", default=stages, metavar="STAGES",
+                        help=f"Comma-separated stages to profile, or '{ALL_STAGES}'")
+    parser.add_argument("--profile-seconds", type=float, default=seconds, metavar="SECONDS",
+                        help="Profile the whole process for this many seconds from start (and on SIGUSR2)")
+
+
+def profile_from_command_line(description: str) -> Optional[SamplingProfiler]:
+    """Parse the profiling flags (defaults from the PROFILE* variables) for entry points that do not load config.py."""
+    parser = argparse.ArgumentParser(description=description)
+    add_profile_arguments(parser, os.getenv("PROFILE", ""), float(os.getenv("PROFILE_SECONDS") or 0))
+    args = parser.parse_args()
+    return configure_profiling(
+        args.profile.split(","),
+        args.profile_seconds,
+        float(os.getenv("PROFILE_INTERVAL_MS", "10")),
+        os.getenv("PROFILE_FOLDER", "profiles"),
+    )
@@ -0,0 +1,369 @@
+"""
+Batch review of extracted identities and their contract roles.
+
+Extraction fills the queue as each document finishes, and the same person found
+in several documents is merged as records arrive. The reviewer confirms or
+corrects everyone on one screen (terminal, or a small local web page) while the
+remaining documents are still being extracted, so OCR and model latency overlap
+with the reviewer's time instead of adding to it. Roles can arrive later, once
+the contract type is known; the reviewer then confirms the proposed roles.
+"""
+import asyncio
+import html
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from pydantic import BaseModel, Field
+
+from entity_resolution import cluster, merge_records
+from models import ContractParties, ContractParty, PIIData, ResolvedParty
+from stage_graph import Stream
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_HELP = "Edits: <n> name <value> | <n> address <value> | <n> role <number> | <n> drop | <n> keep | r (refresh)"
+
+
+class ReviewItem(BaseModel):
+    id: int
+    party: ResolvedParty
+    role: Optional[str] = None
+    reviewed: bool = False
+    dropped: bool = False
+    records: List[int] = Field(default_factory=list, description="Indexes of the merged PII records")
+
+
+class ReviewQueue:
+    """
+    People awaiting review, merged across documents as extraction results arrive.
+
+    Items are shared between the event loop (which adds records) and the web server
+    thread (which applies edits), so every access goes through one lock.
+    """
+
+    def __init__(self, roles: Optional[List[str]] = None, awaiting_roles: bool = False):
+        self.roles = roles or []
+        # Set while the contract type (and with it the role list) is still being determined
+        self.awaiting_roles = awaiting_roles
+        # Bumped when roles are proposed, so a screen shown before that is not accepted as is
+        self.roles_version = 0
+        self.items: Dict[int, ReviewItem] = {}
+        self.records: List[Tuple[str, PIIData]] = []
+        self.closed = False
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed = asyncio.Event()
+
+    def add(self, document: str, pii_list: List[PIIData]) -> None:
+        """Add a document's records, merging them into existing people where they match."""
+        with self._lock:
+            self.records.extend((document, pii) for pii in pii_list)
+            owner = {index: item.id for item in self.items.values() for index in item.records}
+            for indexes in cluster(self.records):
+                existing = sorted({owner[i] for i in indexes if i in owner})
+                if not existing:
+                    self._new_item(indexes)
+                    continue
+                item = self.items[existing[0]]
+                # A new record can bridge two people already on screen; they become one item again to review
+                for other in existing[1:]:
+                    self.items.pop(other)
+                    item.reviewed = False
+                if len(indexes) == len(item.records) and not existing[1:]:
+                    continue
+                item.records = indexes
+                merged = merge_records(self.records, indexes)
+                if item.reviewed:
+                    # Keep what the reviewer confirmed; only the list of documents grows
+                    item.party.source_documents = merged.source_documents
+                else:
+                    item.party = merged
+        self._notify()
+
+    def _new_item(self, indexes: List[int]) -> None:
+        # Propose roles in order of appearance; the reviewer corrects them
+        proposed = self.roles[len(self.items) % len(self.roles)] if self.roles else None
+        item = ReviewItem(id=self._next_id, party=merge_records(self.records, indexes), role=proposed, records=indexes)
+        self.items[item.id] = item
+        self._next_id += 1
+
+    async def feed(self, extracted: Stream) -> None:
+        """Fill the queue from a stream of (document, PII list) pairs, then close it."""
+        self._loop = asyncio.get_running_loop()
+        try:
+            async for document, pii_list in extracted:
+                self.add(document, pii_list)
+        finally:
+            self.close()
+
+    def set_roles(self, roles: Optional[List[str]]) -> None:
+        """Propose roles for everyone on screen once they are known; those people are reviewed again."""
+        with self._lock:
+            self.roles = roles or []
+            self.roles_version += 1
+            for index, item in enumerate(self.items.values()):
+                if self.roles and item.role not in self.roles:
+                    item.role = self.roles[index % len(self.roles)]
+                    item.reviewed = False
+        self._notify()
+
+    async def feed_roles(self, roles: Stream) -> None:
+        """Take the role list from a stream that yields it once the contract type is known."""
+        try:
+            async for proposed in roles:
+                self.set_roles(proposed)
+        finally:
+            with self._lock:
+                self.awaiting_roles = False
+            self._notify()
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+        self._notify()
+
+    def _notify(self) -> None:
+        if self._loop is None:
+            self._changed.set()
+        else:
+            self._loop.call_soon_threadsafe(self._changed.set)
+
+    async def wait_for_change(self) -> None:
+        self._changed.clear()
+        await self._changed.wait()
+
+    def snapshot(self) -> List[ReviewItem]:
+        with self._lock:
+            return [item.model_copy(deep=True) for item in self.items.values()]
+
+    def edit(self, item_id: int, field: str, value: str = "") -> Optional[str]:
+        """Apply one correction; returns an error message for the reviewer, or None."""
+        with self._lock:
+            item = self.items.get(item_id)
+            if item is None:
+                return f"No item {item_id}"
+            if field == "name" and value.strip():
+                item.party.name = value.strip()
+            elif field == "address" and value.strip():
+                item.party.address = value.strip()
+            elif field == "role":
+                if value.isdigit() and 1 <= int(value) <= len(self.roles):
+                    item.role = self.roles[int(value) - 1]
+                elif value in self.roles:
+                    item.role = value
+                else:
+                    return f"Role must be a number between 1 and {len(self.roles)}"
+            elif field in ("drop", "keep"):
+                item.dropped = field == "drop"
+            else:
+                return f"Unknown edit '{field}'"
+        return None
+
+    def accept(self, item_ids: List[int]) -> None:
+        with self._lock:
+            for item_id in item_ids:
+                if item_id in self.items:
+                    self.items[item_id].reviewed = True
+        self._notify()
+
+    @property
+    def done(self) -> bool:
+        with self._lock:
+            return self.closed and not self.awaiting_roles and all(item.reviewed for item in self.items.values())
+
+    def result(self) -> Tuple[List[ResolvedParty], Optional[ContractParties]]:
+        """Verified people and, when roles were reviewed, the contract parties."""
+        kept = [item for item in self.snapshot() if not item.dropped]
+        parties = None
+        if self.roles:
+            parties = ContractParties(parties=[ContractParty(name=item.party.name, roles=[item.role]) for item in kept if item.role])
+        return [item.party for item in kept], parties
+
+
+def render_terminal(queue: ReviewQueue, items: List[ReviewItem]) -> str:
+    lines = []
+    if queue.roles:
+        lines.append("Roles: " + ", ".join(f"{i}. {role}" for i, role in enumerate(queue.roles, start=1)))
+    for item in items:
+        status = "dropped" if item.dropped else ("ok" if item.reviewed else "new")
+        role = f" | {item.role}" if queue.roles else ""
+        lines.append(f"{item.id:>3}. [{status}] {item.party.name} | {item.party.address}{role} | found in: {', '.join(item.party.source_documents)}")
+    if not queue.closed:
+        lines.append("More documents are still being extracted.")
+    if queue.awaiting_roles:
+        lines.append("Roles will be proposed once the contract type is known.")
+    return "\n".join(lines)
+
+
+async def review_in_terminal(queue: ReviewQueue, prompt_lock: Optional[asyncio.Lock] = None) -> None:
+    """
+    Show every extracted person on one screen; Enter accepts all of them at once.
+
+    Each prompt holds `prompt_lock`, so other stages prompting in the terminal wait for it.
+    """
+    prompt_lock = prompt_lock or asyncio.Lock()
+    waiting = False
+    while not queue.done:
+        if all(item.reviewed for item in queue.snapshot()):
+            if not waiting:
+                what = "more documents to be extracted" if not queue.closed else "the contract type"
+                print(f"\nWaiting for {what}...")
+                waiting = True
+            await queue.wait_for_change()
+            continue
+        waiting = False
+        async with prompt_lock:
+            # Taken after the lock: another prompt may have changed the queue meanwhile
+            version = queue.roles_version
+            items = queue.snapshot()
+            print("\nPlease review the people found in the documents:")
+            print(render_terminal(queue, items))
+            print(TERMINAL_HELP)
+            # Reading input in a thread keeps extraction running while the reviewer types
+            command = (await asyncio.to_thread(input, "Press Enter to accept everyone shown, or type an edit: ")).strip()
+        if not command:
+            if queue.roles_version != version:
+                print("Roles were proposed while you were reviewing; please check them.")
+                continue
+            queue.accept([item.id for item in items])
+            continue
+        if command.lower() == "r":
+            continue
+        item_id, _, rest = command.partition(" ")
+        field, _, value = rest.strip().partition(" ")
+        if not item_id.isdigit():
+            print("Invalid input. Start an edit with the item number.")
+            continue
+        error = queue.edit(int(item_id), field.lower(), value)
+        if error:
+            print(error)
+
+
+class _ReviewHandler(BaseHTTPRequestHandler):
+    queue: ReviewQueue
+
+    def do_GET(self) -> None:
+        self._respond(self._page())
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        shown = [int(i) for i in form.get("shown", "").split(",") if i.isdigit()]
+        errors = []
+        for item_id in shown:
+            errors += filter(None, [
+                self.queue.edit(item_id, "name", form.get(f"name_{item_id}", "")),
+                self.queue.edit(item_id, "address", form.get(f"address_{item_id}", "")),
+                self.queue.edit(item_id, "drop" if f"drop_{item_id}" in form else "keep"),
+            ])
+            if self.queue.roles and f"role_{item_id}" in form:
+                errors += filter(None, [self.queue.edit(item_id, "role", form[f"role_{item_id}"])])
+        if form.get("roles_version") != str(self.queue.roles_version):
+            errors.append("Roles were proposed while you were reviewing; please check them.")
+        if not errors:
+            self.queue.accept(shown)
+        self._respond(self._page(errors))
+
+    def _page(self, errors: Optional[List[str]] = None) -> str:
+        if self.queue.done:
+            return "<p>Review complete. You can close this page.</p>"
+        version = self.queue.roles_version
+        items = self.queue.snapshot()
+        rows = []
+        for item in items:
+            i = item.id
+            role_cell = ""
+            if self.queue.roles:
+                options = "".join(
+                    f'<option{" selected" if role == item.role else ""}>{html.escape(role)}</option>' for role in self.queue.roles
+                )
+                role_cell = f'<td><select name="role_{i}">{options}</select></td>'
+            rows.append(
+                f'<tr><td>{"ok" if item.reviewed else "new"}</td>'
+                f'<td><input name="name_{i}" value="{html.escape(item.party.name)}"></td>'
+                f'<td><input name="address_{i}" size="50" value="{html.escape(item.party.address)}"></td>{role_cell}'
+                f'<td><input type="checkbox" name="drop_{i}"{" checked" if item.dropped else ""}></td>'
+                f'<td>{html.escape(", ".join(item.party.source_documents))}</td></tr>'
+            )
+        pending = "" if self.queue.closed else '<p>More documents are still being extracted. <a href="/">Refresh</a></p>'
+        if self.queue.awaiting_roles:
+            pending += '<p>Roles will be proposed once the contract type is known. <a href="/">Refresh</a></p>'
+        error_text = "".join(f"<p style='color:red'>{html.escape(e)}</p>" for e in errors or [])
+        role_header = "<th>Role</th>" if self.queue.roles else ""
+        return (
+            "<h2>Review extracted parties</h2>" + error_text + pending
+            + '<form method="post"><table border="1" cellpadding="4">'
+            + f"<tr><th></th><th>Name</th><th>Address</th>{role_header}<th>Drop</th><th>Found in</th></tr>"
+            + "".join(rows) + "</table>"
+            + f'<input type="hidden" name="shown" value="{",".join(str(item.id) for item in items)}">'
+            + f'<input type="hidden" name="roles_version" value="{version}">'
+            + '<p><button type="submit">Confirm all</button></p></form>'
+        )
+
+    def _respond(self, body: str) -> None:
+        data = f"<!doctype html><html><body>{body}</body></html>".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"Review page: {format % args}")
+
+
+async def review_in_browser(queue: ReviewQueue, port: int) -> None:
+    """Serve the review page on localhost until everyone has been confirmed."""
+    handler = type("ReviewHandler", (_ReviewHandler,), {"queue": queue})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"\nReview the extracted parties at http://127.0.0.1:{server.server_port}/")
+    try:
+        while not queue.done:
+            await queue.wait_for_change()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+async def run_review(
+    extracted: Stream,
+    roles: Optional[List[str]] = None,
+    ui: str = "terminal",
+    port: int = 8765,
+    pending_roles: Optional[Stream] = None,
+    prompt_lock: Optional[asyncio.Lock] = None,
+) -> Tuple[List[ResolvedParty], Optional[ContractParties]]:
+    """
+    Review people from a stream of extraction results as they arrive.
+
+    Args:
+        extracted: Stream of (document, PII list) pairs.
+        roles: Contract roles to assign during the review; None to verify identities only.
+        ui: "terminal" or "web".
+        port: Port of the local review page.
+        pending_roles: Stream yielding the roles once the contract type is known; the review
+            starts without them and the reviewer confirms the proposed roles when they arrive.
+        prompt_lock: Held by each terminal prompt, shared with other stages that prompt.
+    """
+    if ui not in ("terminal", "web"):
+        raise ValueError(f"Unsupported review UI: {ui}. Must be 'terminal' or 'web'")
+    queue = ReviewQueue(roles, awaiting_roles=pending_roles is not None)
+    feeders = [asyncio.create_task(queue.feed(extracted))]
+    if pending_roles is not None:
+        feeders.append(asyncio.create_task(queue.feed_roles(pending_roles)))
+    try:
+        if ui == "web":
+            await review_in_browser(queue, port)
+        else:
+            await review_in_terminal(queue, prompt_lock)
+        await asyncio.gather(*feeders)
+    finally:
+        for feeder in feeders:
+            feeder.cancel()
+    return queue.result()
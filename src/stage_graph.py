@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Generic, List, Optional, TypeVar
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Stream(Generic[T]):
+    """
+    Append-only async channel between stages.
+
+    Every consumer iterates over all items from the start, so a stream can feed
+    several downstream stages while its producer is still running.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._items: List[T] = []
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+
+    async def put(self, item: T) -> None:
+        async with self._changed:
+            self._items.append(item)
+            self._changed.notify_all()
+
+    async def close(self, error: Optional[BaseException] = None) -> None:
+        async with self._changed:
+            self._closed = True
+            self._error = error
+            self._changed.notify_all()
+
+    async def __aiter__(self) -> AsyncIterator[T]:
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self._items) or self._closed)
+                if index >= len(self._items):
+                    if self._error:
+                        raise self._error
+                    return
+                item = self._items[index]
+            index += 1
+            yield item
+
+    async def collect(self) -> List[T]:
+        """Wait for the producer to finish and return every item."""
+        return [item async for item in self]
+
+
+class Stage:
+    """
+    A unit of work in the graph.
+
+    Args:
+        name: Stage name, also used for its tracing span.
+        func: Coroutine function called with the declared inputs as keyword arguments.
+        inputs: Values the stage needs. A stream input is passed as soon as its producer starts.
+        outputs: Values the stage produces. With one output the return value is used as is,
+            with several the coroutine must return a dict keyed by output name.
+        streams: Outputs published as a Stream; the stage receives the Stream as a keyword
+            argument to fill, and it is closed automatically when the stage returns.
+        after: Stages that must complete first although no value flows between them
+            (e.g. interactive prompts that must not interleave).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        inputs: Optional[List[str]] = None,
+        outputs: Optional[List[str]] = None,
+        streams: Optional[List[str]] = None,
+        after: Optional[List[str]] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.streams = streams or []
+        self.outputs = (outputs or []) + self.streams
+        self.after = after or []
+
+
+class StageGraph:
+    """Run stages concurrently as soon as their inputs are available."""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        self.producers: Dict[str, Stage] = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"Output '{output}' is produced by both {self.producers[output].name} and {stage.name}")
+                self.producers[output] = stage
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def _validate(self, initial: Dict[str, Any]) -> None:
+        for stage in self.stages.values():
+            for key in stage.inputs:
+                if key not in self.producers and key not in initial:
+                    raise ValueError(f"Stage {stage.name} needs '{key}', which no stage produces")
+            for name in stage.after:
+                if name not in self.stages:
+                    raise ValueError(f"Stage {stage.name} runs after unknown stage '{name}'")
+
+        # Depth-first search for cycles over value and ordering dependencies
+        visiting, done = set(), set()
+
+        def visit(stage: Stage) -> None:
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise ValueError(f"Cycle in stage graph at {stage.name}")
+            visiting.add(stage.name)
+            for key in stage.inputs:
+                if key in self.producers and key not in self.producers[key].streams:
+                    visit(self.producers[key])
+            for name in stage.after:
+                visit(self.stages[name])
+            visiting.discard(stage.name)
+            done.add(stage.name)
+
+        for stage in self.stages.values():
+            visit(stage)
+
+    async def run(self, initial: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Execute the graph and return every produced value (including the initial ones)."""
+        initial = dict(initial or {})
+        self._validate(initial)
+        loop = asyncio.get_running_loop()
+        values: Dict[str, asyncio.Future] = {key: loop.create_future() for key in self.producers}
+        for key, value in initial.items():
+            values.setdefault(key, loop.create_future()).set_result(value)
+        finished: Dict[str, asyncio.Future] = {name: loop.create_future() for name in self.stages}
+        started_at = time.perf_counter()
+
+        async def run_stage(stage: Stage) -> None:
+            streams = {name: Stream(name) for name in stage.streams}
+            for name, stream in streams.items():
+                values[name].set_result(stream)
+            try:
+                for name in stage.after:
+                    await finished[name]
+                kwargs = {key: await values[key] for key in stage.inputs}
+                ready = time.perf_counter()
+                with span(f"stage.{stage.name}"):
+                    result = await stage.func(**kwargs, **streams)
+                self.timings[stage.name] = {
+                    "ready": round(ready - started_at, 4),
+                    "finished": round(time.perf_counter() - started_at, 4),
+                }
+                plain_outputs = [o for o in stage.outputs if o not in streams]
+                if len(plain_outputs) == 1:
+                    values[plain_outputs[0]].set_result(result)
+                elif plain_outputs:
+                    for key in plain_outputs:
+                        values[key].set_result(result[key])
+                for stream in streams.values():
+                    await stream.close()
+                finished[stage.name].set_result(None)
+            except BaseException as e:
+                for stream in streams.values():
+                    await stream.close(e)
+                raise
+
+        tasks = [asyncio.create_task(run_stage(stage), name=f"stage-{stage.name}") for stage in self.stages.values()]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        logger.debug(f"Stage timings: {self.timings}")
+        return {key: future.result() for key, future in values.items() if future.done() and not future.cancelled()}
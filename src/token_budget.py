@@ -0,0 +1,310 @@
+import logging
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+# Context window per model; unknown models fall back to the smallest entry
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128_000,
+    "gpt-4o": 128_000,
+    "gpt-4-turbo-preview": 128_000,
+}
+
+# Model whose tokenizer and window are used when a caller names none
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# A model, or a route of models (ModelRouter.route) a call may escalate through; a budget for a
+# route holds for each of its models: the smallest window and the tokenizer counting the most tokens
+Models = Union[str, Sequence[str]]
+
+# Tokens kept free for the completion when a call has no explicit prompt limit
+DEFAULT_COMPLETION_RESERVE = 4_096
+
+# Per-message formatting overhead of the chat format
+TOKENS_PER_MESSAGE = 4
+
+# Separates pages in extracted PDF text
+PAGE_BREAK = "\f"
+
+TRUNCATE, CHUNK, FAIL = "truncate", "chunk", "fail"
+POLICIES = (TRUNCATE, CHUNK, FAIL)
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised when a request or job would go over its token budget under the 'fail' policy."""
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The encoding files are downloaded on first use, which fails on offline hosts
+        logger.warning(f"Could not load tiktoken encoding for {model}, estimating token counts: {e}")
+        return None
+
+
+def _model_list(model: Models) -> List[str]:
+    return [model] if isinstance(model, str) else list(model)
+
+
+def _count(text: str, model: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def binding_model(text: str, model: Models) -> str:
+    """The model of a route whose tokenizer counts the most tokens for text."""
+    models = _model_list(model)
+    if len(models) == 1:
+        return models[0]
+    # Models sharing an encoding count alike, so text is encoded once per encoding
+    by_encoding = {id(_encoding(name)): name for name in reversed(models)}
+    return max(by_encoding.values(), key=lambda name: _count(text, name))
+
+
+def count_tokens(text: str, model: Models = DEFAULT_MODEL) -> int:
+    """Count tokens locally (for a route, the most any of its models counts); without tiktoken, estimate at four characters per token."""
+    return _count(text, binding_model(text, model))
+
+
+def count_message_tokens(messages: List[Dict[str, Any]], model: Models = DEFAULT_MODEL) -> int:
+    return sum(count_tokens(str(m.get("content") or ""), model) + TOKENS_PER_MESSAGE for m in messages) + 3
+
+
+def context_window(model: str) -> int:
+    for name in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_CONTEXT_WINDOWS[name]
+    return min(MODEL_CONTEXT_WINDOWS.values())
+
+
+def prompt_limit(model: Models, max_prompt_tokens: Optional[int] = None) -> int:
+    """The tightest of the per-call limit and the (smallest) context window minus the completion reserve."""
+    window = min(context_window(name) for name in _model_list(model)) - DEFAULT_COMPLETION_RESERVE
+    return min(max_prompt_tokens, window) if max_prompt_tokens else window
+
+
+def truncate_text(text: str, max_tokens: int, model: Models = DEFAULT_MODEL) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding(binding_model(text, model))
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def split_text(text: str, max_tokens: int, model: Models = DEFAULT_MODEL, overlap: int = 0) -> List[str]:
+    """Split text into pieces of at most max_tokens, each repeating `overlap` tokens of the previous one."""
+    encoding = _encoding(binding_model(text, model))
+    if encoding is None:
+        size, step = max_tokens * 4, max(1, (max_tokens - overlap) * 4)
+        return [text[i:i + size] for i in range(0, max(len(text), 1), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    step = max(1, max_tokens - overlap)
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, max(len(tokens), 1), step)]
+
+
+def tail_text(text: str, max_tokens: int, model: Models = DEFAULT_MODEL) -> str:
+    """The last max_tokens of text."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding(binding_model(text, model))
+    if encoding is None:
+        return text[-max_tokens * 4:]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[-max_tokens:])
+
+
+def _units(text: str) -> Iterator[str]:
+    """Pages when the text has page breaks, else paragraphs, one at a time."""
+    separator = PAGE_BREAK if PAGE_BREAK in text else "\n\n"
+    start = 0
+    while start <= len(text):
+        end = text.find(separator, start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end]
+        start = end + len(separator)
+
+
+def page_chunks(text: str, max_tokens: int, model: Models = DEFAULT_MODEL, overlap: int = 200) -> Iterator[str]:
+    """
+    Lazily group whole pages (or paragraphs) into chunks of at most max_tokens.
+
+    Each chunk after the first starts with the last `overlap` tokens of the previous one, so a
+    name or address cut by a chunk boundary appears whole in one of them. A page too large
+    for one chunk is split with split_text.
+    """
+    overlap = min(overlap, max_tokens // 2)
+    current: List[str] = []
+    size = 0
+    has_content = False
+    for unit in _units(text):
+        tokens = count_tokens(unit, model)
+        pieces = [unit] if tokens <= max_tokens - overlap else split_text(unit, max_tokens - overlap, model, overlap)
+        for piece in pieces:
+            piece_tokens = tokens if len(pieces) == 1 else count_tokens(piece, model)
+            if has_content and size + piece_tokens > max_tokens:
+                chunk = "\n".join(current)
+                yield chunk
+                carry = tail_text(chunk, overlap, model)
+                current, size, has_content = [carry], count_tokens(carry, model), False
+            current.append(piece)
+            size += piece_tokens
+            has_content = has_content or bool(piece.strip())
+    if has_content:
+        yield "\n".join(current)
+
+
+class JobBudget:
+    """Token allowance for one contract job, charged with estimates before calls and actual usage after."""
+
+    def __init__(self, max_tokens: Optional[int] = None):
+        self.max_tokens = max_tokens
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+
+    @property
+    def used(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def check(self, estimated_tokens: int) -> None:
+        if self.max_tokens is not None and self.used + estimated_tokens > self.max_tokens:
+            raise TokenBudgetExceeded(
+                f"Job token budget exhausted: {self.used} used + {estimated_tokens} requested > {self.max_tokens}"
+            )
+
+    def record(self, usage: Any) -> None:
+        if usage is None:
+            return
+        self.calls += 1
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def summary(self) -> Dict[str, Optional[int]]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "max_tokens": self.max_tokens,
+        }
+
+
+_job_budget: ContextVar[Optional[JobBudget]] = ContextVar("job_budget", default=None)
+
+
+def start_job_budget(max_tokens: Optional[int] = None) -> JobBudget:
+    """Attach a fresh budget to the current context (one per contract job)."""
+    budget = JobBudget(max_tokens)
+    _job_budget.set(budget)
+    return budget
+
+
+def current_job_budget() -> Optional[JobBudget]:
+    return _job_budget.get()
+
+
+def record_usage(usage: Any) -> None:
+    """Charge actual usage from a response to the current job."""
+    budget = _job_budget.get()
+    if budget:
+        budget.record(usage)
+
+
+def budget_text(
+    text: str,
+    overhead_tokens: int,
+    model: Models = DEFAULT_MODEL,
+    max_prompt_tokens: Optional[int] = None,
+    policy: str = FAIL,
+    overlap: int = 200,
+) -> List[str]:
+    """
+    Fit a variable-size input (a document, a template) into the prompt budget.
+
+    Args:
+        text: The part of the prompt that can be shortened or split.
+        overhead_tokens: Tokens of the fixed remainder of the prompt.
+        model: The model receiving the prompt, or the route of models it may escalate through.
+        policy: What to do when it does not fit: truncate it, chunk it into several
+            requests, or fail fast with TokenBudgetExceeded.
+
+    Returns:
+        List[str]: One piece per request to send (a single item unless chunked).
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Invalid token budget policy: {policy}. Must be one of {', '.join(POLICIES)}")
+    available = prompt_limit(model, max_prompt_tokens) - overhead_tokens
+    needed = count_tokens(text, model)
+    if needed <= available:
+        pieces = [text]
+    elif available <= overlap:
+        raise TokenBudgetExceeded(f"Prompt overhead of {overhead_tokens} tokens leaves no room for the input")
+    elif policy == TRUNCATE:
+        logger.warning(f"Truncating input from {needed} to {available} tokens")
+        pieces = [truncate_text(text, available, model)]
+    elif policy == CHUNK:
+        pieces = split_text(text, available, model, overlap)
+        logger.info(f"Splitting input of {needed} tokens into {len(pieces)} chunks")
+    else:
+        raise TokenBudgetExceeded(f"Input of {needed} tokens exceeds the available {available} prompt tokens")
+
+    budget = _job_budget.get()
+    if budget:
+        budget.check(sum(count_tokens(p, model) for p in pieces) + overhead_tokens * len(pieces))
+    return pieces
+
+
+def guard_messages(
+    messages: List[Dict[str, Any]],
+    model: Models = DEFAULT_MODEL,
+    max_prompt_tokens: Optional[int] = None,
+    policy: str = FAIL,
+) -> List[Dict[str, Any]]:
+    """
+    Check a complete request against the call and job budgets before sending it.
+
+    With the truncate policy the longest message is shortened; chunking is not
+    possible at this level, so it behaves like fail.
+    """
+    total = count_message_tokens(messages, model)
+    limit = prompt_limit(model, max_prompt_tokens)
+    if total > limit:
+        if policy != TRUNCATE:
+            raise TokenBudgetExceeded(f"Request of {total} tokens exceeds the limit of {limit} for {'/'.join(_model_list(model))}")
+        longest = max(range(len(messages)), key=lambda i: len(str(messages[i].get("content") or "")))
+        content = str(messages[longest].get("content") or "")
+        keep = count_tokens(content, model) - (total - limit)
+        logger.warning(f"Truncating request from {total} to {limit} tokens")
+        messages = [dict(m) for m in messages]
+        messages[longest]["content"] = truncate_text(content, keep, model)
+        total = count_message_tokens(messages, model)
+
+    budget = _job_budget.get()
+    if budget:
+        budget.check(total)
+    return messages
+
+
+def track_usage(client: Any) -> Any:
+    """Charge the actual usage of every completion made through an instructor client to the current job."""
+
+    def on_response(response: Any) -> None:
+        record_usage(getattr(response, "usage", None))
+
+    client.on("completion:response", on_response)
+    return client
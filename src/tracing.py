@@ -0,0 +1,249 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+# USD per one million tokens (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo-preview": (10.00, 30.00),
+}
+
+
+class Span(BaseModel):
+    name: str
+    trace_id: str
+    span_id: str = Field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+    started_at: Optional[float] = None
+    ended_at: Optional[float] = None
+    attributes: Dict[str, Any] = Field(default_factory=dict)
+    model: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+    cache_hits: int = 0
+    error: Optional[str] = None
+
+    def mark_started(self) -> None:
+        """Mark the moment work actually began (e.g. inside a worker thread)."""
+        if self.started_at is None:
+            self.started_at = time.time()
+
+    @property
+    def queue_wait(self) -> float:
+        return (self.started_at or self.created_at) - self.created_at
+
+    @property
+    def wall_time(self) -> float:
+        return (self.ended_at or time.time()) - (self.started_at or self.created_at)
+
+    @property
+    def cost(self) -> float:
+        model = self.model or ""
+        # Responses report dated snapshots such as "gpt-4o-mini-2024-07-18"
+        prefix = next((name for name in sorted(MODEL_PRICES, key=len, reverse=True) if model.startswith(name)), None)
+        prompt_price, completion_price = MODEL_PRICES.get(prefix, (0.0, 0.0))
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1_000_000
+
+    def record_usage(self, usage: Any, model: Optional[str] = None) -> None:
+        """Add token usage from an OpenAI response to this span."""
+        if model:
+            self.model = model
+        if usage is not None:
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def to_record(self) -> Dict[str, Any]:
+        record = self.model_dump(exclude={"created_at"})
+        record.update(
+            queue_wait=round(self.queue_wait, 6),
+            wall_time=round(self.wall_time, 6),
+            cost_usd=round(self.cost, 8),
+        )
+        return record
+
+
+class JSONLExporter:
+    """
+    Append finished spans to a JSON Lines file.
+
+    export() only queues the record; a background thread writes it, like the logging
+    QueueListener, so spans ending on the event loop do no disk I/O there.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Opened here so a bad path fails at startup rather than in the writer thread
+        self._file = open(path, "a", encoding="utf-8")
+        self._records: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write, name="span-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def export(self, span: Span) -> None:
+        self._records.put(span.to_record())
+
+    def _write(self) -> None:
+        with self._file as f:
+            while True:
+                record = self._records.get()
+                if record is None:
+                    return
+                try:
+                    f.write(json.dumps(record, default=str) + "\n")
+                except Exception as e:
+                    logger.warning(f"Span export failed in JSONLExporter: {e}")
+                if self._records.empty():
+                    f.flush()
+
+    def close(self) -> None:
+        """Write the queued spans and stop the writer thread."""
+        if self._writer.is_alive():
+            self._records.put(None)
+            self._writer.join()
+
+
+class OpenTelemetryExporter:
+    """Forward finished spans to the globally configured OpenTelemetry tracer provider."""
+
+    def __init__(self, service_name: str = "contract-automation"):
+        from opentelemetry import trace
+
+        self._tracer = trace.get_tracer(service_name)
+
+    def export(self, span: Span) -> None:
+        otel_span = self._tracer.start_span(span.name, start_time=int((span.started_at or span.created_at) * 1e9))
+        otel_span.set_attribute("trace.id", span.trace_id)
+        otel_span.set_attribute("queue_wait", span.queue_wait)
+        otel_span.set_attribute("tokens.prompt", span.prompt_tokens)
+        otel_span.set_attribute("tokens.completion", span.completion_tokens)
+        otel_span.set_attribute("retries", span.retries)
+        otel_span.set_attribute("cache_hits", span.cache_hits)
+        otel_span.set_attribute("cost_usd", span.cost)
+        if span.model:
+            otel_span.set_attribute("model", span.model)
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, value if isinstance(value, (str, int, float, bool)) else str(value))
+        otel_span.end(end_time=int((span.ended_at or time.time()) * 1e9))
+
+
+class Tracer:
+    def __init__(self):
+        self.exporters: List[Any] = []
+        # SamplingProfiler installed by profiling.configure_profiling; None when profiling is off
+        self.profiler: Optional[Any] = None
+
+    def add_exporter(self, exporter: Any) -> None:
+        self.exporters.append(exporter)
+
+    def export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning(f"Span export failed in {type(exporter).__name__}: {e}")
+
+
+tracer = Tracer()
+
+_current_trace: ContextVar[Optional[str]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def configure_tracing(jsonl_path: Optional[str] = None, otel: bool = False) -> None:
+    """Install the JSONL exporter and, if requested and available, the OpenTelemetry exporter."""
+    if jsonl_path:
+        tracer.add_exporter(JSONLExporter(jsonl_path))
+    if otel:
+        try:
+            tracer.add_exporter(OpenTelemetryExporter())
+        except ImportError:
+            logger.warning("OpenTelemetry export requested but opentelemetry is not installed")
+
+
+def start_trace(trace_id: Optional[str] = None) -> str:
+    """Start a new trace (one per contract job) in the current context."""
+    trace_id = trace_id or uuid.uuid4().hex
+    _current_trace.set(trace_id)
+    return trace_id
+
+
+def current_trace_id() -> Optional[str]:
+    return _current_trace.get()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, started: bool = True, **attributes: Any) -> Iterator[Span]:
+    """
+    Time a pipeline stage and export it when the block exits.
+
+    Pass started=False when the work is queued (e.g. to a thread pool) and call
+    Span.mark_started() once it actually runs, so queue wait is recorded separately.
+    """
+    parent = _current_span.get()
+    trace_id = _current_trace.get() or start_trace()
+    current = Span(name=name, trace_id=trace_id, parent_id=parent.span_id if parent else None, attributes=attributes)
+    if started:
+        current.mark_started()
+    token = _current_span.set(current)
+    profiler = tracer.profiler
+    window = profiler.enter(name, trace_id) if profiler else None
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.ended_at = time.time()
+        _current_span.reset(token)
+        if window:
+            profiler.exit(window)
+        tracer.export(current)
+
+
+def record_cache_hit() -> None:
+    current = _current_span.get()
+    if current:
+        current.cache_hits += 1
+
+
+def instrument_client(client: Any) -> Any:
+    """Attach instructor hooks that record model, token usage and retries on the active span."""
+
+    def on_kwargs(*args: Any, **kwargs: Any) -> None:
+        current = _current_span.get()
+        if current and kwargs.get("model"):
+            current.model = kwargs["model"]
+
+    def on_response(response: Any) -> None:
+        current = _current_span.get()
+        if current:
+            current.record_usage(getattr(response, "usage", None), getattr(response, "model", None))
+
+    def on_error(error: Exception) -> None:
+        current = _current_span.get()
+        if current:
+            current.retries += 1
+
+    client.on("completion:kwargs", on_kwargs)
+    client.on("completion:response", on_response)
+    client.on("completion:error", on_error)
+    client.on("parse:error", on_error)
+    return client
@@ -0,0 +1,222 @@
+"""
+Queue worker for headless contract jobs.
+
+Run as many workers as needed (on one host with the SQLite queue); each
+leases jobs, keeps its leases alive while they run, and retries or dead-letters
+failures. Jobs of a worker that crashes are picked up by the others once their
+lease runs out.
+
+    rye run python src/worker.py enqueue --documents data/id1.jpg data/id2.pdf --contract-type buy-sell
+    rye run python src/worker.py run --concurrency 4
+    rye run python src/worker.py status
+    rye run python src/worker.py requeue <job id>
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from config import (
+    JOB_BACKOFF_BASE,
+    JOB_BACKOFF_MAX,
+    JOB_DEADLINE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_QUEUE_URL,
+    JOB_VISIBILITY_TIMEOUT,
+    MAX_TOKENS_PER_JOB,
+    PROFILE,
+    PROFILE_FOLDER,
+    PROFILE_INTERVAL_MS,
+    PROFILE_SECONDS,
+    TRACE_FILE,
+    TRACE_OTEL,
+    WORKER_CONCURRENCY,
+    WORKER_POLL_INTERVAL,
+)
+from contract_client import add_contract_arguments, contract_payload
+from deadlines import deadline
+from document_processing import start_ocr_workers
+from job_queue import DEAD, Job, JobQueue, LeaseLost, PermanentJobError, open_queue
+from jobs import JOB_HANDLERS
+from output_writer import shutdown_render_pool
+from profiling import add_profile_arguments, configure_profiling
+from model_router import routing_report, start_job_routing
+from token_budget import start_job_budget
+from tracing import configure_tracing, span, start_trace
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+class Worker:
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Optional[Dict[str, Handler]] = None,
+        concurrency: int = WORKER_CONCURRENCY,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        poll_interval: float = WORKER_POLL_INTERVAL,
+        worker_id: Optional[str] = None,
+    ):
+        self.queue = queue
+        self.handlers = handlers or JOB_HANDLERS
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.tasks: Set[asyncio.Task] = set()
+        self.stopping = asyncio.Event()
+
+    async def _heartbeat(self, job: Job, task: asyncio.Task) -> None:
+        """Extend the lease well before it expires; if another worker has taken the job, stop running it."""
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            try:
+                await asyncio.to_thread(self.queue.extend, job, self.visibility_timeout)
+            except LeaseLost as e:
+                logger.warning(str(e))
+                task.cancel()
+                return
+
+    async def _run(self, job: Job) -> None:
+        start_trace(job.id)
+        budget = start_job_budget(MAX_TOKENS_PER_JOB)
+        routes = start_job_routing()
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            await asyncio.to_thread(self.queue.fail, job, f"No handler for job kind {job.kind}", permanent=True)
+            logger.error(f"Dead-lettered job {job.id}: no handler for kind {job.kind}")
+            return
+
+        task = asyncio.current_task()
+        heartbeat = asyncio.create_task(self._heartbeat(job, task))
+        try:
+            with span("job", kind=job.kind, job_id=job.id, attempt=job.attempts), deadline(JOB_DEADLINE_SECONDS):
+                result = await handler(job.payload)
+            await asyncio.to_thread(self.queue.complete, job, result)
+            logger.info(f"Completed job {job.id} (attempt {job.attempts})")
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                raise
+            # Cancelled by the heartbeat: the lease belongs to another worker now, so record nothing
+            logger.warning(f"Abandoned job {job.id} after losing its lease")
+        except LeaseLost as e:
+            logger.warning(str(e))
+        except Exception as e:
+            permanent = isinstance(e, PermanentJobError)
+            try:
+                status = await asyncio.to_thread(self.queue.fail, job, f"{type(e).__name__}: {e}", permanent=permanent)
+            except LeaseLost as lost:
+                logger.warning(str(lost))
+                return
+            if status == DEAD:
+                logger.error(f"Dead-lettered job {job.id} after {job.attempts} attempt(s): {e}", exc_info=True)
+            else:
+                logger.warning(f"Job {job.id} failed (attempt {job.attempts} of {job.max_attempts}), will retry: {e}")
+        finally:
+            heartbeat.cancel()
+            logger.info(f"Token usage for job {job.id}: {budget.summary()}")
+            logger.info(f"Model routing for job {job.id}: {routing_report(routes)}")
+
+    async def run(self, once: bool = False) -> None:
+        """Lease and run jobs until stopped; with once=True, drain the jobs visible now and stop."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        slots = asyncio.Semaphore(self.concurrency)
+        try:
+            while not self.stopping.is_set():
+                await slots.acquire()
+                # Queue calls can wait on another worker's write lock; keep them off the loop and its heartbeats
+                job = await asyncio.to_thread(self.queue.lease, self.worker_id, self.visibility_timeout)
+                if job is None:
+                    slots.release()
+                    if once and not self.tasks:
+                        break
+                    try:
+                        await asyncio.wait_for(self.stopping.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                logger.info(f"Leased job {job.id} ({job.kind}, attempt {job.attempts} of {job.max_attempts})")
+                task = asyncio.create_task(self._run(job))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            # Finish what is running; jobs of a worker killed outright are re-leased after their timeout
+            if self.tasks:
+                print(f"Waiting for {len(self.tasks)} running job(s) to finish...")
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run or manage queued contract jobs.")
+    parser.add_argument("--queue", default=JOB_QUEUE_URL, help="Job queue URL (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="Lease and run jobs (default)")
+    run.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    run.add_argument("--worker-id", default=None)
+    run.add_argument("--once", action="store_true", help="Run the jobs visible now and exit")
+    add_profile_arguments(run, PROFILE, PROFILE_SECONDS)
+
+    enqueue = commands.add_parser("enqueue", help="Queue a contract job")
+    add_contract_arguments(enqueue)
+    enqueue.add_argument("--max-attempts", type=int, default=JOB_MAX_ATTEMPTS)
+
+    status = commands.add_parser("status", help="Show job counts, or the jobs with one status")
+    status.add_argument("status", nargs="?", default=None)
+
+    requeue = commands.add_parser("requeue", help="Give a dead-lettered job a fresh set of attempts")
+    requeue.add_argument("job_ids", nargs="+")
+    args = parser.parse_args()
+
+    queue = open_queue(args.queue, backoff_base=JOB_BACKOFF_BASE, backoff_max=JOB_BACKOFF_MAX)
+    try:
+        if args.command == "enqueue":
+            print(f"Queued job {queue.enqueue('contract', contract_payload(args), max_attempts=args.max_attempts)}")
+        elif args.command == "status":
+            if args.status:
+                for job in queue.list(args.status):
+                    print(f"{job.id} {job.kind} attempts={job.attempts}/{job.max_attempts} {job.error or ''}")
+            else:
+                print(json.dumps(queue.counts()))
+        elif args.command == "requeue":
+            for job_id in args.job_ids:
+                print(f"{job_id}: {'requeued' if queue.requeue(job_id) else 'not a dead-lettered job'}")
+        else:
+            # Before tracing, profiling or the event loop start any threads
+            start_ocr_workers()
+            configure_tracing(TRACE_FILE, otel=TRACE_OTEL)
+            configure_profiling(
+                getattr(args, "profile", PROFILE).split(","),
+                getattr(args, "profile_seconds", PROFILE_SECONDS),
+                PROFILE_INTERVAL_MS,
+                PROFILE_FOLDER,
+            )
+            worker = Worker(
+                queue,
+                concurrency=getattr(args, "concurrency", WORKER_CONCURRENCY),
+                worker_id=getattr(args, "worker_id", None),
+            )
+            print(f"Worker {worker.worker_id} polling {args.queue}")
+            try:
+                asyncio.run(worker.run(once=getattr(args, "once", False)))
+            finally:
+                shutdown_render_pool()
+                print(f"Queue status: {queue.counts()}")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()